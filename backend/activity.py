@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Rolling-window activity counters.
+
+Activity is counted per (kind, key) in hourly buckets, e.g. predictions per
+group or per category. "How many in the last 24 hours" is the sum of the 24
+most recent buckets instead of a scan of the predictions table.
+
+Buckets older than COMPACT_AFTER are merged into one bucket per day and
+buckets older than RETENTION are dropped, so each key keeps at most a few
+dozen rows. Windows that reach past COMPACT_AFTER are therefore counted to
+the day, which is plenty for trending.
+
+Bucket starts are naive UTC, like `datetime.utcnow()`. Every function here
+that takes a moment converts timezone-aware ones (Prediction.timestamp is
+timestamptz on Postgres) with `naive_utc`, so callers can pass either.
+
+Predictions are counted in and out from their `prediction_created` and
+`prediction_deleted` outbox events, off the request path. Compaction runs at
+most once per COMPACT_INTERVAL per process as a background task after
+writes, and can be run by hand:
+
+    python activity.py
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import String, cast, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+import outbox
+from database import SessionLocal
+from models import ActivityBucket, Visibility
+
+logger = logging.getLogger(__name__)
+
+# Counter kinds
+GROUP_PREDICTIONS = "group_predictions"
+CATEGORY_PREDICTIONS = "category_predictions"
+
+BUCKET_SIZE = timedelta(hours=1)
+COMPACT_AFTER = timedelta(days=2)
+RETENTION = timedelta(days=31)
+COMPACT_INTERVAL = 3600  # seconds
+
+WINDOWS = {"24h": timedelta(days=1), "7d": timedelta(days=7), "30d": timedelta(days=30)}
+
+_last_compaction = 0.0
+_compaction_lock = threading.Lock()
+
+
+def naive_utc(moment: datetime) -> datetime:
+    """`moment` as naive UTC; naive datetimes are taken to be UTC already."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _floor_hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _floor_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_for(moment: datetime, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Start of the bucket that counts `moment`, or None if it is past retention."""
+    moment = naive_utc(moment)
+    now = naive_utc(now) if now else datetime.utcnow()
+    if moment < now - RETENTION:
+        return None
+    if moment < _floor_hour(now) - COMPACT_AFTER:
+        return _floor_day(moment)
+    return _floor_hour(moment)
+
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(ActivityBucket)
+    if dialect == "sqlite":
+        return sqlite.insert(ActivityBucket)
+    raise NotImplementedError(f"Activity counters do not support {dialect}")
+
+
+def record(
+    db: Session,
+    kind: str,
+    key,
+    moment: Optional[datetime] = None,
+    delta: int = 1,
+    now: Optional[datetime] = None,
+) -> None:
+    """Add `delta` to the bucket of `key` that covers `moment` (default: now).
+
+    Runs inside the caller's transaction; pass delta=-1 when the activity is undone.
+    """
+    now = naive_utc(now) if now else datetime.utcnow()
+    bucket_start = bucket_for(moment or now, now)
+    if bucket_start is None:
+        return
+    statement = _upsert(db).values(kind=kind, key=str(key), bucket_start=bucket_start, count=delta)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ActivityBucket.kind, ActivityBucket.key, ActivityBucket.bucket_start],
+        set_={"count": ActivityBucket.count + statement.excluded.count},
+    )
+    db.execute(statement)
+
+
+def forget(db: Session, kind: str, key) -> None:
+    """Drop every bucket of `key`, e.g. when the group it counts is deleted."""
+    db.query(ActivityBucket).filter(
+        ActivityBucket.kind == kind, ActivityBucket.key == str(key)
+    ).delete(synchronize_session=False)
+
+
+def window_start(window: timedelta, now: Optional[datetime] = None) -> datetime:
+    """First bucket inside a window that ends with the current hour."""
+    now = naive_utc(now) if now else datetime.utcnow()
+    return _floor_hour(now) - window + BUCKET_SIZE
+
+
+def key_column(column):
+    """`column` as a counter key, for joining `window_totals` to integer ids."""
+    return cast(column, String)
+
+
+def window_totals(db: Session, kind: str, window: timedelta, keys: Optional[Iterable] = None):
+    """Subquery of (key, total) over `window`, with one row per key that had activity.
+
+    `keys` narrows it to some keys, either as values or as a select of them.
+    Join it against the counted table (see `key_column`); keys without
+    activity have no row.
+    """
+    query = db.query(
+        ActivityBucket.key.label("key"),
+        func.sum(ActivityBucket.count).label("total"),
+    ).filter(
+        ActivityBucket.kind == kind,
+        ActivityBucket.bucket_start >= window_start(window),
+    )
+    if isinstance(keys, Select):
+        query = query.filter(ActivityBucket.key.in_(keys))
+    elif keys is not None:
+        query = query.filter(ActivityBucket.key.in_([str(key) for key in keys]))
+    return query.group_by(ActivityBucket.key).subquery()
+
+
+def top(db: Session, kind: str, window: timedelta, limit: int = 10) -> list:
+    """The `limit` busiest keys over `window` as (key, total) pairs."""
+    totals = window_totals(db, kind, window)
+    return db.query(totals.c.key, totals.c.total).filter(totals.c.total > 0).order_by(
+        totals.c.total.desc(), totals.c.key
+    ).limit(limit).all()
+
+
+def compact(db: Session, now: Optional[datetime] = None) -> int:
+    """Merge hourly buckets older than COMPACT_AFTER into daily ones and drop expired buckets.
+
+    Returns the number of rows removed.
+    """
+    now = naive_utc(now) if now else datetime.utcnow()
+    removed = db.query(ActivityBucket).filter(
+        ActivityBucket.bucket_start < now - RETENTION
+    ).delete(synchronize_session=False)
+
+    # Rows another worker is compacting are locked and left to it
+    cutoff = _floor_hour(now) - COMPACT_AFTER
+    hourly = db.query(ActivityBucket).filter(
+        ActivityBucket.bucket_start < cutoff
+    ).with_for_update(skip_locked=True).all()
+    days = defaultdict(int)
+    for bucket in hourly:
+        day = _floor_day(bucket.bucket_start)
+        if bucket.bucket_start == day:
+            continue
+        days[(bucket.kind, bucket.key, day)] += bucket.count
+        db.delete(bucket)
+        removed += 1
+    db.flush()
+
+    for (kind, key, day), total in days.items():
+        record(db, kind, key, day, delta=total, now=now)
+    db.commit()
+    return removed
+
+
+def compact_if_due() -> None:
+    """Compact in a fresh session unless this process did so within COMPACT_INTERVAL."""
+    global _last_compaction
+    with _compaction_lock:
+        if time.monotonic() - _last_compaction < COMPACT_INTERVAL:
+            return
+        _last_compaction = time.monotonic()
+    db = SessionLocal()
+    try:
+        removed = compact(db)
+        logger.info("Compacted activity buckets, %s rows removed", removed)
+    finally:
+        db.close()
+
+
+def _count_prediction(delivery: outbox.Delivery) -> None:
+    """Count a prediction for its group and, if it is public, for its category; a deletion takes it back."""
+    # From the event, not the row: the prediction may be gone by the time its event is handled
+    payload = delivery.payload
+    moment = datetime.fromisoformat(payload["timestamp"])
+    delta = -1 if delivery.kind == "prediction_deleted" else 1
+    if payload["group_id"]:
+        record(delivery.db, GROUP_PREDICTIONS, payload["group_id"], moment, delta)
+    if payload["visibility"] == Visibility.PUBLIC.value:
+        record(delivery.db, CATEGORY_PREDICTIONS, payload["category"], moment, delta)
+
+
+outbox.register("prediction_created", _count_prediction)
+outbox.register("prediction_deleted", _count_prediction)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        print(f"Removed {compact(session)} activity bucket rows.")
+    finally:
+        session.close()
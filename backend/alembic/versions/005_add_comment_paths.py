@@ -0,0 +1,84 @@
+"""Add materialized paths to comments
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Comments were originally created by Base.metadata.create_all, so a
+    # database built only from migrations may not have them yet.
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'comments' not in tables:
+        op.create_table('comments',
+            sa.Column('comment_id', sa.Integer(), nullable=False),
+            sa.Column('prediction_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('parent_comment_id', sa.Integer(), nullable=True),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.ForeignKeyConstraint(['prediction_id'], ['predictions.prediction_id'], ),
+            sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+            sa.ForeignKeyConstraint(['parent_comment_id'], ['comments.comment_id'], ),
+            sa.PrimaryKeyConstraint('comment_id')
+        )
+        op.create_index('ix_comments_comment_id', 'comments', ['comment_id'], unique=False)
+    if 'comment_votes' not in tables:
+        op.create_table('comment_votes',
+            sa.Column('vote_id', sa.Integer(), nullable=False),
+            sa.Column('comment_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('value', sa.Integer(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.ForeignKeyConstraint(['comment_id'], ['comments.comment_id'], ),
+            sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+            sa.PrimaryKeyConstraint('vote_id'),
+            sa.UniqueConstraint('comment_id', 'user_id', name='unique_comment_vote_per_user')
+        )
+        op.create_index('ix_comment_votes_vote_id', 'comment_votes', ['vote_id'], unique=False)
+
+    op.add_column('comments', sa.Column('path', sa.String(collation='C'), nullable=True))
+    op.add_column('comments', sa.Column('depth', sa.Integer(), nullable=True))
+
+    # Backfill every existing thread top-down in a single statement
+    op.execute("""
+        WITH RECURSIVE tree AS (
+            SELECT comment_id,
+                   lpad(comment_id::text, 10, '0') || '/' AS path,
+                   0 AS depth
+            FROM comments
+            WHERE parent_comment_id IS NULL
+            UNION ALL
+            SELECT c.comment_id,
+                   tree.path || lpad(c.comment_id::text, 10, '0') || '/',
+                   tree.depth + 1
+            FROM comments c
+            JOIN tree ON c.parent_comment_id = tree.comment_id
+        )
+        UPDATE comments
+        SET path = tree.path, depth = tree.depth
+        FROM tree
+        WHERE comments.comment_id = tree.comment_id
+    """)
+
+    op.alter_column('comments', 'path', nullable=False)
+    op.alter_column('comments', 'depth', nullable=False)
+    op.create_index('ix_comments_prediction_id_path', 'comments', ['prediction_id', 'path'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_prediction_id_path', table_name='comments')
+    op.drop_column('comments', 'depth')
+    op.drop_column('comments', 'path')
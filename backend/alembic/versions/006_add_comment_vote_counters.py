@@ -0,0 +1,78 @@
+"""Add vote counters and rankings to comments
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('comments', sa.Column('score', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('comments', sa.Column('upvotes', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('comments', sa.Column('downvotes', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('comments', sa.Column('wilson_score', sa.Float(), nullable=False, server_default='0'))
+    op.add_column('comments', sa.Column('controversy_score', sa.Float(), nullable=False, server_default='0'))
+
+    # Backfill the counters from the existing vote rows
+    op.execute("""
+        UPDATE comments
+        SET score = totals.score, upvotes = totals.upvotes, downvotes = totals.downvotes
+        FROM (
+            SELECT comment_id,
+                   sum(value) AS score,
+                   count(*) FILTER (WHERE value > 0) AS upvotes,
+                   count(*) FILTER (WHERE value < 0) AS downvotes
+            FROM comment_votes
+            GROUP BY comment_id
+        ) AS totals
+        WHERE comments.comment_id = totals.comment_id
+    """)
+
+    # Same formulas as comment_threads.wilson_lower_bound and controversy (z = 1.281551565545)
+    op.execute("""
+        UPDATE comments
+        SET wilson_score = (
+                upvotes::float / (upvotes + downvotes)
+                + 1.281551565545 ^ 2 / (2 * (upvotes + downvotes))
+                - 1.281551565545 * sqrt(
+                    (upvotes::float / (upvotes + downvotes) * downvotes / (upvotes + downvotes)
+                     + 1.281551565545 ^ 2 / (4 * (upvotes + downvotes)))
+                    / (upvotes + downvotes))
+            ) / (1 + 1.281551565545 ^ 2 / (upvotes + downvotes)),
+            controversy_score = CASE
+                WHEN upvotes > 0 AND downvotes > 0 THEN
+                    power(upvotes + downvotes,
+                          CASE WHEN upvotes > downvotes THEN downvotes::float / upvotes
+                               ELSE upvotes::float / downvotes END)
+                ELSE 0
+            END
+        WHERE upvotes + downvotes > 0
+    """)
+
+    op.create_index('ix_comments_thread_top', 'comments',
+                    ['prediction_id', 'parent_comment_id', 'wilson_score', 'comment_id'])
+    op.create_index('ix_comments_thread_controversial', 'comments',
+                    ['prediction_id', 'parent_comment_id', 'controversy_score', 'comment_id'])
+    op.create_index('ix_comments_thread_new', 'comments',
+                    ['prediction_id', 'parent_comment_id', 'timestamp', 'comment_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_thread_new', table_name='comments')
+    op.drop_index('ix_comments_thread_controversial', table_name='comments')
+    op.drop_index('ix_comments_thread_top', table_name='comments')
+    op.drop_column('comments', 'controversy_score')
+    op.drop_column('comments', 'wilson_score')
+    op.drop_column('comments', 'downvotes')
+    op.drop_column('comments', 'upvotes')
+    op.drop_column('comments', 'score')
@@ -0,0 +1,65 @@
+"""Cascade deletes at the database level and add tombstones
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+# (table, column, referenced table, referenced column)
+CASCADING_FOREIGN_KEYS = [
+    ('votes', 'prediction_id', 'predictions', 'prediction_id'),
+    ('backings', 'prediction_id', 'predictions', 'prediction_id'),
+    ('comments', 'prediction_id', 'predictions', 'prediction_id'),
+    ('comments', 'parent_comment_id', 'comments', 'comment_id'),
+    ('comment_votes', 'comment_id', 'comments', 'comment_id'),
+    ('predictions', 'group_id', 'groups', 'group_id'),
+    ('group_members', 'group_id', 'groups', 'group_id'),
+]
+
+
+def _replace_foreign_key(table, column, referred_table, referred_column, ondelete):
+    # Older constraints were created unnamed, so look the current name up
+    inspector = sa.inspect(op.get_bind())
+    for foreign_key in inspector.get_foreign_keys(table):
+        if foreign_key['constrained_columns'] == [column] and foreign_key['referred_table'] == referred_table:
+            op.drop_constraint(foreign_key['name'], table, type_='foreignkey')
+    op.create_foreign_key(
+        f'fk_{table}_{column}_{referred_table}',
+        table, referred_table,
+        [column], [referred_column],
+        ondelete=ondelete
+    )
+
+
+def upgrade() -> None:
+    for table, column, referred_table, referred_column in CASCADING_FOREIGN_KEYS:
+        _replace_foreign_key(table, column, referred_table, referred_column, 'CASCADE')
+
+    # Cascades look children up by these columns
+    op.create_index('ix_comments_parent_comment_id', 'comments', ['parent_comment_id'])
+    op.create_index('ix_predictions_group_id', 'predictions', ['group_id'])
+
+    for table in ('predictions', 'comments', 'groups'):
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    for table in ('groups', 'comments', 'predictions'):
+        op.drop_column(table, 'deleted_at')
+
+    op.drop_index('ix_predictions_group_id', table_name='predictions')
+    op.drop_index('ix_comments_parent_comment_id', table_name='comments')
+
+    for table, column, referred_table, referred_column in CASCADING_FOREIGN_KEYS:
+        _replace_foreign_key(table, column, referred_table, referred_column, None)
@@ -0,0 +1,40 @@
+"""Add member and prediction counters to groups
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('groups', sa.Column('member_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('groups', sa.Column('prediction_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill both counters from the existing rows
+    op.execute("""
+        UPDATE groups
+        SET member_count = (SELECT count(*) FROM group_members WHERE group_members.group_id = groups.group_id),
+            prediction_count = (SELECT count(*) FROM predictions WHERE predictions.group_id = groups.group_id)
+    """)
+
+    op.create_index('ix_groups_directory_new', 'groups', ['visibility', 'group_id'])
+    op.create_index('ix_groups_directory_top', 'groups', ['visibility', 'prediction_count', 'group_id'])
+    op.create_index('ix_groups_directory_members', 'groups', ['visibility', 'member_count', 'group_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_groups_directory_members', table_name='groups')
+    op.drop_index('ix_groups_directory_top', table_name='groups')
+    op.drop_index('ix_groups_directory_new', table_name='groups')
+    op.drop_column('groups', 'prediction_count')
+    op.drop_column('groups', 'member_count')
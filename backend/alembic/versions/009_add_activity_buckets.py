@@ -0,0 +1,59 @@
+"""Add hourly activity buckets for trending
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('activity_buckets',
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'key', 'bucket_start')
+    )
+    op.create_index('ix_activity_buckets_kind_bucket_start', 'activity_buckets', ['kind', 'bucket_start'])
+
+    # Backfill the retention window (see activity.py): hourly buckets for the
+    # last two days, daily buckets before that
+    op.execute("""
+        INSERT INTO activity_buckets (kind, key, bucket_start, count)
+        SELECT kind, key, bucket_start, count(*)
+        FROM (
+            SELECT 'group_predictions' AS kind,
+                   group_id::text AS key,
+                   CASE WHEN timestamp >= date_trunc('hour', now()) - interval '2 days'
+                        THEN date_trunc('hour', timestamp AT TIME ZONE 'UTC')
+                        ELSE date_trunc('day', timestamp AT TIME ZONE 'UTC')
+                   END AS bucket_start
+            FROM predictions
+            WHERE group_id IS NOT NULL AND timestamp >= now() - interval '31 days'
+            UNION ALL
+            SELECT 'category_predictions',
+                   category,
+                   CASE WHEN timestamp >= date_trunc('hour', now()) - interval '2 days'
+                        THEN date_trunc('hour', timestamp AT TIME ZONE 'UTC')
+                        ELSE date_trunc('day', timestamp AT TIME ZONE 'UTC')
+                   END
+            FROM predictions
+            WHERE visibility = 'PUBLIC' AND timestamp >= now() - interval '31 days'
+        ) AS activity
+        GROUP BY kind, key, bucket_start
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_activity_buckets_kind_bucket_start', table_name='activity_buckets')
+    op.drop_table('activity_buckets')
@@ -0,0 +1,24 @@
+"""Index predictions by group timeline for the home feed
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_predictions_group_timeline', 'predictions', ['group_id', 'timestamp', 'prediction_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_predictions_group_timeline', table_name='predictions')
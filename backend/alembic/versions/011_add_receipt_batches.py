@@ -0,0 +1,49 @@
+"""Add Merkle receipt batches
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('receipt_batches',
+        sa.Column('batch_id', sa.Integer(), nullable=False),
+        sa.Column('root', sa.String(length=64), nullable=False),
+        sa.Column('leaf_count', sa.Integer(), nullable=False),
+        sa.Column('first_timestamp', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_timestamp', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('sealed_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('batch_id')
+    )
+    op.create_index(op.f('ix_receipt_batches_batch_id'), 'receipt_batches', ['batch_id'], unique=False)
+
+    op.add_column('predictions', sa.Column('receipt_batch_id', sa.Integer(), nullable=True))
+    op.add_column('predictions', sa.Column('receipt_leaf_index', sa.Integer(), nullable=True))
+    op.add_column('predictions', sa.Column('receipt_proof', sa.Text(), nullable=True))
+    op.create_foreign_key('fk_predictions_receipt_batch_id_receipt_batches', 'predictions', 'receipt_batches', ['receipt_batch_id'], ['batch_id'])
+    op.create_index(op.f('ix_predictions_receipt_batch_id'), 'predictions', ['receipt_batch_id'], unique=False)
+    # Existing predictions start out unsealed; `python receipts.py` seals them
+    op.create_index('ix_predictions_unsealed', 'predictions', ['prediction_id'],
+                    postgresql_where=sa.text('receipt_batch_id IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_predictions_unsealed', table_name='predictions')
+    op.drop_index(op.f('ix_predictions_receipt_batch_id'), table_name='predictions')
+    op.drop_constraint('fk_predictions_receipt_batch_id_receipt_batches', 'predictions', type_='foreignkey')
+    op.drop_column('predictions', 'receipt_proof')
+    op.drop_column('predictions', 'receipt_leaf_index')
+    op.drop_column('predictions', 'receipt_batch_id')
+    op.drop_index(op.f('ix_receipt_batches_batch_id'), table_name='receipt_batches')
+    op.drop_table('receipt_batches')
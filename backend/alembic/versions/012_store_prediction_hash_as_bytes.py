@@ -0,0 +1,59 @@
+"""Store prediction hashes as 32-byte digests
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000  # predictions per backfill transaction
+
+# Hashes have always been SHA-256 hex; anything else (e.g. seed data) is
+# replaced by the SHA-256 of the old string so it still fits 32 bytes
+TO_DIGEST = """
+    CASE WHEN hash ~ '^[0-9a-fA-F]{64}$' THEN decode(hash, 'hex')
+         ELSE sha256(convert_to(hash, 'UTF8'))
+    END
+"""
+
+
+def _backfill(expression: str) -> None:
+    """Fill hash_new from `expression` in primary key ranges, one transaction per range."""
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = bind.execute(sa.text("SELECT max(prediction_id) FROM predictions")).scalar() or 0
+        for start in range(0, last_id + 1, BATCH_SIZE):
+            bind.execute(sa.text(f"""
+                UPDATE predictions SET hash_new = {expression}
+                WHERE prediction_id >= :start AND prediction_id < :end AND hash_new IS NULL
+            """), {"start": start, "end": start + BATCH_SIZE})
+
+
+def _swap(expression: str) -> None:
+    """Catch up on rows written during the backfill, then replace the old column."""
+    op.execute(f"UPDATE predictions SET hash_new = {expression} WHERE hash_new IS NULL")
+    op.alter_column('predictions', 'hash_new', nullable=False)
+    op.drop_column('predictions', 'hash')  # Drops its unique constraint too
+    op.alter_column('predictions', 'hash_new', new_column_name='hash')
+    op.create_unique_constraint('uq_predictions_hash', 'predictions', ['hash'])
+
+
+def upgrade() -> None:
+    op.add_column('predictions', sa.Column('hash_new', sa.LargeBinary(length=32), nullable=True))
+    _backfill(TO_DIGEST)
+    _swap(TO_DIGEST)
+
+
+def downgrade() -> None:
+    op.add_column('predictions', sa.Column('hash_new', sa.String(length=255), nullable=True))
+    _backfill("encode(hash, 'hex')")
+    _swap("encode(hash, 'hex')")
@@ -0,0 +1,25 @@
+"""Give each outbox row the one handler it is for
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Rows already waiting keep NULL and run every handler of their kind
+    op.add_column('outbox_events', sa.Column('handler', sa.String(length=200), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox_events', 'handler')
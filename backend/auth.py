@@ -1,12 +1,12 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
 import bcrypt
 from fastapi import HTTPException, status, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from config import settings
 from database import get_db
+import entity_cache
 from models import User
 from schemas import TokenData
 
@@ -29,6 +29,8 @@ def get_password_hash(password: str) -> str:
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token."""
+    from jose import jwt  # Imported on first use; its crypto backend is slow to load
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -42,6 +44,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def verify_token(token: str) -> TokenData:
     """Verify and decode a JWT token."""
+    from jose import JWTError, jwt
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -66,7 +70,7 @@ def get_current_user(
 ) -> User:
     """Get the current authenticated user."""
     token_data = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.user_id == token_data.user_id).first()
+    user = entity_cache.load_user(db, token_data.user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,8 +92,7 @@ def get_current_user_optional(
         if scheme.lower() != 'bearer':
             return None
         token_data = verify_token(token)
-        user = db.query(User).filter(User.user_id == token_data.user_id).first()
-        return user
+        return entity_cache.load_user(db, token_data.user_id)
     except (ValueError, HTTPException):
         # Catches split errors, malformed headers, and invalid tokens
         return None
\ No newline at end of file
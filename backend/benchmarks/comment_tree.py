@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Comment tree benchmark.
+
+Builds a single prediction with a 10k-comment thread and compares walking the
+tree through `parent_comment_id` (one query per level) against reading it
+through the materialized `path` column (one range query).
+
+Usage:
+    python benchmarks/comment_tree.py [--comments 10000] [--database-url URL]
+
+By default it runs against a throwaway SQLite file. Point --database-url at an
+empty Postgres database to measure the real thing; the tables it creates are
+dropped again at the end.
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+from sqlalchemy import create_engine, event, func, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import comment_threads
+from database import Base
+from models import Comment, LoginType, Prediction, User, Visibility
+
+
+def build_thread(db, comment_count: int, seed: int) -> list:
+    """Insert one user, one prediction and a randomly shaped comment thread.
+
+    New comments favour recent parents, which produces the long reply chains
+    real threads have. Returns the generated (comment_id, parent_id) pairs.
+    """
+    rng = random.Random(seed)
+    db.execute(insert(User), [{
+        "user_id": 1, "email": "bench@example.com", "handle": "bench",
+        "login_type": LoginType.PASSWORD, "wisdom_level": 0,
+    }])
+    db.execute(insert(Prediction), [{
+        "prediction_id": 1, "user_id": 1, "title": "Benchmark", "content": "Benchmark",
+        "category": "General", "visibility": Visibility.PUBLIC, "allow_backing": True,
+        "hash": hashlib.sha256(b"benchmark").hexdigest(), "contains_profanity": False,
+    }])
+
+    rows, paths, depths, edges = [], {}, {}, []
+    for comment_id in range(1, comment_count + 1):
+        parent_id = None
+        if comment_id > 1 and rng.random() > 0.05:
+            # Mostly reply to something recent, sometimes to anything
+            window = 50 if rng.random() < 0.8 else comment_id - 1
+            parent_id = rng.randint(max(1, comment_id - window), comment_id - 1)
+        paths[comment_id] = comment_threads.path_for(comment_id, paths.get(parent_id, ""))
+        depths[comment_id] = depths[parent_id] + 1 if parent_id else 0
+        edges.append((comment_id, parent_id))
+        rows.append({
+            "comment_id": comment_id, "prediction_id": 1, "user_id": 1,
+            "parent_comment_id": parent_id, "content": f"Comment {comment_id}",
+            "timestamp": datetime.utcnow(), "path": paths[comment_id], "depth": depths[comment_id],
+        })
+    db.execute(insert(Comment), rows)
+    db.commit()
+    return edges
+
+
+def walk_subtree(db, comment_id: int) -> list:
+    """Subtree ids through parent_comment_id, one query per level."""
+    found, level = [comment_id], [comment_id]
+    while level:
+        level = [row[0] for row in db.query(Comment.comment_id).filter(Comment.parent_comment_id.in_(level))]
+        found.extend(level)
+    return found
+
+
+def range_subtree(db, comment: Comment) -> list:
+    """Subtree ids through the materialized path, one range query."""
+    return [row[0] for row in db.query(Comment.comment_id).filter(comment_threads.in_subtree(comment))]
+
+
+def range_descendant_count(db, comment: Comment) -> int:
+    return db.query(func.count(Comment.comment_id)).filter(
+        Comment.prediction_id == comment.prediction_id,
+        comment_threads.descendants_of(comment.path),
+    ).scalar()
+
+
+def measure(label: str, fn, repeat: int, query_log: list):
+    timings = []
+    for _ in range(repeat):
+        query_log.clear()
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f"  {label:<34} {statistics.median(timings):9.2f} ms  {len(query_log):5d} queries")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkstemp(suffix='.db')[1]}"
+    engine = create_engine(database_url)
+
+    query_log = []
+    event.listen(engine, "before_cursor_execute", lambda *a: query_log.append(a[2]))
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        print(f"Building a {args.comments}-comment thread on {engine.dialect.name}...")
+        started = time.perf_counter()
+        edges = build_thread(db, args.comments, args.seed)
+        print(f"  built in {time.perf_counter() - started:.1f}s, "
+              f"max depth {db.query(func.max(Comment.depth)).scalar()}")
+        if engine.dialect.name == "postgresql":
+            db.execute(text("ANALYZE comments"))
+
+        # Benchmark the root with the largest subtree and one from the middle of it
+        child_count = {}
+        for comment_id, parent_id in edges:
+            child_count[parent_id] = child_count.get(parent_id, 0) + 1
+        roots = [comment_id for comment_id, parent_id in edges if parent_id is None]
+        largest_root = max(roots, key=lambda comment_id: child_count.get(comment_id, 0))
+        root = db.get(Comment, largest_root)
+        middle = db.query(Comment).filter(
+            comment_threads.in_subtree(root), Comment.depth == root.depth + 3
+        ).first() or root
+
+        for label, comment in (("largest thread", root), ("mid-thread comment", middle)):
+            print(f"{label} (comment {comment.comment_id}, depth {comment.depth})")
+            walked = measure("subtree via parent_comment_id", lambda: walk_subtree(db, comment.comment_id), args.repeat, query_log)
+            ranged = measure("subtree via path range", lambda: range_subtree(db, comment), args.repeat, query_log)
+            assert sorted(walked) == sorted(ranged), "path and adjacency subtrees differ"
+            measure("descendant count via path range", lambda: range_descendant_count(db, comment), args.repeat, query_log)
+            measure("continue thread (depth 3)", lambda: comment_threads.load_subtree(db, comment, depth=3), args.repeat, query_log)
+            print(f"  {len(ranged)} comments in subtree\n")
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
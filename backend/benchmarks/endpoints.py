@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark suite.
+
+Boots `main.app` in-process against a database filled by synthetic_data.py
+at the given scale factor and drives the hot endpoints through httpx's ASGI transport at fixed concurrency levels.
+Each scenario records p50/p95/p99 latency and throughput per level; `run
+--save` writes them to a JSON baseline and `compare` flags regressions
+between two baselines.
+
+Usage:
+    python benchmarks/endpoints.py run [--scale 0.002] [--concurrency 1 8 32] [--save baselines/sqlite.json]
+    python benchmarks/endpoints.py compare OLD.json NEW.json [--tolerance 0.15]
+
+The data and the request sequence are deterministic from --seed, so two runs
+on the same machine differ only by noise. By default it runs against a
+throwaway SQLite file. Point --database-url at an empty Postgres database to
+measure the real thing; the tables it creates are dropped again at the end.
+`compare` exits with status 1 when any scenario regressed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("INVALIDATION_BACKEND", "inprocess")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+
+SCENARIOS = (
+    "feed_recent", "feed_popular", "feed_controversial", "home_feed",
+    "prediction_detail", "comment_thread", "vote", "back", "login", "group_list",
+)
+METRICS = ("p50_ms", "p95_ms", "p99_ms")  # Higher is worse; throughput is the other way round
+
+
+class Driver:
+    """Builds the requests of each scenario from a seeded random sequence."""
+
+    def __init__(self, dataset: dict, seed_value: int):
+        from auth import create_access_token
+        import synthetic_data
+
+        self.dataset = dataset
+        self.password = synthetic_data.PASSWORD
+        self.rng = random.Random(seed_value)
+        self.tokens = {
+            user_id: {"Authorization": f"Bearer {create_access_token(data={'sub': str(user_id)}, expires_delta=timedelta(days=1))}"}
+            for user_id in range(1, dataset["users"] + 1)
+        }
+        # Fresh (user, prediction) pairs; the ones the dataset already backed are skipped
+        self.backings = ((user_id, prediction_id)
+                         for prediction_id in dataset["backable"]
+                         for user_id in range(1, dataset["users"] + 1)
+                         if (user_id, prediction_id) not in dataset["backed"])
+
+    def user(self) -> int:
+        return self.rng.randint(1, self.dataset["users"])
+
+    def prediction(self) -> int:
+        return self.rng.choice(self.dataset["public"])
+
+    def request(self, scenario: str) -> tuple:
+        """(method, url, keyword arguments for httpx) for one request of `scenario`."""
+        if scenario.startswith("feed_"):
+            return "GET", f"/predictions?sort={scenario[len('feed_'):]}&page={self.rng.randint(1, 5)}", {}
+        if scenario == "home_feed":
+            return "GET", "/feed/home", {"headers": self.tokens[self.user()]}
+        if scenario == "prediction_detail":
+            return "GET", f"/predictions/{self.prediction()}", {}
+        if scenario == "comment_thread":
+            return "GET", f"/predictions/{self.rng.choice(self.dataset['hot_predictions'])}/comments/thread", {}
+        if scenario == "vote":
+            return "POST", f"/predictions/{self.prediction()}/vote", {
+                "json": {"value": self.rng.choice((-1, 1))}, "headers": self.tokens[self.user()],
+            }
+        if scenario == "back":
+            user_id, prediction_id = next(self.backings)
+            return "POST", f"/predictions/{prediction_id}/back", {"headers": self.tokens[user_id]}
+        if scenario == "login":
+            return "POST", "/auth/login", {"json": {"email": f"user{self.user()}@example.com", "password": self.password}}
+        if scenario == "group_list":
+            return "GET", f"/groups?sort={self.rng.choice(('new', 'top', 'members'))}", {}
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run_level(client, driver: Driver, scenario: str, concurrency: int, requests: int) -> dict:
+    """Send `requests` requests of `scenario` from `concurrency` concurrent clients."""
+    planned = [driver.request(scenario) for _ in range(requests)]
+    latencies, errors = [], 0
+
+    async def worker(share):
+        nonlocal errors
+        for method, url, kwargs in share:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(planned[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "throughput_rps": round(requests / elapsed, 1),
+    }
+
+
+async def run_suite(args, dataset: dict) -> dict:
+    import httpx
+
+    import main
+
+    driver = Driver(dataset, args.seed)
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    # Startup handlers included, so the outbox processor competes with the requests as in production
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for scenario in args.scenarios:
+            results[scenario] = {}
+            for concurrency in args.concurrency:
+                await run_level(client, driver, scenario, concurrency, args.warmup)
+                level = await run_level(client, driver, scenario, concurrency, args.requests)
+                results[scenario][str(concurrency)] = level
+                print(f"  {scenario:<20} c={concurrency:<3} p50 {level['p50_ms']:8.2f} ms  p95 {level['p95_ms']:8.2f} ms  "
+                      f"p99 {level['p99_ms']:8.2f} ms  {level['throughput_rps']:8.1f} req/s  {level['errors']} errors")
+    return results
+
+
+def run(args) -> None:
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkstemp(suffix='.db')[1]}"
+    import models  # Registers the tables with Base.metadata
+    import synthetic_data
+    from database import Base, SessionLocal, engine
+    from models import Backing, Prediction, Visibility
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print(f"Generating scale {args.scale} on {engine.dialect.name}...")
+        started = time.perf_counter()
+        dataset = synthetic_data.generate(db, args.scale, args.seed)
+        # Requests stick to what anonymous users may see and what may be backed, so errors mean failures
+        public = db.query(Prediction.prediction_id, Prediction.allow_backing).filter(
+            Prediction.visibility == Visibility.PUBLIC
+        ).order_by(Prediction.prediction_id).all()
+        dataset["public"] = [row.prediction_id for row in public]
+        dataset["backable"] = [row.prediction_id for row in public if row.allow_backing]
+        dataset["hot_predictions"] = [p for p in dataset["hot_predictions"] if p in set(dataset["public"])]
+        dataset["backed"] = set(db.query(Backing.backer_user_id, Backing.prediction_id).all())
+        print(f"  generated in {time.perf_counter() - started:.1f}s")
+        db.close()
+
+        results = asyncio.run(run_suite(args, dataset))
+        if args.save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+            with open(args.save, "w") as baseline:
+                json.dump({
+                    "meta": {
+                        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                        "dialect": engine.dialect.name,
+                        "scale": args.scale,
+                        "seed": args.seed,
+                        "requests": args.requests,
+                        "python": platform.python_version(),
+                        "machine": platform.machine(),
+                    },
+                    "results": results,
+                }, baseline, indent=2)
+            print(f"Saved {args.save}")
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def compare(args) -> int:
+    """Print every metric that moved by more than the tolerance; 1 if any got worse."""
+    with open(args.old) as old_file, open(args.new) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    if (old["meta"]["dialect"], old["meta"]["scale"]) != (new["meta"]["dialect"], new["meta"]["scale"]):
+        print("Warning: the baselines were recorded on different databases or scales")
+
+    regressions = 0
+    for scenario, levels in sorted(new["results"].items()):
+        for concurrency, current in sorted(levels.items(), key=lambda item: int(item[0])):
+            previous = old["results"].get(scenario, {}).get(concurrency)
+            if previous is None:
+                continue
+            changes = [(metric, previous[metric], current[metric], current[metric] / previous[metric] - 1)
+                       for metric in METRICS if previous[metric]]
+            if previous["throughput_rps"]:
+                changes.append(("throughput_rps", previous["throughput_rps"], current["throughput_rps"],
+                                previous["throughput_rps"] / max(current["throughput_rps"], 1e-9) - 1))
+            for metric, before, after, worse_by in changes:
+                if abs(worse_by) <= args.tolerance:
+                    continue
+                verdict = "REGRESSION" if worse_by > 0 else "improved"
+                regressions += worse_by > 0
+                print(f"{verdict:<10} {scenario:<20} c={concurrency:<3} {metric:<14} {before:>10} -> {after:<10} ({worse_by:+.0%})")
+    print(f"{regressions} regression{'s' if regressions != 1 else ''} beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate a database and benchmark the endpoints")
+    run_parser.add_argument("--scale", type=float, default=0.002, help="synthetic_data.py scale factor")
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    run_parser.add_argument("--requests", type=int, default=200, help="per scenario and concurrency level")
+    run_parser.add_argument("--warmup", type=int, default=20)
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--database-url")
+    run_parser.add_argument("--save", help="write the results to this JSON baseline")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two baselines")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change, e.g. 0.15")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Home feed benchmark.
+
+Builds groups with a history of predictions and three viewers who belong to
+1, 50 and 500 of them, then compares what clients did before `/feed/home`
+(one group feed query per group, merged by the client) against the merged
+timeline query, for the first page and for a page deep into the timeline.
+
+Usage:
+    python benchmarks/home_feed.py [--predictions-per-group 40] [--database-url URL]
+
+By default it runs against a throwaway SQLite file. Point --database-url at an
+empty Postgres database to measure the LATERAL merge; the tables it creates
+are dropped again at the end.
+"""
+import argparse
+import hashlib
+import heapq
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("JWT_SECRET", "benchmark")
+
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import feed
+from database import Base
+from models import Group, GroupMember, LoginType, Prediction, User, Visibility
+
+VIEWER_GROUP_COUNTS = (1, 50, 500)
+PAGE_SIZE = 20
+
+
+def build(db, group_count: int, per_group: int, seed: int) -> dict:
+    """Insert the groups, their predictions and one viewer per entry of VIEWER_GROUP_COUNTS.
+
+    Returns {group count: viewer}.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    db.execute(insert(User), [{
+        "user_id": 1, "email": "author@example.com", "handle": "author",
+        "login_type": LoginType.PASSWORD, "wisdom_level": 0,
+    }] + [{
+        "user_id": 1 + i, "email": f"viewer{count}@example.com", "handle": f"viewer{count}",
+        "login_type": LoginType.PASSWORD, "wisdom_level": 0,
+    } for i, count in enumerate(VIEWER_GROUP_COUNTS, start=1)])
+    db.execute(insert(Group), [{
+        "group_id": group_id, "name": f"Group {group_id}", "description": "Benchmark",
+        "visibility": "public", "created_by": 1,
+    } for group_id in range(1, group_count + 1)])
+
+    rows = []
+    for group_id in range(1, group_count + 1):
+        for _ in range(per_group):
+            prediction_id = len(rows) + 1
+            rows.append({
+                "prediction_id": prediction_id, "user_id": 1, "group_id": group_id,
+                "title": f"Prediction {prediction_id}", "content": "Benchmark", "category": "General",
+                "visibility": Visibility.PUBLIC, "allow_backing": True, "hash": hashlib.sha256(f"benchmark-{prediction_id}".encode()).hexdigest(),
+                "contains_profanity": False,
+                "timestamp": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            })
+    db.execute(insert(Prediction), rows)
+
+    viewers, members = {}, []
+    for user_id, count in enumerate(VIEWER_GROUP_COUNTS, start=2):
+        viewers[count] = db.get(User, user_id)
+        members += [{"group_id": group_id, "user_id": user_id, "role": "member"}
+                    for group_id in rng.sample(range(1, group_count + 1), count)]
+    db.execute(insert(GroupMember), members)
+    db.commit()
+    return viewers
+
+
+def per_group_feeds(db, viewer: User, pages: int) -> list:
+    """The old client pattern: every group's newest predictions, merged locally."""
+    group_ids = [row[0] for row in db.query(GroupMember.group_id).filter(GroupMember.user_id == viewer.user_id)]
+    runs = []
+    for group_id in group_ids:
+        runs.append(db.query(Prediction.timestamp, Prediction.prediction_id).filter(
+            Prediction.group_id == group_id
+        ).order_by(Prediction.timestamp.desc(), Prediction.prediction_id.desc()).limit(PAGE_SIZE * pages).all())
+    merged = heapq.merge(*runs, key=lambda row: (row[0], row[1]), reverse=True)
+    return [row[1] for row in merged][PAGE_SIZE * (pages - 1):PAGE_SIZE * pages]
+
+
+def merged_feed(db, viewer: User, pages: int) -> list:
+    """The /feed/home path, following cursors to the requested page."""
+    cursor = None
+    for page_number in range(1, pages + 1):
+        page = feed.load_home_feed(db, viewer, cursor, PAGE_SIZE, fields=frozenset({"prediction_id"}))
+        cursor = page["next_cursor"]
+        if cursor is None and page_number < pages:
+            return []
+    return [item["prediction_id"] for item in page["predictions"]]
+
+
+def measure(label: str, fn, repeat: int, query_log: list):
+    timings = []
+    for _ in range(repeat):
+        query_log.clear()
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f"  {label:<34} {statistics.median(timings):9.2f} ms  {len(query_log):5d} queries")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=max(VIEWER_GROUP_COUNTS))
+    parser.add_argument("--predictions-per-group", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkstemp(suffix='.db')[1]}"
+    engine = create_engine(database_url)
+
+    query_log = []
+    event.listen(engine, "before_cursor_execute", lambda *a: query_log.append(a[2]))
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        print(f"Building {args.groups} groups x {args.predictions_per_group} predictions on {engine.dialect.name}...")
+        started = time.perf_counter()
+        viewers = build(db, args.groups, args.predictions_per_group, args.seed)
+        print(f"  built in {time.perf_counter() - started:.1f}s")
+        if engine.dialect.name == "postgresql":
+            db.execute(text("ANALYZE predictions"))
+
+        for count, viewer in viewers.items():
+            print(f"viewer in {count} group{'s' if count != 1 else ''}")
+            for pages in (1, 5):
+                old = measure(f"per-group queries, page {pages}", lambda: per_group_feeds(db, viewer, pages), args.repeat, query_log)
+                new = measure(f"/feed/home, page {pages}", lambda: merged_feed(db, viewer, pages), args.repeat, query_log)
+                assert old == new, "merged feed differs from the per-group merge"
+            print()
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
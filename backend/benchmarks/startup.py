@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Worker startup benchmark.
+
+Starts fresh interpreters and measures, for each, how long `import main`
+takes, how long the startup handlers take, and how long the first anonymous
+and the first authenticated request take after that. With --preload the app
+is imported (and warmed up, see main.warm_up) once and each run forks from
+that process instead, the way `gunicorn --preload` starts its workers.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--preload] [--database-url URL]
+
+By default it runs against a throwaway SQLite file. Point --database-url at an
+empty Postgres database to include real connection setup; the tables it
+creates are dropped again at the end.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("INVALIDATION_BACKEND", "inprocess")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+
+PHASES = ("import_ms", "startup_ms", "first_request_ms", "first_authenticated_ms")
+
+# Runs in the measured interpreter; prints one JSON line per run
+CHILD = r"""
+import asyncio, json, os, sys, time
+import httpx  # The harness's own imports stay outside the measurement
+
+def measure(app, started, imported):
+    async def requests():
+        async with app.router.lifespan_context(app):
+            ready = time.perf_counter()
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                (await client.get("/predictions")).raise_for_status()
+                first = time.perf_counter()
+                (await client.get("/auth/me", headers={"Authorization": "Bearer " + os.environ["STARTUP_TOKEN"]})).raise_for_status()
+                return ready, first, time.perf_counter()
+
+    ready, first, authenticated = asyncio.run(requests())
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "startup_ms": (ready - imported) * 1000,
+        "first_request_ms": (first - ready) * 1000,
+        "first_authenticated_ms": (authenticated - first) * 1000,
+    }), flush=True)
+
+runs = int(sys.argv[1])
+if sys.argv[2] == "preload":
+    import main
+    if hasattr(main, "warm_up"):
+        main.warm_up()
+    for _ in range(runs):
+        pid = os.fork()
+        if pid == 0:
+            forked = time.perf_counter()
+            measure(main.app, forked, forked)
+            os._exit(0)
+        os.waitpid(pid, 0)
+else:
+    started = time.perf_counter()
+    import main
+    measure(main.app, started, time.perf_counter())
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", action="store_true", help="fork warmed workers from one imported app")
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkstemp(suffix='.db')[1]}"
+    import models  # Registers the tables with Base.metadata
+    from auth import create_access_token, get_password_hash
+    from database import Base, SessionLocal, engine
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    try:
+        with SessionLocal() as db:
+            user = models.User(email="startup@example.com", handle="startup", password_hash=get_password_hash("startup"),
+                               login_type=models.LoginType.PASSWORD)
+            db.add(user)
+            db.commit()
+            token = create_access_token(data={"sub": str(user.user_id)}, expires_delta=timedelta(hours=1))
+
+        environment = {**os.environ, "STARTUP_TOKEN": token}
+        if args.preload:
+            commands = [[sys.executable, "-c", CHILD, str(args.runs), "preload"]]
+        else:
+            commands = [[sys.executable, "-c", CHILD, "1", "fresh"]] * args.runs
+        results = []
+        for command in commands:
+            output = subprocess.run(command, cwd=BACKEND, env=environment, capture_output=True, text=True, check=True).stdout
+            results += [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+        print(f"{'preloaded fork' if args.preload else 'fresh interpreter'}, {engine.dialect.name}, median of {len(results)} runs:")
+        for phase in PHASES:
+            print(f"  {phase:<24} {statistics.median(run[phase] for run in results):9.1f}")
+        print(f"  {'total_ms':<24} {statistics.median(sum(run[p] for p in PHASES) for run in results):9.1f}")
+    finally:
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Bounded comment thread loading.
+
+A thread page is built one level at a time: one query for the page of
+comments at the top, then one query per reply depth that fetches the first
+few replies of every node on the previous level. Authors are joined into the
+same statement and vote totals are counters stored on the comment row, so the
+number of queries depends on the requested depth and never on the size of the
+thread.
+
+Every comment also stores a materialized `path` of its ancestors' ids. All
+descendants of a comment share its path as a prefix, so a subtree is a single
+indexed range: `path > parent.path AND path < parent.path || '~'`.
+"""
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlalchemy import and_, func, null, or_
+from sqlalchemy.orm import Session, aliased, contains_eager, load_only
+
+from fieldsets import CONTENT_PREVIEW_LENGTH, author_columns, author_summary
+from models import Comment, CommentVote, User
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+DEFAULT_REPLY_DEPTH = 3
+MAX_REPLY_DEPTH = 8
+DEFAULT_REPLIES_PER_NODE = 5
+MAX_REPLIES_PER_NODE = 50
+
+MAX_SUBTREE_SIZE = 500
+
+PATH_SEGMENT_WIDTH = 10  # Wide enough for any 32-bit comment_id
+PATH_SEPARATOR = "/"
+PATH_UPPER_BOUND = "~"  # Sorts after every digit and the separator
+
+SORTS = ("top", "new", "controversial")
+_SORT_KEY_COUNTS = {"top": 2, "new": 2, "controversial": 2}
+
+# z-score for an 80% confidence interval, as used by reddit's "best" sort
+WILSON_Z = 1.281551565545
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+def encode_cursor(sort: str, keys: Optional[list]) -> str:
+    """Encode the sort keys of the last row on a page into an opaque cursor.
+
+    A cursor with no keys points at the start of a reply list; it is handed
+    out for nodes whose replies were cut off by the depth limit.
+    """
+    payload = {"s": sort, "k": keys}
+    raw = json.dumps(payload, separators=(",", ":"), default=_json_default).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(
+    cursor: str,
+    sort: str,
+    key_counts: Dict[str, int] = _SORT_KEY_COUNTS,
+    timestamp_sorts: tuple = ("new",),
+) -> Optional[list]:
+    """Decode a cursor issued by `encode_cursor` for the given sort.
+
+    `key_counts` gives the number of keys each sort order uses; the first key
+    of a sort in `timestamp_sorts` is turned back into a datetime.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        cursor_sort, keys = payload["s"], payload["k"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+
+    if cursor_sort != sort:
+        raise InvalidCursor("Cursor was issued for a different sort order")
+    if keys is None:
+        return None
+    if not isinstance(keys, list) or len(keys) != key_counts[sort]:
+        raise InvalidCursor("Malformed cursor")
+    if sort in timestamp_sorts:
+        try:
+            keys[0] = datetime.fromisoformat(keys[0])
+        except (TypeError, ValueError):
+            raise InvalidCursor("Malformed cursor")
+    return keys
+
+
+def path_for(comment_id: int, parent_path: str = "") -> str:
+    """Materialized path of a comment whose parent has `parent_path`."""
+    return f"{parent_path}{comment_id:0{PATH_SEGMENT_WIDTH}d}{PATH_SEPARATOR}"
+
+
+def descendants_of(path, model=Comment):
+    """Filter clause selecting every descendant of the comment at `path`.
+
+    `path` may be a plain string or a column, so the same range works as a
+    correlated subquery.
+    """
+    return and_(model.path > path, model.path < path + PATH_UPPER_BOUND)
+
+
+def in_subtree(comment: Comment):
+    """Filter clause selecting `comment` itself and all of its descendants."""
+    return and_(
+        Comment.prediction_id == comment.prediction_id,
+        Comment.path >= comment.path,
+        Comment.path < comment.path + PATH_UPPER_BOUND,
+    )
+
+
+def wilson_lower_bound(upvotes: int, downvotes: int, z: float = WILSON_Z) -> float:
+    """Lower bound of the Wilson score interval for the share of upvotes.
+
+    Ranks a comment by how confident we are that it is well liked, so 40 up
+    and 2 down beats 1 up and 0 down.
+    """
+    total = upvotes + downvotes
+    if total == 0:
+        return 0.0
+    share = upvotes / total
+    return (
+        share + z * z / (2 * total)
+        - z * math.sqrt((share * (1 - share) + z * z / (4 * total)) / total)
+    ) / (1 + z * z / total)
+
+
+def controversy(upvotes: int, downvotes: int) -> float:
+    """Large when many people vote and the votes are evenly split."""
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = downvotes / upvotes if upvotes > downvotes else upvotes / downvotes
+    return float((upvotes + downvotes) ** balance)
+
+
+def apply_vote(comment: Comment, old_value: Optional[int], new_value: Optional[int]) -> None:
+    """Move one user's vote on `comment` from `old_value` to `new_value`.
+
+    Either value may be None for "no vote". Updates the stored counters and
+    both rankings; the caller should hold a row lock on the comment.
+    """
+    for value, step in ((old_value, -1), (new_value, 1)):
+        if value is None:
+            continue
+        comment.score += value * step
+        if value > 0:
+            comment.upvotes += step
+        elif value < 0:
+            comment.downvotes += step
+    comment.wilson_score = wilson_lower_bound(comment.upvotes, comment.downvotes)
+    comment.controversy_score = controversy(comment.upvotes, comment.downvotes)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def _reply_counts(db: Session, prediction_id: int):
+    """Number of direct replies for every comment of one prediction."""
+    child = aliased(Comment)
+    return db.query(
+        child.parent_comment_id.label("parent_id"),
+        func.count(child.comment_id).label("reply_count"),
+    ).filter(
+        child.prediction_id == prediction_id,
+        child.parent_comment_id.isnot(None),
+    ).group_by(child.parent_comment_id).subquery()
+
+
+def _sort_keys(sort: str) -> list:
+    """Descending sort keys for a sort order, ending with the comment id as tie-breaker.
+
+    Each combination is covered by one of the `ix_comments_thread_*` indexes.
+    """
+    if sort == "new":
+        return [Comment.timestamp, Comment.comment_id]
+    if sort == "controversial":
+        return [Comment.controversy_score, Comment.comment_id]
+    return [Comment.wilson_score, Comment.comment_id]
+
+
+def keyset_after(keys: list, values: list):
+    """Keyset condition selecting rows that sort after `values` in descending order."""
+    clauses = []
+    for i, key in enumerate(keys):
+        equal_prefix = [keys[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, key < values[i]))
+    return or_(*clauses)
+
+
+def _wants(fields: Optional[FrozenSet[str]], name: str) -> bool:
+    return fields is None or name in fields
+
+
+def _base_query(db: Session, prediction_id: int, sort: str, viewer_id: Optional[int], fields=None):
+    """Comments of one prediction with everything a thread node needs.
+
+    With a sparse `fields` set only the requested columns, joins and
+    subqueries are selected; the tree-building columns are always loaded.
+    """
+    replies = _reply_counts(db, prediction_id)
+    keys = _sort_keys(sort)
+
+    if viewer_id and _wants(fields, "user_vote"):
+        viewer_vote = aliased(CommentVote)
+        user_vote = viewer_vote.value
+    else:
+        viewer_vote = None
+        user_vote = null()
+
+    if _wants(fields, "descendant_count"):
+        descendant = aliased(Comment)
+        descendant_count = db.query(func.count(descendant.comment_id)).filter(
+            descendant.prediction_id == Comment.prediction_id,
+            descendants_of(Comment.path, descendant),
+        ).correlate(Comment).scalar_subquery()
+    else:
+        descendant_count = null()
+
+    columns = [
+        Comment,
+        Comment.score.label("vote_score"),
+        func.coalesce(replies.c.reply_count, 0).label("reply_count"),
+        descendant_count.label("descendant_count"),
+        user_vote.label("user_vote"),
+        *[key.label(f"sort_key_{i}") for i, key in enumerate(keys)],
+    ]
+    if fields is not None:
+        if "content_preview" in fields:
+            columns.append(func.substr(Comment.content, 1, CONTENT_PREVIEW_LENGTH).label("content_preview"))
+        if "user" in fields:
+            columns += author_columns()
+
+    query = db.query(*columns).outerjoin(
+        replies, replies.c.parent_id == Comment.comment_id
+    ).filter(
+        Comment.prediction_id == prediction_id
+    )
+    if fields is None:
+        query = query.join(Comment.user).options(contains_eager(Comment.user))
+    else:
+        loaded = [Comment.comment_id, Comment.prediction_id, Comment.parent_comment_id, Comment.path, Comment.depth]
+        loaded += [getattr(Comment, name) for name in ("content", "timestamp") if name in fields]
+        query = query.options(load_only(*loaded))
+        if "user" in fields:
+            query = query.join(User, User.user_id == Comment.user_id)
+    if viewer_vote is not None:
+        query = query.outerjoin(
+            viewer_vote,
+            and_(viewer_vote.comment_id == Comment.comment_id, viewer_vote.user_id == viewer_id),
+        )
+    return query, keys
+
+
+def _node(row, key_count: int, fields=None) -> dict:
+    comment = row[0]
+    node = {
+        "comment_id": comment.comment_id,
+        "prediction_id": comment.prediction_id,
+        "parent_comment_id": comment.parent_comment_id,
+        "vote_score": row.vote_score,
+        "reply_count": row.reply_count,
+        "descendant_count": row.descendant_count,
+        "user_vote": row.user_vote,
+        "replies": [],
+        "replies_cursor": None,
+        "_keys": [getattr(row, f"sort_key_{i}") for i in range(key_count)],
+    }
+    if fields is None:
+        node.update(user=comment.user, content=comment.content, timestamp=comment.timestamp)
+    else:
+        # Only touch attributes that were loaded, anything else would lazy-load
+        for name in ("content", "timestamp"):
+            if name in fields:
+                node[name] = getattr(comment, name)
+        if "content_preview" in fields:
+            node["content_preview"] = row.content_preview
+        if "user" in fields:
+            node["user"] = author_summary(row)
+    return node
+
+
+def _fetch_page(db, prediction_id, sort, viewer_id, parent_id, after_keys, limit, fields=None):
+    """One page of comments under `parent_id` (or of root comments)."""
+    query, keys = _base_query(db, prediction_id, sort, viewer_id, fields)
+    if parent_id is None:
+        query = query.filter(Comment.parent_comment_id.is_(None))
+    else:
+        query = query.filter(Comment.parent_comment_id == parent_id)
+    if after_keys is not None:
+        query = query.filter(keyset_after(keys, after_keys))
+
+    rows = query.order_by(*[key.desc() for key in keys]).limit(limit + 1).all()
+    nodes = [_node(row, len(keys), fields) for row in rows[:limit]]
+    next_cursor = encode_cursor(sort, nodes[-1]["_keys"]) if len(rows) > limit else None
+    return nodes, next_cursor
+
+
+def _fetch_children(db, prediction_id, sort, viewer_id, parent_ids, limit, fields=None):
+    """The first `limit` replies of every parent in `parent_ids`, grouped by parent."""
+    ranked = db.query(
+        Comment.comment_id.label("comment_id"),
+        func.row_number().over(
+            partition_by=Comment.parent_comment_id,
+            order_by=[key.desc() for key in _sort_keys(sort)],
+        ).label("position"),
+    ).filter(
+        Comment.parent_comment_id.in_(parent_ids)
+    ).subquery()
+
+    query, keys = _base_query(db, prediction_id, sort, viewer_id, fields)
+    rows = query.join(
+        ranked, ranked.c.comment_id == Comment.comment_id
+    ).filter(
+        ranked.c.position <= limit + 1
+    ).order_by(Comment.parent_comment_id, ranked.c.position).all()
+
+    children: Dict[int, List[dict]] = {}
+    for row in rows:
+        children.setdefault(row[0].parent_comment_id, []).append(_node(row, len(keys), fields))
+    return children
+
+
+def load_thread(
+    db: Session,
+    prediction_id: int,
+    sort: str = "top",
+    viewer_id: Optional[int] = None,
+    parent_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    depth: int = DEFAULT_REPLY_DEPTH,
+    replies_per_node: int = DEFAULT_REPLIES_PER_NODE,
+    fields: Optional[FrozenSet[str]] = None,
+) -> dict:
+    """Load one page of a comment thread with a bounded amount of nested replies.
+
+    Returns a dict with the page of `comments` (each carrying up to `depth`
+    levels of `replies`) and a `next_cursor` for the following page. A node
+    whose replies were truncated gets a `replies_cursor`; passing it back
+    together with `parent_id` continues that node's reply list. `fields`
+    limits the loaded columns to a sparse fieldset (see `fieldsets`).
+    """
+    after_keys = decode_cursor(cursor, sort) if cursor else None
+    nodes, next_cursor = _fetch_page(db, prediction_id, sort, viewer_id, parent_id, after_keys, limit, fields)
+
+    level = nodes
+    for _ in range(depth):
+        parents = [node for node in level if node["reply_count"]]
+        if not parents:
+            break
+        children = _fetch_children(
+            db, prediction_id, sort, viewer_id,
+            [node["comment_id"] for node in parents], replies_per_node, fields,
+        )
+        level = []
+        for node in parents:
+            replies = children.get(node["comment_id"], [])
+            node["replies"] = replies[:replies_per_node]
+            if len(replies) > replies_per_node:
+                node["replies_cursor"] = encode_cursor(sort, node["replies"][-1]["_keys"])
+            level.extend(node["replies"])
+
+    # Nodes at the depth limit keep their reply count but get a fresh cursor.
+    for node in level:
+        if node["reply_count"] and not node["replies"]:
+            node["replies_cursor"] = encode_cursor(sort, None)
+
+    return {"comments": nodes, "next_cursor": next_cursor}
+
+
+def load_subtree(
+    db: Session,
+    comment: Comment,
+    sort: str = "top",
+    viewer_id: Optional[int] = None,
+    depth: int = DEFAULT_REPLY_DEPTH,
+    limit: int = MAX_SUBTREE_SIZE,
+    fields: Optional[FrozenSet[str]] = None,
+) -> dict:
+    """Load `comment` and up to `depth` levels of its replies in one range query.
+
+    This backs "continue this thread": the subtree is read breadth-first and
+    capped at `limit` comments. If the cap cuts into a level, that whole level
+    is dropped, so every returned node carries either all of its replies or
+    none of them (with a `replies_cursor` to fetch them).
+    """
+    query, keys = _base_query(db, comment.prediction_id, sort, viewer_id, fields)
+    rows = query.filter(
+        in_subtree(comment),
+        Comment.depth <= comment.depth + depth,
+    ).order_by(Comment.depth, Comment.path).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        partial_depth = rows[-1][0].depth
+        if partial_depth > comment.depth:
+            rows = [row for row in rows if row[0].depth < partial_depth]
+
+    nodes = {row[0].comment_id: _node(row, len(keys), fields) for row in rows}
+    for node in nodes.values():
+        parent = nodes.get(node["parent_comment_id"])
+        if parent is not None and node["comment_id"] != comment.comment_id:
+            parent["replies"].append(node)
+
+    for node in nodes.values():
+        node["replies"].sort(key=lambda reply: reply["_keys"], reverse=True)
+        if node["reply_count"] and not node["replies"]:
+            node["replies_cursor"] = encode_cursor(sort, None)
+
+    return nodes[comment.comment_id]
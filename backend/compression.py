@@ -0,0 +1,153 @@
+"""
+gzip and brotli response compression.
+
+CompressionMiddleware compresses JSON and text responses of at least
+COMPRESSION_MIN_SIZE bytes with the best encoding the client accepts, per
+its Accept-Encoding q-values. Brotli wins ties, and is only offered when the
+`brotli` package is installed. Streaming responses (more than one body
+message, e.g. /live) and responses that already carry a Content-Encoding,
+like the precompressed entries response_cache serves, pass through
+untouched.
+
+Dynamic responses use fast levels (DYNAMIC_LEVELS); response_cache
+compresses each entry once at PRECOMPRESSED_LEVELS. Bodies of
+OFFLOAD_MIN_SIZE bytes or more are compressed in a worker thread, so a big
+page does not hold up every other request on the event loop; smaller ones
+compress faster than the handoff takes. Bytes saved and time spent
+compressing are counted per encoding in metrics.
+"""
+import gzip
+import time
+from typing import Iterable, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import settings
+from metrics import COUNTER, registry
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip only without it
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+IDENTITY = "identity"
+ENCODINGS: Tuple[str, ...] = ((BROTLI,) if brotli is not None else ()) + (GZIP,)  # In order of preference
+
+DYNAMIC_LEVELS = {GZIP: 6, BROTLI: 4}
+PRECOMPRESSED_LEVELS = {GZIP: 9, BROTLI: 9}  # Brotli's 10 and 11 are an order of magnitude slower
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+OFFLOAD_MIN_SIZE = 32 * 1024  # bytes; gzip takes about 0.3 ms here, roughly three thread handoffs
+
+registry.declare("http_response_compressed_total", COUNTER, "Responses sent compressed, by encoding.")
+registry.declare("http_response_compression_saved_bytes_total", COUNTER, "Bytes not sent thanks to compression, by encoding.")
+registry.declare("http_response_compression_seconds_total", COUNTER, "Time spent compressing responses, by encoding.")
+
+
+def negotiate(accept_encoding: Optional[str], available: Iterable[str] = ENCODINGS) -> Optional[str]:
+    """The acceptable encoding with the highest q-value, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(headers: Headers) -> bool:
+    return "content-encoding" not in headers and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str, levels: dict = DYNAMIC_LEVELS) -> bytes:
+    """`body` in `encoding`, counting the time it took."""
+    started = time.perf_counter()
+    if encoding == BROTLI:
+        compressed = brotli.compress(body, quality=levels[BROTLI])
+    else:
+        compressed = gzip.compress(body, compresslevel=levels[GZIP], mtime=0)
+    registry.inc("http_response_compression_seconds_total", {"encoding": encoding}, time.perf_counter() - started)
+    return compressed
+
+
+def record_sent(encoding: str, original_size: int, sent_size: int) -> None:
+    registry.inc("http_response_compressed_total", {"encoding": encoding})
+    registry.inc("http_response_compression_saved_bytes_total", {"encoding": encoding}, original_size - sent_size)
+
+
+def add_vary(headers: MutableHeaders) -> None:
+    vary = headers.get("vary")
+    if vary is None:
+        headers["vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses single-message responses the client can decode."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # Held back until the body shows whether to compress
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            response_start, start = start, None
+            headers = MutableHeaders(scope=response_start)
+            body = message.get("body", b"")
+            if not compressible(headers):
+                await send(response_start)
+                await send(message)
+                return
+            add_vary(headers)
+            if message.get("more_body") or len(body) < settings.compression_min_size:
+                await send(response_start)
+                await send(message)
+                return
+
+            if len(body) >= OFFLOAD_MIN_SIZE:
+                compressed = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            if len(compressed) >= len(body):
+                await send(response_start)
+                await send(message)
+                return
+            record_sent(encoding, len(body), len(compressed))
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            await send(response_start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -18,9 +18,47 @@ class Settings(BaseSettings):
     
     # API Configuration
     allowed_origins: str = "http://localhost:3000"
-    rate_limit_per_minute: int = 60
+    rate_limit_per_minute: int = 60  # Per user; 0 turns rate limiting off (see rate_limits.py)
+    rate_limit_burst: int = 30
+    rate_limit_ip_per_minute: int = 300
+    rate_limit_ip_burst: int = 100
+    rate_limit_dir: str = "/tmp/callingitnow-ratelimit"
+    forwarded_ip_header: Optional[str] = None  # e.g. do-connecting-ip behind DigitalOcean's proxy
     content_filter_level: str = "PG13"
+
+    # Cache invalidation between workers: inprocess, local or postgres (see invalidation.py)
+    invalidation_backend: str = "local"
+    invalidation_socket_dir: str = "/tmp/callingitnow-invalidation"
+
+    # Metrics snapshots shared between workers, and the share of requests written to the access log
+    metrics_dir: str = "/tmp/callingitnow-metrics"
+    access_log_sample_rate: float = 0.01
+
+    # Request profiling (see profiling.py): a secret for the X-Profile header and/or a sampling rate
+    profiling_token: Optional[str] = None
+    profiling_sample_rate: float = 0.0
+    profiling_dir: str = "/tmp/callingitnow-profiles"
+
+    # Slow query log (see slow_queries.py); /internal/ endpoints need X-Internal-Token and are off without one
+    slow_query_ms: float = 200
+    slow_query_explain_interval: float = 300
+    internal_token: Optional[str] = None
     
+    # Responses smaller than this are sent uncompressed; cached responses are held per worker up to the byte limit
+    compression_min_size: int = 1024
+    response_cache_max_bytes: int = 32 * 1024 * 1024
+
+    # Entity cache (see entity_cache.py): a per-worker LRU, plus an optional shared tier at redis://... or memory://
+    entity_cache_size: int = 10000
+    entity_cache_ttl: float = 30
+    entity_cache_url: Optional[str] = None
+    entity_cache_shared_ttl: int = 300
+    entity_cache_timeout: float = 0.05
+
+    # Transactional outbox (see outbox.py): events claimed per batch, and how often idle workers look for new ones
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 1.0
+
     # Development
     debug: bool = False
     log_level: str = "info"
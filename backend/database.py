@@ -1,4 +1,8 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
@@ -15,3 +19,31 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+PING_CACHE_SECONDS = 5.0
+_ping_lock = threading.Lock()
+_last_ping: Tuple[float, Optional[str]] = (float("-inf"), "not checked yet")
+
+
+def ping() -> Optional[str]:
+    """None if the database answered within the last PING_CACHE_SECONDS, else the error.
+
+    Probes arriving while a ping is under way get the previous answer instead
+    of queueing up more connections.
+    """
+    global _last_ping
+    checked_at, error = _last_ping
+    if time.monotonic() - checked_at < PING_CACHE_SECONDS or not _ping_lock.acquire(blocking=False):
+        return error
+    try:
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            error = None
+        except Exception as exc:
+            error = str(exc).splitlines()[0] or type(exc).__name__
+        _last_ping = (time.monotonic(), error)
+        return error
+    finally:
+        _ping_lock.release()
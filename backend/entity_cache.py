@@ -0,0 +1,462 @@
+"""
+Two-tier cache of the rows every request reads: users, predictions, groups
+and receipt batches.
+
+The first tier is an LRU in each worker, bounded by ENTITY_CACHE_SIZE
+entries that live ENTITY_CACHE_TTL seconds. The optional second tier is
+shared by every worker: anything that speaks the Redis `get`/`set`/`delete`
+commands, at ENTITY_CACHE_URL. Use a `redis://` URL (which needs the `redis`
+package), or `memory://` for FakeRedis, an in-memory stand-in for tests and
+development. A shared tier that errors or times out counts as a miss, and
+the row comes from the database.
+
+Entries are JSON snapshots of a row's columns, never ORM instances. The
+read-through helpers (`load_user`, `load_prediction`, `load_group`,
+`load_receipt_batch`, `prediction_id_for_hash`) turn a snapshot back into an
+instance attached to the caller's session without a query. Related rows
+come through their own helpers and are attached as already loaded, so
+`prediction.user` does not query either. Columns left out of a snapshot, such as
+`users.password_hash`, load lazily if anything reads them. `cached()` holds
+plain values, such as a prediction's counts.
+
+Mutating endpoints call `invalidate(kind, id)` instead of
+`invalidation.publish`. It deletes the shared entries, then publishes on the
+bus, which drops the entries of every worker's first tier. A read that
+misses while an invalidation of the same key goes by does not store what it
+read, so a worker never caches a row older than its own last write.
+Receipt batches and prediction hashes never change, so they are never
+invalidated.
+
+Misses are coalesced through single_flight: concurrent requests for the
+same missing entry in a worker wait for one of them to load it. Entries
+also expire early on a random basis (XFetch). Each lookup treats an entry
+as expired with a probability that rises as its expiry nears and with how
+long the entry took to compute, scaled by EARLY_REFRESH_BETA. One request
+then refreshes a hot entry before it expires, while the rest keep hitting
+it, so expiry does not turn into a burst of identical queries.
+"""
+import enum
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import DateTime, Enum, inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+import invalidation
+import single_flight
+from config import settings
+from models import Group, Prediction, ReceiptBatch, User
+
+logger = logging.getLogger(__name__)
+
+SHARED_KEY_PREFIX = "entity:v2:"  # Bumped whenever a snapshot's shape changes
+USER_EXCLUDED_COLUMNS = frozenset({"password_hash"})
+MAX_REMEMBERED_INVALIDATIONS = 10000
+EARLY_REFRESH_BETA = 1.0  # Above 1 refreshes earlier, 0 turns early refresh off
+
+# What each invalidation bus kind makes stale
+STALE_KINDS = {
+    "prediction": ("prediction", "prediction_counts"),
+    "user": ("user",),
+    "group": ("group",),
+}
+
+Key = Tuple[str, object]
+
+
+def expires_early(expires: float, delta: float, now: float) -> bool:
+    """Whether this lookup should refresh an entry that expires at `expires` and took `delta` seconds to compute."""
+    return now - delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= expires
+
+
+class LocalTier:
+    """This worker's LRU of snapshots, with a TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Key, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "early_refreshes": 0}
+
+    def get(self, key: Key) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                if expires_early(entry[0], entry[1], now):
+                    self._stats["early_refreshes"] += 1  # Left in place for everyone else
+                else:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[2]
+            elif entry is not None:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: Key, value: Any, delta: float = 0.0) -> None:
+        """Store `value`, which took `delta` seconds to compute."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, delta, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def delete(self, key: Key) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+class FakeRedis:
+    """The part of the redis-py client the shared tier uses, kept in a dict."""
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self._values[name]
+                return None
+            return entry[1]
+
+    def set(self, name: str, value, ex: Optional[float] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._values[name] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def flushdb(self) -> bool:
+        with self._lock:
+            self._values.clear()
+        return True
+
+
+def connect(url: Optional[str]):
+    """A client for the shared tier at `url`, or None to run without one."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return FakeRedis()
+    import redis  # Only needed when a Redis server is configured
+
+    timeout = settings.entity_cache_timeout
+    return redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+
+class EntityCache:
+    def __init__(self, local: LocalTier, shared_url: Optional[str], shared_ttl: float):
+        self.local = local
+        self.shared_url = shared_url
+        self.shared_ttl = shared_ttl
+        self._shared = None
+        self._shared_connected = False
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated: "OrderedDict[Key, int]" = OrderedDict()  # Key -> generation it was last invalidated at
+        self._forgotten_generation = 0  # Newest generation dropped from _invalidated
+        self._stats = {"shared_hits": 0, "shared_misses": 0, "misses": 0, "shared_errors": 0, "invalidations": 0}
+        self.flights = single_flight.Group()
+
+    @property
+    def shared(self):
+        # Connected on first use, so each forked worker gets its own connections
+        if not self._shared_connected:
+            with self._lock:
+                if not self._shared_connected:
+                    self._shared = connect(self.shared_url)
+                    self._shared_connected = True
+        return self._shared
+
+    def _get_shared(self, key: Key, token: int) -> Optional[Any]:
+        if self.shared is None:
+            return None
+        try:
+            raw = self.shared.get(self._shared_key(key))
+        except Exception:
+            self._count("shared_errors")
+            logger.debug("Shared entity cache read failed", exc_info=True)
+            return None
+        if raw is not None:
+            expires, delta, value = json.loads(raw)
+            if not expires_early(expires, delta, time.time()):
+                self._count("shared_hits")
+                self.set(key, value, token, delta, shared=False)
+                return value
+        self._count("shared_misses")
+        return None
+
+    def set(self, key: Key, value: Any, token: int, delta: float = 0.0, shared: bool = True) -> None:
+        """Store a value read since the generation was `token`, unless `key` was invalidated meanwhile."""
+        with self._lock:
+            if token < self._forgotten_generation or self._invalidated.get(key, -1) > token:
+                return
+        self.local.set(key, value, delta)
+        if shared and self.shared is not None:
+            entry = [time.time() + self.shared_ttl, delta, value]  # Expiry included for early refresh
+            try:
+                self.shared.set(self._shared_key(key), json.dumps(entry, separators=(",", ":")), ex=self.shared_ttl)
+            except Exception:
+                self._count("shared_errors")
+                logger.debug("Shared entity cache write failed", exc_info=True)
+
+    def load(self, key: Key, compute: Callable[[], Any], usable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """The cached value, or the result of `compute()`, run once for all concurrent misses, which is then cached.
+
+        A cached value that `usable` rejects counts as a miss. None results
+        are not cached.
+        """
+        token = self._generation
+        value = self.local.get(key)
+        if value is not None and (usable is None or usable(value)):
+            return value
+        return self.flights.do(key, lambda: self._fill(key, compute, usable, token))
+
+    def _fill(self, key: Key, compute: Callable[[], Any], usable: Optional[Callable[[Any], bool]], token: int) -> Any:
+        value = self._get_shared(key, token)
+        if value is not None and (usable is None or usable(value)):
+            return value
+        self._count("misses")
+        started = time.perf_counter()
+        value = compute()
+        if value is not None:
+            self.set(key, value, token, time.perf_counter() - started)
+        return value
+
+    def forget(self, key: Key) -> None:
+        """Drop `key` from this worker's tier and stop reads already under way from storing it."""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > MAX_REMEMBERED_INVALIDATIONS:
+                _, generation = self._invalidated.popitem(last=False)
+                self._forgotten_generation = max(self._forgotten_generation, generation)
+            self._stats["invalidations"] += 1
+        self.local.delete(key)
+        self.flights.forget(key)
+
+    def delete_shared(self, keys: Iterable[Key]) -> None:
+        if self.shared is None:
+            return
+        try:
+            self.shared.delete(*[self._shared_key(key) for key in keys])
+        except Exception:
+            self._count("shared_errors")
+            logger.warning("Shared entity cache delete failed; entries stay stale until they expire", exc_info=True)
+
+    def clear(self) -> None:
+        self.local.clear()
+        if isinstance(self.shared, FakeRedis):
+            self.shared.flushdb()
+
+    def stats(self) -> dict:
+        local = self.local.stats()
+        with self._lock:
+            stats = {
+                "local_hits": local["hits"],
+                "local_misses": local["misses"],
+                "evictions": local["evictions"],
+                "expirations": local["expirations"],
+                "early_refreshes": local["early_refreshes"],
+                "entries": local["entries"],
+                **self._stats,
+            }
+        lookups = stats["local_hits"] + stats["local_misses"]
+        stats["hit_ratio"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        flights = self.flights.stats()
+        stats["coalesced"] = flights["coalesced"]
+        stats["coalesce_fallbacks"] = flights["fallbacks"]
+        return stats
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _shared_key(key: Key) -> str:
+        return f"{SHARED_KEY_PREFIX}{key[0]}:{key[1]}"
+
+
+cache = EntityCache(
+    LocalTier(settings.entity_cache_size, settings.entity_cache_ttl),
+    settings.entity_cache_url,
+    settings.entity_cache_shared_ttl,
+)
+
+
+def stats() -> dict:
+    return cache.stats()
+
+
+# Snapshots
+
+_decoders: Dict[type, Dict[str, Callable]] = {}
+
+
+def snapshot(instance, exclude: Iterable[str] = ()) -> dict:
+    """The instance's column values as JSON-ready primitives."""
+    values = {}
+    for attr in sa_inspect(type(instance)).column_attrs:
+        if attr.key in exclude:
+            continue
+        value = getattr(instance, attr.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        values[attr.key] = value
+    return values
+
+
+def _decoders_for(model: type) -> Dict[str, Callable]:
+    decoders = _decoders.get(model)
+    if decoders is None:
+        decoders = {}
+        for attr in sa_inspect(model).column_attrs:
+            column_type = attr.columns[0].type
+            if isinstance(column_type, DateTime):
+                decoders[attr.key] = datetime.fromisoformat
+            elif isinstance(column_type, Enum) and column_type.enum_class is not None:
+                decoders[attr.key] = column_type.enum_class
+        _decoders[model] = decoders
+    return decoders
+
+
+def restore(db: Session, model: type, values: dict):
+    """An instance rebuilt from `snapshot` values, attached to `db` without a query."""
+    decoders = _decoders_for(model)
+    instance = model(**{
+        key: decoders[key](value) if value is not None and key in decoders else value
+        for key, value in values.items()
+    })
+    make_transient_to_detached(instance)  # The values become its committed state, as if loaded
+    return db.merge(instance, load=False)
+
+
+# Read-through helpers
+
+def cached(kind: str, entity_id, load: Callable[[], Any]) -> Any:
+    """A JSON-serializable value, from the cache or from `load()`, which it then caches."""
+    return cache.load((kind, entity_id), load)
+
+
+def _load_row(
+    db: Session,
+    model: type,
+    kind: str,
+    entity_id,
+    query: Callable[[], Any],
+    exclude: Iterable[str] = (),
+    usable: Optional[Callable[[dict], bool]] = None,
+):
+    def compute():
+        instance = query()  # Shared with concurrent callers as a snapshot, not bound to this session
+        return None if instance is None else snapshot(instance, exclude)
+
+    values = cache.load((kind, entity_id), compute, usable)
+    return None if values is None else restore(db, model, values)
+
+
+def load_user(db: Session, user_id: int) -> Optional[User]:
+    user_id = int(user_id)
+    return _load_row(
+        db, User, "user", user_id,
+        lambda: db.query(User).filter(User.user_id == user_id).first(),
+        exclude=USER_EXCLUDED_COLUMNS,
+    )
+
+
+def load_prediction(db: Session, prediction_id: int, sealed: bool = False) -> Optional[Prediction]:
+    """The prediction with its author, or None if it does not exist or is being deleted.
+
+    Pass `sealed` when the receipt matters: sealing updates predictions in
+    bulk without invalidating them, so a cached copy that is not sealed yet
+    is read again. The receipt batch is attached too.
+    """
+    prediction = _load_row(
+        db, Prediction, "prediction", prediction_id,
+        lambda: db.query(Prediction).filter(Prediction.prediction_id == prediction_id).first(),
+        usable=(lambda values: values["receipt_batch_id"] is not None) if sealed else None,
+    )
+    if prediction is not None:
+        set_committed_value(prediction, "user", load_user(db, prediction.user_id))
+        if sealed and prediction.receipt_batch_id is not None:
+            set_committed_value(prediction, "receipt_batch", load_receipt_batch(db, prediction.receipt_batch_id))
+    return prediction
+
+
+def load_group(db: Session, group_id: int) -> Optional[Group]:
+    """The group with its creator, or None if it does not exist or is being deleted."""
+    group = _load_row(
+        db, Group, "group", group_id,
+        lambda: db.query(Group).filter(Group.group_id == group_id).first(),
+    )
+    if group is not None:
+        set_committed_value(group, "creator", load_user(db, group.created_by))
+    return group
+
+
+def load_receipt_batch(db: Session, batch_id: int) -> Optional[ReceiptBatch]:
+    return _load_row(
+        db, ReceiptBatch, "receipt_batch", batch_id,
+        lambda: db.query(ReceiptBatch).filter(ReceiptBatch.batch_id == batch_id).first(),
+    )
+
+
+def prediction_id_for_hash(db: Session, prediction_hash: str) -> Optional[int]:
+    prediction_hash = prediction_hash.lower()
+    return cached("prediction_hash", prediction_hash, lambda: db.query(Prediction.prediction_id).filter(
+        Prediction.hash == prediction_hash
+    ).scalar())
+
+
+# Invalidation
+
+def invalidate(kind: str, entity_id) -> None:
+    """Drop what a committed change to `kind:entity_id` made stale, here, in the shared tier and in other workers."""
+    cache.delete_shared((stale_kind, entity_id) for stale_kind in STALE_KINDS.get(kind, ()))
+    invalidation.publish(kind, entity_id)
+
+
+def _subscriber(kind: str) -> Callable:
+    stale_kinds = STALE_KINDS[kind]
+
+    def forget(entity_id) -> None:
+        entity_id = int(entity_id)
+        for stale_kind in stale_kinds:
+            cache.forget((stale_kind, entity_id))
+
+    return forget
+
+
+for _kind in STALE_KINDS:
+    invalidation.subscribe(_kind, _subscriber(_kind))
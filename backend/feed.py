@@ -0,0 +1,132 @@
+"""
+Home timeline: new predictions from every group the viewer belongs to.
+
+The timeline is read, not stored. Each group's predictions are an ordered
+run in `ix_predictions_group_timeline` (group_id, timestamp, prediction_id),
+so a page is a k-way merge of those runs. On Postgres every group
+contributes at most one page worth of index entries through a LATERAL
+subquery and the outer query merges them, so the cost grows with the number
+of groups times the page size rather than with the groups' history. Other
+databases get the equivalent `group_id IN (...)` query.
+
+Pages are keyset-paginated on (timestamp, prediction_id) with the same
+opaque cursors as comment threads.
+"""
+from typing import FrozenSet, List, Optional
+
+from sqlalchemy import func, or_, select, true
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, joinedload
+
+import fieldsets
+import memberships
+from comment_threads import InvalidCursor, decode_cursor, encode_cursor, keyset_after
+from models import Prediction, User, Visibility
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+FEED_SORT = "home"
+_SORT_KEY_COUNTS = {FEED_SORT: 2}
+
+# Per-prediction totals that the full response adds to each row
+FEED_COUNTS = frozenset({"vote_score", "backing_count", "comment_count", "user_vote", "user_backed"})
+
+
+def visible_to(viewer_id: Optional[int]):
+    """Predictions a viewer may see in a group: public ones and their own private ones.
+
+    Membership does not reveal other members' private predictions, just as
+    /predictions/{id} does not. /groups/{id}/predictions lists with the same
+    rule, so the timeline holds exactly what the viewer's group pages do.
+    """
+    if viewer_id is None:
+        return Prediction.visibility == Visibility.PUBLIC
+    return or_(Prediction.visibility == Visibility.PUBLIC, Prediction.user_id == viewer_id)
+
+
+def _page_ids_merged(db: Session, group_ids: List[int], viewer_id: int, after_keys, limit: int) -> list:
+    """Page of (prediction_id, timestamp) through one LATERAL index scan per group."""
+    groups = func.unnest(postgresql.array(group_ids)).table_valued("group_id").render_derived(name="member_groups")
+    per_group = select(Prediction.prediction_id, Prediction.timestamp).where(
+        Prediction.group_id == groups.c.group_id,
+        Prediction.deleted_at.is_(None),
+        visible_to(viewer_id),
+    )
+    if after_keys is not None:
+        per_group = per_group.where(keyset_after([Prediction.timestamp, Prediction.prediction_id], after_keys))
+    per_group = per_group.order_by(
+        Prediction.timestamp.desc(), Prediction.prediction_id.desc()
+    ).limit(limit).lateral("group_timeline")
+
+    merged = select(per_group.c.prediction_id, per_group.c.timestamp).select_from(groups).join(
+        per_group, true()
+    ).order_by(per_group.c.timestamp.desc(), per_group.c.prediction_id.desc()).limit(limit)
+    return db.execute(merged).all()
+
+
+def _page_ids_in(db: Session, group_ids: List[int], viewer_id: int, after_keys, limit: int) -> list:
+    """Page of (prediction_id, timestamp) through a single `group_id IN (...)` query."""
+    keys = [Prediction.timestamp, Prediction.prediction_id]
+    query = db.query(Prediction.prediction_id, Prediction.timestamp).filter(
+        Prediction.group_id.in_(group_ids),
+        visible_to(viewer_id),
+    )
+    if after_keys is not None:
+        query = query.filter(keyset_after(keys, after_keys))
+    return query.order_by(*[key.desc() for key in keys]).limit(limit).all()
+
+
+def full_predictions(db: Session, prediction_ids: List[int], viewer_id: Optional[int]) -> List[dict]:
+    """Complete prediction rows with authors and totals, in two queries, in the order of `prediction_ids`."""
+    predictions = {
+        prediction.prediction_id: prediction
+        for prediction in db.query(Prediction).options(joinedload(Prediction.user)).filter(
+            Prediction.prediction_id.in_(prediction_ids)
+        )
+    }
+    counts = {row["prediction_id"]: row for row in fieldsets.select_predictions(db, prediction_ids, FEED_COUNTS, viewer_id)}
+    items = []
+    for prediction_id in prediction_ids:
+        prediction = predictions.get(prediction_id)
+        if prediction is None:
+            continue
+        item = {column.key: getattr(prediction, column.key) for column in Prediction.__table__.columns}
+        item.update(counts[prediction_id], user=prediction.user)
+        items.append(item)
+    return items
+
+
+def load_home_feed(
+    db: Session,
+    viewer: User,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[FrozenSet[str]] = None,
+) -> dict:
+    """One page of the viewer's home timeline as `{"predictions", "next_cursor"}`.
+
+    `fields` trims each prediction as in `fieldsets.select_predictions`;
+    without it the rows carry everything PredictionResponse needs. Raises
+    InvalidCursor for cursors not issued by this feed.
+    """
+    after_keys = decode_cursor(cursor, FEED_SORT, _SORT_KEY_COUNTS, timestamp_sorts=(FEED_SORT,)) if cursor else None
+
+    group_ids = sorted(memberships.groups_for(db, viewer.user_id))
+    if not group_ids:
+        return {"predictions": [], "next_cursor": None}
+
+    page_ids = _page_ids_merged if db.get_bind().dialect.name == "postgresql" else _page_ids_in
+    rows = page_ids(db, group_ids, viewer.user_id, after_keys, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(FEED_SORT, [rows[-1].timestamp, rows[-1].prediction_id])
+
+    prediction_ids = [row.prediction_id for row in rows]
+    if fields is not None:
+        predictions = fieldsets.select_predictions(db, prediction_ids, fields, viewer.user_id)
+    else:
+        predictions = full_predictions(db, prediction_ids, viewer.user_id)
+    return {"predictions": predictions, "next_cursor": next_cursor}
@@ -0,0 +1,263 @@
+"""
+Sparse fieldsets for prediction and comment responses.
+
+List and detail endpoints accept either a named `shape` (`compact`, `card`)
+or an explicit comma-separated `fields` list. Both resolve to a set of field
+names, and the helpers here select only the columns and aggregates those
+fields need, so a compact feed never reads `content` or author records from
+the database. `shape=full` (the default) keeps the regular response models.
+"""
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from fastapi import HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, exists, func, null, select, false
+from sqlalchemy.orm import Session, aliased
+
+from models import Backing, Comment, CommentVote, Prediction, User, Vote
+
+CONTENT_PREVIEW_LENGTH = 280
+
+PREDICTION_FIELDS = frozenset({
+    "prediction_id", "user_id", "group_id", "title", "content", "content_preview",
+    "category", "visibility", "allow_backing", "timestamp", "hash", "user",
+    "vote_score", "backing_count", "comment_count", "user_vote", "user_backed",
+})
+PREDICTION_SHAPES = {
+    "compact": frozenset({"prediction_id", "title", "category", "timestamp", "vote_score"}),
+    "card": frozenset({
+        "prediction_id", "group_id", "title", "content_preview", "category", "timestamp", "user",
+        "vote_score", "backing_count", "comment_count", "user_vote", "user_backed",
+    }),
+}
+
+COMMENT_FIELDS = frozenset({
+    "comment_id", "prediction_id", "parent_comment_id", "user", "content", "content_preview",
+    "timestamp", "votes", "vote_score", "user_vote",
+})
+COMMENT_SHAPES = {
+    "compact": frozenset({"comment_id", "parent_comment_id", "content", "vote_score"}),
+    "card": frozenset({"comment_id", "parent_comment_id", "content", "user", "timestamp", "vote_score", "user_vote"}),
+}
+
+# Thread nodes have no embedded vote list but do report reply totals
+COMMENT_THREAD_FIELDS = (COMMENT_FIELDS - {"votes"}) | {"reply_count", "descendant_count"}
+COMMENT_THREAD_SHAPES = {
+    name: fields | {"reply_count"} for name, fields in COMMENT_SHAPES.items()
+}
+
+# Keys that hold a comment tree together and are returned whatever was asked for
+TREE_KEYS = ("comment_id", "replies", "replies_cursor")
+
+
+class InvalidFieldSet(ValueError):
+    """Raised for unknown field names or conflicting shape and fields parameters."""
+
+
+def resolve_fields(
+    shape: str,
+    fields: Optional[str],
+    allowed: FrozenSet[str],
+    shapes: Dict[str, FrozenSet[str]],
+) -> Optional[FrozenSet[str]]:
+    """Turn `shape` / `fields` query parameters into a set of field names.
+
+    Returns None for the full response.
+    """
+    if fields:
+        if shape != "full":
+            raise InvalidFieldSet("Use either shape or fields, not both")
+        requested = frozenset(name.strip() for name in fields.split(",") if name.strip())
+        unknown = requested - allowed
+        if unknown:
+            raise InvalidFieldSet(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return requested
+    if shape == "full":
+        return None
+    return shapes[shape]
+
+
+def _dependency(allowed, shapes):
+    def fieldset(
+        shape: str = Query("full", regex="^(full|compact|card)$"),
+        fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    ) -> Optional[FrozenSet[str]]:
+        try:
+            return resolve_fields(shape, fields, allowed, shapes)
+        except InvalidFieldSet as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    return fieldset
+
+
+# FastAPI dependencies; they resolve to None when the full response was requested
+prediction_fields = _dependency(PREDICTION_FIELDS, PREDICTION_SHAPES)
+comment_fields = _dependency(COMMENT_FIELDS, COMMENT_SHAPES)
+comment_thread_fields = _dependency(COMMENT_THREAD_FIELDS, COMMENT_THREAD_SHAPES)
+
+
+def sparse_response(payload) -> JSONResponse:
+    """Return trimmed payloads directly, bypassing the full response model."""
+    return JSONResponse(content=jsonable_encoder(payload))
+
+
+def author_columns() -> list:
+    """The author summary that sparse responses carry instead of the full user record."""
+    return [
+        User.user_id.label("author_user_id"),
+        User.handle.label("author_handle"),
+        User.wisdom_level.label("author_wisdom_level"),
+    ]
+
+
+def author_summary(row) -> dict:
+    return {
+        "user_id": row.author_user_id,
+        "handle": row.author_handle,
+        "wisdom_level": row.author_wisdom_level,
+    }
+
+
+def trim_tree(nodes: Iterable[dict], fields: FrozenSet[str]) -> List[dict]:
+    """Drop unrequested keys from a comment tree, keeping the keys that link it together."""
+    keep = set(fields) | set(TREE_KEYS)
+    trimmed = []
+    for node in nodes:
+        node = {key: value for key, value in node.items() if key in keep}
+        node["replies"] = trim_tree(node.get("replies", []), fields)
+        trimmed.append(node)
+    return trimmed
+
+
+def select_predictions(
+    db: Session,
+    prediction_ids: List[int],
+    fields: FrozenSet[str],
+    viewer_id: Optional[int] = None,
+) -> List[dict]:
+    """Load the requested fields for `prediction_ids` in one query, preserving their order.
+
+    Counts and the viewer's vote/backing are correlated subqueries that are
+    only added when asked for.
+    """
+    if not prediction_ids:
+        return []
+
+    columns = [Prediction.prediction_id]
+    plain = ("user_id", "group_id", "title", "content", "category", "visibility", "allow_backing", "timestamp", "hash")
+    columns += [getattr(Prediction, name) for name in plain if name in fields]
+    if "content_preview" in fields:
+        columns.append(func.substr(Prediction.content, 1, CONTENT_PREVIEW_LENGTH).label("content_preview"))
+    if "user" in fields:
+        columns += author_columns()
+    if "vote_score" in fields:
+        columns.append(select(func.coalesce(func.sum(Vote.value), 0)).where(
+            Vote.prediction_id == Prediction.prediction_id
+        ).scalar_subquery().label("vote_score"))
+    if "backing_count" in fields:
+        columns.append(select(func.count(Backing.backing_id)).where(
+            Backing.prediction_id == Prediction.prediction_id
+        ).scalar_subquery().label("backing_count"))
+    if "comment_count" in fields:
+        columns.append(select(func.count(Comment.comment_id)).where(
+            Comment.prediction_id == Prediction.prediction_id
+        ).scalar_subquery().label("comment_count"))
+    if "user_vote" in fields:
+        user_vote = select(Vote.value).where(
+            Vote.prediction_id == Prediction.prediction_id, Vote.user_id == viewer_id
+        ).scalar_subquery() if viewer_id else null()
+        columns.append(user_vote.label("user_vote"))
+    if "user_backed" in fields:
+        user_backed = exists().where(
+            Backing.prediction_id == Prediction.prediction_id, Backing.backer_user_id == viewer_id
+        ) if viewer_id else false()
+        columns.append(user_backed.label("user_backed"))
+
+    query = db.query(*columns).filter(Prediction.prediction_id.in_(prediction_ids))
+    if "user" in fields:
+        query = query.join(User, User.user_id == Prediction.user_id)
+
+    rows = {row.prediction_id: row for row in query}
+    results = []
+    for prediction_id in prediction_ids:
+        row = rows.get(prediction_id)
+        if row is None:
+            continue
+        item = {"prediction_id": prediction_id}
+        for name in fields:
+            if name == "user":
+                item["user"] = author_summary(row)
+            elif name == "user_vote":
+                item["user_vote"] = row.user_vote
+            elif name == "user_backed":
+                item["user_backed"] = bool(row.user_backed)
+            elif name != "prediction_id":
+                item[name] = getattr(row, name)
+        results.append(item)
+    return results
+
+
+def select_comment_tree(
+    db: Session,
+    prediction_id: int,
+    order_by: list,
+    fields: FrozenSet[str],
+    viewer_id: Optional[int] = None,
+) -> List[dict]:
+    """Load a prediction's whole comment tree with only the requested fields.
+
+    Siblings keep the order given by `order_by`. One query reads the
+    comments; a second one is issued only when the vote lists are requested.
+    """
+    columns = [Comment.comment_id, Comment.parent_comment_id]
+    plain = ("prediction_id", "content", "timestamp")
+    columns += [getattr(Comment, name) for name in plain if name in fields]
+    if "content_preview" in fields:
+        columns.append(func.substr(Comment.content, 1, CONTENT_PREVIEW_LENGTH).label("content_preview"))
+    if "vote_score" in fields:
+        columns.append(Comment.score.label("vote_score"))
+    if "user" in fields:
+        columns += author_columns()
+
+    query = db.query(*columns).filter(Comment.prediction_id == prediction_id)
+    if "user" in fields:
+        query = query.join(User, User.user_id == Comment.user_id)
+    if "user_vote" in fields:
+        if viewer_id:
+            viewer_vote = aliased(CommentVote)
+            query = query.outerjoin(viewer_vote, and_(
+                viewer_vote.comment_id == Comment.comment_id, viewer_vote.user_id == viewer_id
+            )).add_columns(viewer_vote.value.label("user_vote"))
+        else:
+            query = query.add_columns(null().label("user_vote"))
+
+    votes: Dict[int, List[dict]] = {}
+    if "votes" in fields:
+        vote_rows = db.query(CommentVote.comment_id, CommentVote.user_id, CommentVote.value).join(
+            Comment, Comment.comment_id == CommentVote.comment_id
+        ).filter(Comment.prediction_id == prediction_id)
+        for comment_id, user_id, value in vote_rows:
+            votes.setdefault(comment_id, []).append({"user_id": user_id, "value": value})
+
+    nodes, roots = {}, []
+    rows = query.order_by(*order_by).all()
+    for row in rows:
+        node = {"comment_id": row.comment_id, "parent_comment_id": row.parent_comment_id, "replies": []}
+        for name in fields:
+            if name == "user":
+                node["user"] = author_summary(row)
+            elif name == "votes":
+                node["votes"] = votes.get(row.comment_id, [])
+            elif name not in node:
+                node[name] = getattr(row, name)
+        nodes[row.comment_id] = node
+
+    for row in rows:
+        node = nodes[row.comment_id]
+        parent = nodes.get(row.parent_comment_id)
+        if parent is not None:
+            parent["replies"].append(node)
+        elif row.parent_comment_id is None:
+            roots.append(node)
+
+    return trim_tree(roots, fields)
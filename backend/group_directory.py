@@ -0,0 +1,141 @@
+"""
+Paginated public group directory.
+
+Groups carry `member_count` and `prediction_count` counters, so a directory
+page is one indexed keyset query instead of a COUNT per group. Joins,
+leaves, new predictions and deleted ones update them from their outbox
+events, off the request path, since every write to a popular group would
+otherwise queue on its row. Pages are cached in-process per sort order for
+DIRECTORY_CACHE_SECONDS and dropped on any `group` invalidation from the
+invalidation bus, in this worker or another one.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+import activity
+import entity_cache
+import invalidation
+import outbox
+from comment_threads import InvalidCursor, decode_cursor, encode_cursor, keyset_after
+from models import Group, GroupVisibility
+from schemas import GroupResponse
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SORTS = ("new", "top", "members", "popular")
+_SORT_KEY_COUNTS = {"new": 1, "top": 2, "members": 2, "popular": 2}
+
+POPULAR_WINDOW = timedelta(days=1)
+DIRECTORY_CACHE_SECONDS = 30
+DIRECTORY_CACHE_MAX_PAGES = 256
+
+_cache: Dict[Tuple[str, Optional[str], int], Tuple[float, dict]] = {}
+_cache_lock = threading.Lock()
+
+
+def _directory_query(db: Session, sort: str):
+    """Public groups with their descending sort keys, ending with the group id."""
+    query = db.query(Group).options(joinedload(Group.creator)).filter(
+        Group.visibility == GroupVisibility.PUBLIC.value
+    )
+    if sort == "top":
+        keys = [Group.prediction_count, Group.group_id]
+    elif sort == "members":
+        keys = [Group.member_count, Group.group_id]
+    elif sort == "popular":
+        # Groups without recent predictions have no totals row and stay in
+        # the directory with a count of zero
+        recent = activity.window_totals(db, activity.GROUP_PREDICTIONS, POPULAR_WINDOW)
+        query = query.outerjoin(recent, recent.c.key == activity.key_column(Group.group_id))
+        keys = [func.coalesce(recent.c.total, 0), Group.group_id]
+    else:
+        # Ids are assigned in creation order, so they double as the creation time
+        keys = [Group.group_id]
+    return query, keys
+
+
+def _load_page(db: Session, sort: str, cursor: Optional[str], limit: int) -> dict:
+    after_keys = decode_cursor(cursor, sort, _SORT_KEY_COUNTS, timestamp_sorts=()) if cursor else None
+
+    query, keys = _directory_query(db, sort)
+    labelled = [key.label(f"sort_key_{i}") for i, key in enumerate(keys)]
+    query = query.add_columns(*labelled)
+    if after_keys is not None:
+        query = query.filter(keyset_after(keys, after_keys))
+    rows = query.order_by(*[key.desc() for key in keys]).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, f"sort_key_{i}") for i in range(len(keys))])
+
+    groups = [GroupResponse.model_validate(row[0]).model_dump(mode="json") for row in rows]
+    return {"groups": groups, "next_cursor": next_cursor}
+
+
+def load_directory(
+    db: Session,
+    sort: str = "new",
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> dict:
+    """One page of the public directory as `{"groups", "next_cursor"}`.
+
+    Raises InvalidCursor for cursors that were not issued for `sort`.
+    """
+    key = (sort, cursor, limit)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    page = _load_page(db, sort, cursor, limit)
+    with _cache_lock:
+        if len(_cache) >= DIRECTORY_CACHE_MAX_PAGES:
+            for stale in [k for k, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[stale]
+            if len(_cache) >= DIRECTORY_CACHE_MAX_PAGES:
+                _cache.clear()
+        _cache[key] = (now + DIRECTORY_CACHE_SECONDS, page)
+    return page
+
+
+def invalidate() -> None:
+    """Drop every cached directory page in this process."""
+    with _cache_lock:
+        _cache.clear()
+
+
+invalidation.subscribe("group", lambda group_id: invalidate())
+
+
+def _adjust_counter(delivery: outbox.Delivery, column, group_id: int, delta: int) -> None:
+    delivery.db.query(Group).filter(Group.group_id == group_id).update(
+        {column: column + delta}, synchronize_session=False
+    )
+    delivery.after_commit(lambda: entity_cache.invalidate("group", group_id))
+
+
+def _count_prediction(delivery: outbox.Delivery) -> None:
+    if delivery.payload["group_id"]:
+        delta = -1 if delivery.kind == "prediction_deleted" else 1
+        _adjust_counter(delivery, Group.prediction_count, delivery.payload["group_id"], delta)
+
+
+def _count_member(delivery: outbox.Delivery) -> None:
+    delta = 1 if delivery.kind == "group_joined" else -1
+    _adjust_counter(delivery, Group.member_count, delivery.payload["group_id"], delta)
+
+
+outbox.register("prediction_created", _count_prediction)
+outbox.register("prediction_deleted", _count_prediction)
+outbox.register("group_joined", _count_member)
+outbox.register("group_left", _count_member)
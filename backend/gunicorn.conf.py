@@ -0,0 +1,26 @@
+"""
+gunicorn settings for the API:
+
+    gunicorn main:app -c gunicorn.conf.py
+
+The app is imported and warmed up (see main.warm_up) once in the master, and
+the workers fork from it. They share those pages and serve their first
+request without loading anything. Everything that must not be shared
+(database connections, the invalidation bus, the metrics writer) starts in
+each worker's startup handlers. The schema is managed by `alembic upgrade
+head` alone.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master before the first worker is forked
+    if server.cfg.preload_app:
+        import main
+
+        main.warm_up()
@@ -0,0 +1,292 @@
+"""
+Cross-worker cache invalidation bus.
+
+Mutating endpoints publish the entities they changed as keys such as
+`group:12` or `user:3`; caches subscribe to the kinds they hold. Subscribers
+in the publishing process are called synchronously inside `publish()`, so a
+worker never serves its own stale data. The backend then carries the key to
+the other workers, where a listener thread calls their subscribers.
+
+Backends, picked with the INVALIDATION_BACKEND setting:
+
+- `inprocess`: no delivery to other processes. For tests and single-process
+  development servers.
+- `local`: every worker binds a Unix datagram socket in
+  INVALIDATION_SOCKET_DIR and sends each key to all the others. Covers
+  `gunicorn -w 4` on one host.
+- `postgres`: `NOTIFY` on a channel every worker `LISTEN`s on. Covers
+  workers spread across hosts that share the database.
+
+Delivery is best effort. Messages that cannot be handed to a peer count as
+dropped; every cache that subscribes also has a TTL, which bounds how stale
+it can get when that happens.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Union
+
+from sqlalchemy.engine import make_url
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+EntityId = Union[int, str]
+Callback = Callable[[EntityId], None]
+
+KINDS = ("prediction", "user", "group", "comment")
+POSTGRES_CHANNEL = "cache_invalidation"
+RECONNECT_DELAY = 5.0  # seconds
+SEND_TIMEOUT = 0.05  # seconds to wait for a busy peer before dropping the message
+
+
+def _encode(kind: str, entity_id: EntityId, origin: str) -> bytes:
+    return json.dumps({"k": f"{kind}:{entity_id}", "t": time.time(), "o": origin}).encode("utf-8")
+
+
+def _decode(payload: Union[bytes, str]):
+    message = json.loads(payload)
+    kind, _, entity_id = message["k"].partition(":")
+    return kind, int(entity_id) if entity_id.isdigit() else entity_id, message["t"], message["o"]
+
+
+class InProcessBackend:
+    """Delivers nothing beyond this process."""
+
+    name = "inprocess"
+
+    def start(self, receive: Callable[[bytes], None]) -> None:
+        pass
+
+    def send(self, payload: bytes) -> int:
+        """Hand `payload` to the other workers; returns how many peers it could not reach."""
+        return 0
+
+    def stop(self) -> None:
+        pass
+
+
+class LocalSocketBackend:
+    """Unix datagram sockets, one per worker, in a shared directory."""
+
+    name = "local"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._receiver = None
+        self._sender = None
+
+    def start(self, receive: Callable[[bytes], None]) -> None:
+        # Named after the worker's pid, so start() must run after forking
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.settimeout(SEND_TIMEOUT)
+        threading.Thread(target=self._listen, args=(self._receiver, receive), name="invalidation-local", daemon=True).start()
+
+    def _listen(self, receiver: socket.socket, receive: Callable[[bytes], None]) -> None:
+        while True:
+            try:
+                payload = receiver.recv(65536)
+            except OSError:
+                return  # Closed by stop()
+            receive(payload)
+
+    def send(self, payload: bytes) -> int:
+        if self._sender is None:
+            return 0
+        dropped = 0
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or peer == self.path:
+                continue
+            try:
+                self._sender.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # A worker that exited without cleaning up
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                # Peer's queue stayed full for SEND_TIMEOUT
+                dropped += 1
+        return dropped
+
+    def stop(self) -> None:
+        for sock in (self._receiver, self._sender):
+            if sock is not None:
+                sock.close()
+        self._receiver = self._sender = None
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class PostgresBackend:
+    """LISTEN/NOTIFY on a dedicated pair of connections."""
+
+    name = "postgres"
+
+    def __init__(self, database_url: str, channel: str = POSTGRES_CHANNEL):
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.channel = channel
+        self._notifier = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _connect(self):
+        import psycopg2
+
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def start(self, receive: Callable[[bytes], None]) -> None:
+        self._stopped.clear()
+        threading.Thread(target=self._listen, args=(receive,), name="invalidation-postgres", daemon=True).start()
+
+    def _listen(self, receive: Callable[[bytes], None]) -> None:
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], RECONNECT_DELAY) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        receive(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Invalidation listener lost its connection, reconnecting")
+                self._stopped.wait(RECONNECT_DELAY)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def send(self, payload: bytes) -> int:
+        with self._lock:
+            try:
+                if self._notifier is None or self._notifier.closed:
+                    self._notifier = self._connect()
+                with self._notifier.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload.decode("utf-8")))
+                return 0
+            except Exception:
+                logger.exception("Could not publish a cache invalidation")
+                self._notifier = None
+                return 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._lock:
+            if self._notifier is not None:
+                self._notifier.close()
+                self._notifier = None
+
+
+class InvalidationBus:
+    def __init__(self, backend):
+        self.backend = backend
+        self.origin = self._new_origin()
+        self._subscribers: Dict[str, List[Callback]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stats = {
+            "published": 0, "received": 0, "dropped": 0, "callback_errors": 0,
+            "latency_count": 0, "latency_seconds_sum": 0.0, "latency_seconds_max": 0.0,
+        }
+
+    def subscribe(self, kind: str, callback: Callback) -> None:
+        """Call `callback(entity_id)` whenever an entity of `kind` changes, in any worker."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown entity kind: {kind}")
+        self._subscribers[kind].append(callback)
+
+    def publish(self, kind: str, entity_id: EntityId) -> None:
+        """Invalidate `kind:entity_id` here and in every other worker. Call after committing."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown entity kind: {kind}")
+        self._dispatch(kind, entity_id)
+        dropped = self.backend.send(_encode(kind, entity_id, self.origin))
+        with self._lock:
+            self._stats["published"] += 1
+            self._stats["dropped"] += dropped
+
+    def _receive(self, payload: Union[bytes, str]) -> None:
+        try:
+            kind, entity_id, sent_at, origin = _decode(payload)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed invalidation message %r", payload)
+            return
+        if origin == self.origin:
+            return  # Our own NOTIFY; local subscribers already ran
+        latency = max(0.0, time.time() - sent_at)
+        with self._lock:
+            self._stats["received"] += 1
+            self._stats["latency_count"] += 1
+            self._stats["latency_seconds_sum"] += latency
+            self._stats["latency_seconds_max"] = max(self._stats["latency_seconds_max"], latency)
+        self._dispatch(kind, entity_id)
+
+    def _dispatch(self, kind: str, entity_id: EntityId) -> None:
+        for callback in self._subscribers.get(kind, ()):
+            try:
+                callback(entity_id)
+            except Exception:
+                logger.exception("Invalidation subscriber failed for %s:%s", kind, entity_id)
+                with self._lock:
+                    self._stats["callback_errors"] += 1
+
+    @staticmethod
+    def _new_origin() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self) -> None:
+        """Start receiving other workers' invalidations; call once per worker after forking."""
+        self.origin = self._new_origin()
+        self.backend.start(self._receive)
+
+    def stop(self) -> None:
+        self.backend.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        count = stats["latency_count"]
+        stats["latency_seconds_avg"] = stats["latency_seconds_sum"] / count if count else 0.0
+        stats["backend"] = self.backend.name
+        return stats
+
+
+def create_backend(name: str):
+    if name == "inprocess":
+        return InProcessBackend()
+    if name == "local":
+        return LocalSocketBackend(settings.invalidation_socket_dir)
+    if name == "postgres":
+        return PostgresBackend(settings.database_url)
+    raise ValueError(f"Unknown invalidation backend: {name}")
+
+
+bus = InvalidationBus(create_backend(settings.invalidation_backend))
+
+
+def subscribe(kind: str, callback: Callback) -> None:
+    bus.subscribe(kind, callback)
+
+
+def publish(kind: str, entity_id: EntityId) -> None:
+    bus.publish(kind, entity_id)
@@ -0,0 +1,152 @@
+"""
+Live prediction totals over Server-Sent Events.
+
+Every `prediction` invalidation on the invalidation bus, from this worker or
+another one, marks that prediction dirty for the subscribers watching it;
+that never queries or blocks. Each stream
+wakes up on the first change, waits out the rest of its
+COALESCE_INTERVAL, then loads the current totals of everything that changed
+in one query and sends one event per prediction. Any number of changes to a
+prediction within an interval therefore become a single event.
+
+A subscriber's pending state is a set of prediction ids, bounded by what it
+subscribed to, so a slow client never makes us queue events: while it is not
+reading, further changes merge into the set and it gets the latest totals
+once it catches up.
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+import fieldsets
+import invalidation
+from database import SessionLocal
+
+COALESCE_INTERVAL = 1.0  # seconds between events for one subscriber
+HEARTBEAT_INTERVAL = 15.0
+MAX_SUBSCRIBED_IDS = 100
+MAX_SUBSCRIBERS = 1000
+
+LIVE_FIELDS = frozenset({"vote_score", "backing_count", "comment_count"})
+
+
+class Subscription:
+    """One client's stream: the ids it watches and the ones that changed since its last event."""
+
+    def __init__(self, prediction_ids: Iterable[int], loop: asyncio.AbstractEventLoop):
+        self.prediction_ids = frozenset(prediction_ids)
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._dirty: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def mark(self, prediction_id: int) -> None:
+        """Record a change; safe to call from any thread."""
+        with self._lock:
+            first = not self._dirty
+            self._dirty.add(prediction_id)
+        if first:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def drain(self) -> Set[int]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        self._wake.clear()
+        return dirty
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a change; False if `timeout` passed without one."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class Broker:
+    """In-process pub/sub from prediction ids to the subscriptions watching them."""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, prediction_ids: Iterable[int]) -> Subscription:
+        subscription = Subscription(prediction_ids, asyncio.get_running_loop())
+        with self._lock:
+            self._count += 1
+            for prediction_id in subscription.prediction_ids:
+                self._subscribers.setdefault(prediction_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._count -= 1
+            for prediction_id in subscription.prediction_ids:
+                watchers = self._subscribers.get(prediction_id)
+                if watchers is None:
+                    continue
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._subscribers[prediction_id]
+
+    def publish(self, prediction_id: int) -> None:
+        with self._lock:
+            watchers = list(self._subscribers.get(prediction_id, ()))
+        for subscription in watchers:
+            subscription.mark(prediction_id)
+
+    def is_full(self) -> bool:
+        """Whether this process already serves MAX_SUBSCRIBERS streams."""
+        with self._lock:
+            return self._count >= MAX_SUBSCRIBERS
+
+
+broker = Broker()
+invalidation.subscribe("prediction", broker.publish)
+
+
+def load_totals(prediction_ids: Iterable[int]) -> List[dict]:
+    """Current totals for `prediction_ids`, in one query on a short-lived session."""
+    db = SessionLocal()
+    try:
+        return fieldsets.select_predictions(db, sorted(prediction_ids), LIVE_FIELDS)
+    finally:
+        db.close()
+
+
+def _event(totals: dict) -> str:
+    return f"event: totals\nid: {totals['prediction_id']}\ndata: {json.dumps(totals, separators=(',', ':'))}\n\n"
+
+
+async def stream(prediction_ids: Iterable[int], interval: Optional[float] = None) -> AsyncIterator[str]:
+    """SSE body for `prediction_ids`: current totals first, then coalesced changes.
+
+    The subscription lives exactly as long as the body is being sent.
+    """
+    interval = COALESCE_INTERVAL if interval is None else interval
+    subscription = broker.subscribe(prediction_ids)
+    try:
+        yield f"retry: {int(interval * 1000)}\n\n"
+        for totals in await run_in_threadpool(load_totals, subscription.prediction_ids):
+            yield _event(totals)
+
+        last_sent = time.monotonic()
+        while True:
+            if not await subscription.wait(HEARTBEAT_INTERVAL):
+                yield ": keep-alive\n\n"
+                continue
+            # Let further changes pile up until the interval since the last event is over
+            delay = last_sent + interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            changed = subscription.drain()
+            for totals in await run_in_threadpool(load_totals, changed):
+                yield _event(totals)
+            last_sent = time.monotonic()
+    finally:
+        broker.unsubscribe(subscription)
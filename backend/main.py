@@ -1,41 +1,63 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Query, Path, BackgroundTasks, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, asc
+from sqlalchemy.orm import Session, configure_mappers, joinedload
+from sqlalchemy import func, desc, asc, select
 from sqlalchemy import text # Make sure 'text' is imported from sqlalchemy at the top
+from sqlalchemy.exc import IntegrityError
 from typing import Optional, List
+import functools
 import hashlib
+import hmac
 import json
-from better_profanity import profanity
+import os
 from datetime import datetime, timedelta
 from profanity_list import custom_bad_words
 from config import settings
-from database import get_db, engine, Base
+from database import get_db, engine, ping
 from models import User, Prediction, Vote, Backing, Group, GroupMember, LoginType, Visibility, GroupRole, GroupVisibility, Comment, CommentVote
 from schemas import (
     UserCreate, UserResponse, UserProfile, Token, LoginRequest, GoogleAuthRequest,
     PredictionCreate, PredictionResponse, PredictionListResponse, VoteRequest, VoteResponse,
-    BackingResponse, PredictionReceipt, ErrorResponse, GroupCreate, GroupResponse, GroupListResponse,
-    MessageResponse, CommentCreate, CommentResponse
+    BackingResponse, PredictionReceipt, ReceiptProofStep, ReceiptVerifyRequest, ReceiptVerifyResult, ReceiptVerifyResponse, ErrorResponse, GroupCreate, GroupResponse, GroupListResponse,
+    MessageResponse, CommentCreate, CommentResponse, CommentThreadNode, CommentThreadResponse,
+    TrendingCategory, TrendingCategoriesResponse, FeedResponse
 )
+import activity
+import comment_threads
+import compression
+import entity_cache
+import feed
+import fieldsets
+import group_directory
+import invalidation
+import live
+import memberships
+import metrics
+import outbox
+import profiling
+import purge
+import rate_limits
+import receipts
+import response_cache
+import slow_queries
 
 from auth import (
     get_password_hash, verify_password, create_access_token,
     get_current_user, get_current_user_optional
 )
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="CallingItNow API",
     description="API for the CallingItNow prediction platform",
-    version="1.0.0"
+    version="1.0.0",
+    dependencies=[Depends(rate_limits.enforce)],
 )
 
-# Enhance the profanity filter with custom words
-profanity.add_censor_words(custom_bad_words)
+# Innermost first: cache hits are compressed already and still get CORS headers
+app.add_middleware(response_cache.ResponseCacheMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -46,16 +68,113 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def log_request_path(request, call_next):
-    print(f"Request received for path: {request.url.path}")
-    response = await call_next(request)
-    return response
+if profiling.enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_stats(
+    "membership_cache", memberships.stats,
+    counters=("hits", "misses", "invalidations"), gauges=("cached_users",),
+)
+metrics.register_stats("rate_limit", rate_limits.stats, counters=("allowed", "limited"))
+metrics.register_stats(
+    "response_cache", response_cache.stats,
+    counters=("hits", "misses", "stores", "invalidations"), gauges=("entries", "bytes"),
+)
+metrics.register_stats(
+    "entity_cache", entity_cache.stats,
+    counters=(
+        "local_hits", "shared_hits", "misses", "evictions", "expirations", "early_refreshes",
+        "coalesced", "coalesce_fallbacks", "shared_errors", "invalidations",
+    ),
+    gauges=("entries",),
+)
+metrics.register_stats(
+    "outbox", outbox.stats,
+    counters=("processed", "failed", "dead", "batches", "conflicts", "latency_count", "latency_seconds_sum"),
+    maxes=("latency_seconds_max", "lag_seconds"),
+)
+metrics.register_stats(
+    "invalidation_bus", invalidation.bus.stats,
+    counters=("published", "received", "dropped", "callback_errors", "latency_count", "latency_seconds_sum"),
+    maxes=("latency_seconds_max",),
+)
+
+@functools.lru_cache(maxsize=None)
+def profanity_filter():
+    """The profanity filter enhanced with our custom words, loaded on first use."""
+    from better_profanity import profanity
+    profanity.add_censor_words(custom_bad_words)
+    return profanity
+
+def warm_up():
+    """Load what the first requests would otherwise pay for.
+
+    gunicorn.conf.py calls this in the master when the app is preloaded, so
+    forked workers start with it all in place.
+    """
+    configure_mappers()
+    profanity_filter()
+    import jose.jwt  # noqa: F401  auth imports it on first use
 
 @app.get("/healthcheck")
 def healthcheck():
     return {"status": "ok"}
 
+@app.get("/readyz")
+def readyz(response: Response):
+    """Whether this worker can serve traffic, i.e. reach the database. /healthcheck only says it is running."""
+    error = ping()
+    if error is not None:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "unavailable", "database": error}
+    return {"status": "ready"}
+
+@app.on_event("startup")
+def reset_connection_pool():
+    # A preloading master must not hand its pooled connections to the workers
+    engine.dispose(close=False)
+
+@app.on_event("startup")
+def start_invalidation_bus():
+    invalidation.bus.start()
+
+@app.on_event("startup")
+def start_metrics():
+    metrics.start()
+
+@app.on_event("startup")
+def start_outbox_processor():
+    outbox.processor.start()
+
+@app.on_event("shutdown")
+def stop_outbox_processor():
+    outbox.processor.stop()
+
+@app.on_event("shutdown")
+def stop_metrics():
+    metrics.stop()
+
+@app.on_event("shutdown")
+def stop_invalidation_bus():
+    invalidation.bus.stop()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request, cache and invalidation bus metrics for every worker, in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    """Gate for /internal/ endpoints; they do not exist unless INTERNAL_TOKEN is set."""
+    if not settings.internal_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_internal_token is None or not hmac.compare_digest(x_internal_token, settings.internal_token):
+        raise HTTPException(status_code=403, detail="Invalid internal token")
+
+@app.get("/internal/slow-queries", dependencies=[Depends(require_internal_token)])
+def get_slow_queries(limit: int = Query(slow_queries.TOP_N, ge=1, le=slow_queries.TRACKED_SHAPES)):
+    """The slowest statement shapes this worker ran in the last hour, with their plans."""
+    return {"pid": os.getpid(), "threshold_ms": settings.slow_query_ms, "queries": slow_queries.top(limit)}
+
 def generate_prediction_hash(user_id: int, title: str, content: str, timestamp: datetime) -> str:
     """Generate a unique hash for a prediction."""
     data = f"{user_id}:{title}:{content}:{timestamp.isoformat()}"
@@ -83,10 +202,22 @@ def get_user_backing(prediction_id: int, user_id: Optional[int], db: Session) ->
     backing = db.query(Backing).filter(Backing.prediction_id == prediction_id, Backing.backer_user_id == user_id).first()
     return backing is not None
 
+def sparse_prediction_list(query, total: int, page: int, per_page: int, fields: frozenset, current_user: Optional[User], db: Session):
+    """Build a PredictionListResponse-shaped payload holding only the requested fields."""
+    page_ids = [row[0] for row in query.with_entities(Prediction.prediction_id).offset((page - 1) * per_page).limit(per_page)]
+    viewer_id = current_user.user_id if current_user else None
+    return fieldsets.sparse_response({
+        "predictions": fieldsets.select_predictions(db, page_ids, fields, viewer_id),
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+    })
+
 @app.get("/predictions/my", response_model=PredictionListResponse)
 def list_my_predictions(
     page: int = 1,
     per_page: int = 10,
+    selected_fields: Optional[frozenset] = Depends(fieldsets.prediction_fields),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -95,6 +226,9 @@ def list_my_predictions(
     query = query.order_by(Prediction.timestamp.desc())
     
     total = query.count()
+    if selected_fields is not None:
+        return sparse_prediction_list(query, total, page, per_page, selected_fields, current_user, db)
+
     predictions_db = query.offset((page - 1) * per_page).limit(per_page).all()
 
     # This part requires that your main.py imports PredictionResponse
@@ -181,21 +315,14 @@ def get_current_user_profile(current_user: User = Depends(get_current_user), db:
 
 # Prediction endpoints
 @app.post("/predictions", response_model=PredictionResponse, status_code=status.HTTP_201_CREATED)
-def create_prediction(prediction_data: PredictionCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def create_prediction(prediction_data: PredictionCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Create a new prediction."""
     if prediction_data.group_id:
-        member = db.query(GroupMember).filter(
-            GroupMember.group_id == prediction_data.group_id,
-            GroupMember.user_id == current_user.user_id
-        ).first()
-        if not member:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You are not a member of this group."
-            )
+        memberships.require_member(db, current_user, prediction_data.group_id)
 
 
     # Check for profanity but don't censor here
+    profanity = profanity_filter()
     has_profanity = profanity.contains_profanity(prediction_data.title) or profanity.contains_profanity(prediction_data.content)
 
     # Censor content for display later if needed
@@ -223,8 +350,18 @@ def create_prediction(prediction_data: PredictionCreate, db: Session = Depends(g
         contains_profanity=has_profanity
     )
     db.add(prediction)
+    db.flush()
+    # Group counters and trending activity are updated from the event
+    outbox.add(
+        db, "prediction_created",
+        prediction_id=prediction.prediction_id, group_id=prediction.group_id, category=prediction.category,
+        visibility=prediction.visibility.value, timestamp=now.isoformat(),
+    )
     db.commit()
     db.refresh(prediction)
+    entity_cache.invalidate("prediction", prediction.prediction_id)
+    background_tasks.add_task(activity.compact_if_due)
+    background_tasks.add_task(receipts.seal_if_due)
 
     return PredictionResponse(
         **prediction.__dict__,
@@ -237,17 +374,44 @@ def create_prediction(prediction_data: PredictionCreate, db: Session = Depends(g
     )
 
 
+@app.get("/feed/home", response_model=FeedResponse)
+def get_home_feed(
+    cursor: Optional[str] = None,
+    limit: int = Query(feed.DEFAULT_PAGE_SIZE, ge=1, le=feed.MAX_PAGE_SIZE),
+    selected_fields: Optional[frozenset] = Depends(fieldsets.prediction_fields),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Newest predictions from all of the current user's groups, as one timeline.
+
+    Pass the returned `next_cursor` back as `cursor` to get the next page.
+    """
+    try:
+        page = feed.load_home_feed(db, current_user, cursor, limit, selected_fields)
+    except feed.InvalidCursor as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    if selected_fields is not None:
+        return fieldsets.sparse_response(page)
+    return page
+
+
 @app.get("/predictions", response_model=PredictionListResponse)
 def get_predictions(
+    request: Request,
     category: Optional[str] = None,
     sort: str = Query("recent", regex="^(recent|popular|controversial)$"),
     page: int = Query(1, ge=1),
     per_page: int = Query(20, ge=1, le=100),
     safe_search: bool = False, # Add this line
+    selected_fields: Optional[frozenset] = Depends(fieldsets.prediction_fields),
     current_user: Optional[User] = Depends(get_current_user_optional),
     db: Session = Depends(get_db)
 ):
     """Get public predictions with filtering and pagination."""
+    if current_user is None:
+        response_cache.cache_for(request, response_cache.FEED_MAX_AGE)
     query = db.query(Prediction).filter(Prediction.visibility == Visibility.PUBLIC)
     
     if category:
@@ -268,35 +432,14 @@ def get_predictions(
         query = query.outerjoin(Vote).group_by(Prediction.prediction_id).order_by(desc(func.count(Vote.vote_id)))
     
     total = query.count()
-    predictions = query.offset((page - 1) * per_page).limit(per_page).all()
-    
-    # Build response with additional data
-    prediction_responses = []
-    for prediction in predictions:
-        vote_score = calculate_vote_score(prediction.prediction_id, db)
-        backing_count = db.query(Backing).filter(Backing.prediction_id == prediction.prediction_id).count()
-        user_vote = get_user_vote(prediction.prediction_id, current_user.user_id if current_user else None, db)
-        user_backed = get_user_backing(prediction.prediction_id, current_user.user_id if current_user else None, db)
-        comment_count = db.query(Comment).filter(Comment.prediction_id == prediction.prediction_id).count()
-        
-        prediction_responses.append(PredictionResponse(
-            prediction_id=prediction.prediction_id,
-            user_id=prediction.user_id,
-            title=prediction.title,
-            content=prediction.content,
-            category=prediction.category,
-            visibility=prediction.visibility,
-            allow_backing=prediction.allow_backing,
-            timestamp=prediction.timestamp,
-            hash=prediction.hash,
-            user=prediction.user,
-            vote_score=vote_score,
-            backing_count=backing_count,
-            user_vote=user_vote,
-            user_backed=user_backed,
-            comment_count=comment_count,
-        ))
-        
+    if selected_fields is not None:
+        return sparse_prediction_list(query, total, page, per_page, selected_fields, current_user, db)
+
+    page_ids = [row[0] for row in query.with_entities(Prediction.prediction_id).offset((page - 1) * per_page).limit(per_page)]
+    # Authors and totals for the whole page at once, rather than five queries per prediction
+    viewer_id = current_user.user_id if current_user else None
+    prediction_responses = [PredictionResponse(**item) for item in feed.full_predictions(db, page_ids, viewer_id)]
+
     return PredictionListResponse(
         predictions=prediction_responses,
         total=total,
@@ -308,22 +451,31 @@ def get_predictions(
 @app.get("/predictions/{prediction_id}", response_model=PredictionResponse)
 def get_prediction(
     prediction_id: int,
+    selected_fields: Optional[frozenset] = Depends(fieldsets.prediction_fields),
     current_user: Optional[User] = Depends(get_current_user_optional),
     db: Session = Depends(get_db)
     ):
 
     """Get a specific prediction by ID."""
-    prediction = db.query(Prediction).filter(Prediction.prediction_id == prediction_id).first()
+    prediction = entity_cache.load_prediction(db, prediction_id)
     if not prediction:
         raise HTTPException(status_code=404, detail="Prediction not found")
     
     # Check visibility
     if prediction.visibility == Visibility.PRIVATE and (not current_user or current_user.user_id != prediction.user_id):
         raise HTTPException(status_code=404, detail="Prediction not found")
+
+    if selected_fields is not None:
+        viewer_id = current_user.user_id if current_user else None
+        return fieldsets.sparse_response(
+            fieldsets.select_predictions(db, [prediction_id], selected_fields, viewer_id)[0]
+        )
     
-    vote_score = calculate_vote_score(prediction.prediction_id, db)
-    backing_count = db.query(Backing).filter(Backing.prediction_id == prediction.prediction_id).count()
-    comment_count=db.query(Comment).filter(Comment.prediction_id == prediction.prediction_id).count()
+    counts = entity_cache.cached("prediction_counts", prediction.prediction_id, lambda: {
+        "vote_score": calculate_vote_score(prediction.prediction_id, db),
+        "backing_count": db.query(Backing).filter(Backing.prediction_id == prediction.prediction_id).count(),
+        "comment_count": db.query(Comment).filter(Comment.prediction_id == prediction.prediction_id).count(),
+    })
     user_vote = get_user_vote(prediction.prediction_id, current_user.user_id if current_user else None, db)
     user_backed = get_user_backing(prediction.prediction_id, current_user.user_id if current_user else None, db)
     
@@ -345,14 +497,57 @@ def get_prediction(
             wisdom_level=prediction.user.wisdom_level,
             created_at=prediction.user.created_at
         ),
-        vote_score=vote_score,
-        backing_count=backing_count,
-        comment_count=comment_count,
+        vote_score=counts["vote_score"],
+        backing_count=counts["backing_count"],
+        comment_count=counts["comment_count"],
         user_vote=user_vote,
         user_backed=user_backed
     )
 
 
+@app.get("/live/predictions", response_class=StreamingResponse)
+def live_prediction_totals(
+    ids: str = Query(..., description="Comma-separated prediction ids to watch"),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream vote score, backing count and comment count of predictions as Server-Sent Events.
+
+    Sends the current totals first, then at most one `totals` event per
+    prediction per second while they change.
+    """
+    try:
+        prediction_ids = {int(value) for value in ids.split(",") if value.strip()}
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    if not prediction_ids or len(prediction_ids) > live.MAX_SUBSCRIBED_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Subscribe to between 1 and {live.MAX_SUBSCRIBED_IDS} predictions"
+        )
+    if live.broker.is_full():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many live subscribers, poll instead")
+
+    # Same rule as get_prediction: private predictions are only visible to their author
+    visible = Prediction.visibility == Visibility.PUBLIC
+    if current_user:
+        visible = visible | (Prediction.user_id == current_user.user_id)
+    visible_ids = [row[0] for row in db.query(Prediction.prediction_id).filter(
+        Prediction.prediction_id.in_(prediction_ids), visible
+    )]
+    # The stream outlives the request; don't hold a connection for it
+    db.close()
+    if not visible_ids:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+
+    return StreamingResponse(
+        live.stream(visible_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/predictions/{prediction_id}/vote", response_model=VoteResponse)
 def vote_prediction(
     prediction_id: int,
@@ -374,6 +569,7 @@ def vote_prediction(
     if existing_vote:
         # Update existing vote
         existing_vote.value = vote_data.value
+        outbox.add(db, "prediction_voted", prediction_id=prediction_id, user_id=current_user.user_id, value=vote_data.value)
         db.commit()
         db.refresh(existing_vote)
         return VoteResponse(
@@ -391,6 +587,7 @@ def vote_prediction(
             value=vote_data.value
         )
         db.add(vote)
+        outbox.add(db, "prediction_voted", prediction_id=prediction_id, user_id=current_user.user_id, value=vote_data.value)
         db.commit()
         db.refresh(vote)
         return VoteResponse(
@@ -402,6 +599,15 @@ def vote_prediction(
         )
 
 
+def invalidate_vote_totals(delivery: outbox.Delivery) -> None:
+    """Drop the cached prediction and its totals, which the vote changed."""
+    prediction_id = delivery.payload["prediction_id"]
+    delivery.after_commit(lambda: entity_cache.invalidate("prediction", prediction_id))
+
+
+outbox.register("prediction_voted", invalidate_vote_totals)
+
+
 @app.post("/predictions/{prediction_id}/back", response_model=BackingResponse)
 def back_prediction(
     prediction_id: int,
@@ -431,12 +637,11 @@ def back_prediction(
         backer_user_id=current_user.user_id
     )
     db.add(backing)
-    
-    # Update wisdom level of prediction author
-    prediction.user.wisdom_level += 1
-    
+    # The author's wisdom level goes up from the event
+    outbox.add(db, "prediction_backed", prediction_id=prediction_id, author_id=prediction.user_id)
     db.commit()
     db.refresh(backing)
+    entity_cache.invalidate("prediction", prediction_id)
     
     return BackingResponse(
         backing_id=backing.backing_id,
@@ -469,18 +674,61 @@ def unback_prediction(
     if not backing:
         raise HTTPException(status_code=404, detail="Not backed")
 
-    # Decrement wisdom level of prediction author, ensuring it doesn't go below 0
-    if backing.prediction.user.wisdom_level > 0:
-        backing.prediction.user.wisdom_level -= 1
-
+    author_id = backing.prediction.user_id
     db.delete(backing)
+    outbox.add(db, "prediction_unbacked", prediction_id=prediction_id, author_id=author_id)
     db.commit()
+    entity_cache.invalidate("prediction", prediction_id)
     return
 
 
+def adjust_wisdom(delivery: outbox.Delivery) -> None:
+    """Credit a prediction's author for a backing, or take it back, never going below 0."""
+    author_id = delivery.payload["author_id"]
+    query = delivery.db.query(User).filter(User.user_id == author_id)
+    if delivery.kind == "prediction_backed":
+        query.update({User.wisdom_level: User.wisdom_level + 1}, synchronize_session=False)
+    else:
+        query.filter(User.wisdom_level > 0).update({User.wisdom_level: User.wisdom_level - 1}, synchronize_session=False)
+    delivery.after_commit(lambda: entity_cache.invalidate("user", author_id))
+
+
+outbox.register("prediction_backed", adjust_wisdom)
+outbox.register("prediction_unbacked", adjust_wisdom)
+
+
+def prediction_deleted_payload(prediction, group_gone: bool = False) -> dict:
+    """The `prediction_deleted` event of a Prediction, or of a row with the same columns.
+
+    With `group_gone` the group is deleted along with it, so there is no
+    group counter left to take it out of.
+    """
+    return dict(
+        prediction_id=prediction.prediction_id, group_id=None if group_gone else prediction.group_id,
+        category=prediction.category, visibility=prediction.visibility.value,
+        # Naive UTC like the created event's; the column is timestamptz on Postgres
+        timestamp=activity.naive_utc(prediction.timestamp).isoformat(),
+    )
+
+
+def add_prediction_deleted(db: Session, prediction: Prediction) -> None:
+    """Record that `prediction` is going; group counters and trending activity take it back from the event."""
+    outbox.add(db, "prediction_deleted", **prediction_deleted_payload(prediction))
+
+
+def invalidate_deleted_prediction(delivery: outbox.Delivery) -> None:
+    """Drop the cached prediction, also when it went with its group."""
+    prediction_id = delivery.payload["prediction_id"]
+    delivery.after_commit(lambda: entity_cache.invalidate("prediction", prediction_id))
+
+
+outbox.register("prediction_deleted", invalidate_deleted_prediction)
+
+
 @app.delete("/predictions/{prediction_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_prediction(
     prediction_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -493,29 +741,60 @@ def delete_prediction(
     if prediction.user_id != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this prediction")
 
-    # Manually delete associated votes and backings due to lack of cascade
-    db.query(Vote).filter(Vote.prediction_id == prediction_id).delete()
-    db.query(Backing).filter(Backing.prediction_id == prediction_id).delete()
+    add_prediction_deleted(db, prediction)
+
+    # Large predictions are hidden now and purged in chunks after the response
+    if purge.prediction_child_count(db, prediction_id) > purge.PURGE_THRESHOLD:
+        purge.tombstone(db, prediction)
+        background_tasks.add_task(purge.purge_prediction, prediction_id)
+        return
 
-    db.delete(prediction)
+    # Votes, backings, comments and comment votes go with it via ON DELETE CASCADE
+    db.query(Prediction).filter(Prediction.prediction_id == prediction_id).delete(synchronize_session=False)
     db.commit()
     return
 
 @app.get("/predictions/{prediction_id}/receipt", response_model=PredictionReceipt)
 def get_prediction_receipt(
+    request: Request,
     prediction_id: int,
     current_user: Optional[User] = Depends(get_current_user_optional),
     db: Session = Depends(get_db)
 ):
-    """Get a prediction receipt."""
-    prediction = db.query(Prediction).filter(Prediction.prediction_id == prediction_id).first()
+    """Get a prediction receipt, with its Merkle inclusion proof once it is sealed."""
+    return load_receipt(request, db, current_user, prediction_id)
+
+
+@app.get("/receipts/{prediction_hash}", response_model=PredictionReceipt)
+def get_receipt_by_hash(
+    request: Request,
+    prediction_hash: str = Path(..., regex="^[0-9a-fA-F]{64}$"),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Look a receipt up by the prediction hash it carries."""
+    prediction_id = entity_cache.prediction_id_for_hash(db, prediction_hash)
+    if prediction_id is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    return load_receipt(request, db, current_user, prediction_id)
+
+
+def load_receipt(request: Request, db: Session, current_user: Optional[User], prediction_id: int) -> PredictionReceipt:
+    """The receipt of a prediction, if the user may see it.
+
+    Sealed receipts of public predictions no longer change, so anonymous
+    copies are cached until the prediction is deleted.
+    """
+    prediction = entity_cache.load_prediction(db, prediction_id, sealed=True)
     if not prediction:
         raise HTTPException(status_code=404, detail="Prediction not found")
     
     # Check visibility
     if prediction.visibility == Visibility.PRIVATE and (not current_user or current_user.user_id != prediction.user_id):
         raise HTTPException(status_code=404, detail="Prediction not found")
-    
+
+    if prediction.receipt_batch is not None and prediction.visibility == Visibility.PUBLIC:
+        response_cache.cache_for(request, response_cache.RECEIPT_MAX_AGE, [("prediction", prediction.prediction_id)])
     return PredictionReceipt(
         prediction_id=prediction.prediction_id,
         title=prediction.title,
@@ -523,7 +802,51 @@ def get_prediction_receipt(
         user_handle=prediction.user.handle,
         timestamp=prediction.timestamp,
         hash=prediction.hash,
-        verification_url=f"https://callingitnow.com/predictions/{prediction_id}"
+        verification_url=f"https://callingitnow.com/predictions/{prediction.prediction_id}",
+        **receipt_proof_fields(prediction)
+    )
+
+
+def receipt_proof_fields(prediction: Prediction) -> dict:
+    """The Merkle batch part of a receipt; empty until the prediction is sealed."""
+    batch = prediction.receipt_batch
+    if batch is None:
+        return {}
+    return dict(
+        batch_id=batch.batch_id,
+        merkle_root=batch.root,
+        sealed_at=batch.sealed_at,
+        leaf_index=prediction.receipt_leaf_index,
+        proof=[ReceiptProofStep(side=side, hash=sibling) for side, sibling in receipts.load_proof(prediction)],
+    )
+
+
+@app.post("/receipts/verify", response_model=ReceiptVerifyResponse)
+def verify_receipts(request: ReceiptVerifyRequest, db: Session = Depends(get_db)):
+    """Check receipts against the stored Merkle roots, in one query for the whole request."""
+    valid = receipts.verify(db, [
+        (receipt.hash, receipt.batch_id, [(step.side, step.hash) for step in receipt.proof])
+        for receipt in request.receipts
+    ])
+    results = [
+        ReceiptVerifyResult(hash=receipt.hash, batch_id=receipt.batch_id, valid=is_valid)
+        for receipt, is_valid in zip(request.receipts, valid)
+    ]
+    valid_count = sum(valid)
+    return ReceiptVerifyResponse(results=results, valid_count=valid_count, invalid_count=len(valid) - valid_count)
+
+
+@app.get("/categories/trending", response_model=TrendingCategoriesResponse)
+def get_trending_categories(
+    window: str = Query("24h", regex="^(24h|7d|30d)$"),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """Categories with the most new public predictions over the window."""
+    rows = activity.top(db, activity.CATEGORY_PREDICTIONS, activity.WINDOWS[window], limit)
+    return TrendingCategoriesResponse(
+        window=window,
+        categories=[TrendingCategory(category=key, prediction_count=total) for key, total in rows]
     )
 
 
@@ -544,7 +867,8 @@ def create_group(group: GroupCreate, db: Session = Depends(get_db), current_user
         name=group.name,
         description=group.description,
         visibility=group.visibility.value, # Pass the lowercase string value
-        created_by=current_user.user_id
+        created_by=current_user.user_id,
+        member_count=1
     )
     db.add(new_group)
     db.flush()
@@ -555,9 +879,10 @@ def create_group(group: GroupCreate, db: Session = Depends(get_db), current_user
         role=GroupRole.OWNER.value # Also use .value for the role
     )
     db.add(new_member)
-    
     db.commit()
     db.refresh(new_group)
+    entity_cache.invalidate("user", current_user.user_id)
+    entity_cache.invalidate("group", new_group.group_id)
 
     return GroupResponse(
         group_id=new_group.group_id,
@@ -571,46 +896,29 @@ def create_group(group: GroupCreate, db: Session = Depends(get_db), current_user
 
 
 @app.get("/groups", response_model=GroupListResponse, tags=["groups"])
-def get_groups(sort: Optional[str] = Query(None, regex="^(popular|top)$"), db: Session = Depends(get_db)):
+def get_groups(
+    response: Response,
+    sort: str = Query("new", regex="^(new|top|members|popular)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(group_directory.DEFAULT_PAGE_SIZE, ge=1, le=group_directory.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
     """
-    Get a list of all public groups, with sorting options.
-    - `popular`: Groups with the most new predictions in the last 24 hours.
+    Get a page of public groups, with sorting options.
+    - `new`: Most recently created groups first (default).
     - `top`: Groups with the most predictions of all time.
-    """
-    query = db.query(Group).filter(Group.visibility == GroupVisibility.PUBLIC.value)
+    - `members`: Groups with the most members.
+    - `popular`: Groups with the most new predictions in the last 24 hours.
 
-    if sort == "top":
-        query = query.outerjoin(Prediction, Group.group_id == Prediction.group_id)\
-                     .group_by(Group.group_id)\
-                     .order_by(desc(func.count(Prediction.prediction_id)))
-    elif sort == "popular":
-        one_day_ago = datetime.utcnow() - timedelta(days=1)
-        query = query.outerjoin(Prediction, Group.group_id == Prediction.group_id)\
-                     .filter(Prediction.timestamp >= one_day_ago)\
-                     .group_by(Group.group_id)\
-                     .order_by(desc(func.count(Prediction.prediction_id)))
-    else:
-        # Default sort by most recent
-        query = query.order_by(desc(Group.created_at))
+    Pass the returned `next_cursor` back as `cursor` to get the next page.
+    """
+    try:
+        page = group_directory.load_directory(db, sort, cursor, limit)
+    except group_directory.InvalidCursor as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
 
-    groups_db = query.all()
-    
-    group_responses = []
-    for group in groups_db:
-        member_count = db.query(GroupMember).filter(GroupMember.group_id == group.group_id).count()
-        group_responses.append(
-            GroupResponse(
-                group_id=group.group_id,
-                name=group.name,
-                description=group.description,
-                visibility=group.visibility,
-                creator=group.creator,
-                created_at=group.created_at,
-                member_count=member_count
-            )
-        )
-        
-    return GroupListResponse(groups=group_responses)
+    response.headers["Cache-Control"] = f"public, max-age={group_directory.DIRECTORY_CACHE_SECONDS}"
+    return page
 
 @app.get("/groups/me", response_model=GroupListResponse, tags=["groups"])
 def get_my_groups(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -618,34 +926,31 @@ def get_my_groups(db: Session = Depends(get_db), current_user: User = Depends(ge
     Get a list of all groups the current user is a member of,
     sorted by the number of new predictions in the last 7 days.
     """
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-
-    # Subquery to count recent predictions for each group
-    recent_predictions_subquery = db.query(
-        Prediction.group_id,
-        func.count(Prediction.prediction_id).label('recent_prediction_count')
-    ).filter(
-        Prediction.timestamp >= seven_days_ago
-    ).group_by(Prediction.group_id).subquery()
+    # Predictions per group over the last 7 days, summed from the activity buckets
+    my_group_keys = select(activity.key_column(GroupMember.group_id)).where(
+        GroupMember.user_id == current_user.user_id
+    )
+    recent_predictions = activity.window_totals(
+        db, activity.GROUP_PREDICTIONS, activity.WINDOWS["7d"], keys=my_group_keys
+    )
 
-    # Main query to get user's groups and join with the subquery
+    # Main query to get user's groups and join with the totals
     groups_db = db.query(
         Group,
-        recent_predictions_subquery.c.recent_prediction_count
-    ).join(
+        func.coalesce(recent_predictions.c.total, 0)
+    ).options(joinedload(Group.creator)).join(
         GroupMember, Group.group_id == GroupMember.group_id
     ).outerjoin(
-        recent_predictions_subquery, Group.group_id == recent_predictions_subquery.c.group_id
+        recent_predictions, recent_predictions.c.key == activity.key_column(Group.group_id)
     ).filter(
         GroupMember.user_id == current_user.user_id
     ).order_by(
-        desc(func.coalesce(recent_predictions_subquery.c.recent_prediction_count, 0)),
+        desc(func.coalesce(recent_predictions.c.total, 0)),
         Group.name
     ).all()
 
     group_responses = []
     for group, recent_prediction_count in groups_db:
-        member_count = db.query(GroupMember).filter(GroupMember.group_id == group.group_id).count()
         group_responses.append(
             GroupResponse(
                 group_id=group.group_id,
@@ -654,7 +959,7 @@ def get_my_groups(db: Session = Depends(get_db), current_user: User = Depends(ge
                 visibility=group.visibility,
                 creator=group.creator,
                 created_at=group.created_at,
-                member_count=member_count,
+                member_count=group.member_count,
                 is_member=True # User is always a member in this query
             )
         )
@@ -667,21 +972,16 @@ def get_group(group_id: int, db: Session = Depends(get_db), current_user: Option
     Get details for a single group by its ID.
     Includes 'is_member' flag if a user is authenticated.
     """
-    group = db.query(Group).filter(Group.group_id == group_id).first()
+    group = entity_cache.load_group(db, group_id)
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Group not found."
         )
 
-    member_count = db.query(GroupMember).filter(GroupMember.group_id == group.group_id).count()
-    
     is_member = None
     if current_user:
-        is_member = db.query(GroupMember).filter(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == current_user.user_id
-        ).first() is not None
+        is_member = memberships.role_in(db, current_user, group_id) is not None
 
     # Manually create a dictionary with all required fields
     group_data = {
@@ -691,7 +991,7 @@ def get_group(group_id: int, db: Session = Depends(get_db), current_user: Option
         "visibility": group.visibility,
         "creator": group.creator,
         "created_at": group.created_at,
-        "member_count": member_count,
+        "member_count": group.member_count,
         "is_member": is_member
     }
     # Validate the complete dictionary
@@ -702,6 +1002,7 @@ def get_group_predictions(
     group_id: int,
     page: int = Query(1, ge=1),
     per_page: int = Query(10, ge=1, le=100),
+    selected_fields: Optional[frozenset] = Depends(fieldsets.prediction_fields),
     current_user: Optional[User] = Depends(get_current_user_optional),
     db: Session = Depends(get_db)
 ):
@@ -712,12 +1013,19 @@ def get_group_predictions(
         raise HTTPException(status_code=404, detail="Group not found")
 
     # Basic visibility check (can be expanded later)
-    if group.visibility != 'public' and (not current_user or not db.query(GroupMember).filter(GroupMember.group_id == group_id, GroupMember.user_id == current_user.user_id).first()):
-         raise HTTPException(status_code=403, detail="You do not have permission to view this group's predictions.")
+    if group.visibility != 'public':
+        memberships.require_member(db, current_user, group_id, detail="You do not have permission to view this group's predictions.")
 
-    query = db.query(Prediction).filter(Prediction.group_id == group_id).order_by(desc(Prediction.timestamp))
+    # Other members' private predictions stay hidden, as on the home timeline
+    viewer_id = current_user.user_id if current_user else None
+    query = db.query(Prediction).filter(
+        Prediction.group_id == group_id, feed.visible_to(viewer_id)
+    ).order_by(desc(Prediction.timestamp))
 
     total = query.count()
+    if selected_fields is not None:
+        return sparse_prediction_list(query, total, page, per_page, selected_fields, current_user, db)
+
     predictions_db = query.offset((page - 1) * per_page).limit(per_page).all()
 
     prediction_responses = []
@@ -767,17 +1075,12 @@ def join_group(group_id: int, db: Session = Depends(get_db), current_user: User
             detail="This group is private and cannot be joined directly."
         )
 
-    # Check if user is already a member
-    existing_member = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == current_user.user_id
-    ).first()
-
-    if existing_member:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You are already a member of this group."
-        )
+    already_member = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="You are already a member of this group."
+    )
+    if memberships.role_in(db, current_user, group_id) is not None:
+        raise already_member
 
     # Create the new membership
     new_member = GroupMember(
@@ -786,7 +1089,15 @@ def join_group(group_id: int, db: Session = Depends(get_db), current_user: User
         role=GroupRole.MEMBER.value
     )
     db.add(new_member)
-    db.commit()
+    outbox.add(db, "group_joined", group_id=group_id, user_id=current_user.user_id)  # Counts the member
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker's cached memberships were stale; the unique constraint caught it
+        db.rollback()
+        entity_cache.invalidate("user", current_user.user_id)
+        raise already_member
+    entity_cache.invalidate("user", current_user.user_id)
 
     return MessageResponse(message="Successfully joined group.")
 
@@ -795,32 +1106,38 @@ def leave_group(group_id: int, db: Session = Depends(get_db), current_user: User
     """
     Allows the current user to leave a group they are a member of.
     """
-    # Find the membership record
-    member = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == current_user.user_id
-    ).first()
-
-    if not member:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You are not a member of this group."
-        )
+    not_member = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="You are not a member of this group."
+    )
+    role = memberships.role_in(db, current_user, group_id)
+    if role is None:
+        raise not_member
     
     # Prevent owner from leaving the group for now
-    if member.role == 'owner':
+    if role == GroupRole.OWNER.value:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Group owners cannot leave the group. You must transfer ownership or delete the group."
         )
 
-    db.delete(member)
+    removed = db.query(GroupMember).filter(
+        GroupMember.group_id == group_id,
+        GroupMember.user_id == current_user.user_id
+    ).delete(synchronize_session=False)
+    if not removed:
+        db.rollback()
+        entity_cache.invalidate("user", current_user.user_id)
+        raise not_member
+
+    outbox.add(db, "group_left", group_id=group_id, user_id=current_user.user_id)  # Counts the member out
     db.commit()
+    entity_cache.invalidate("user", current_user.user_id)
 
     return MessageResponse(message="You have successfully left the group.")
 
 @app.delete("/groups/{group_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["groups"])
-def delete_group(group_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def delete_group(group_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
     Delete a group. Only the creator of the group can delete it.
     """
@@ -829,13 +1146,29 @@ def delete_group(group_id: int, db: Session = Depends(get_db), current_user: Use
     if not group:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
 
-    if group.created_by != current_user.user_id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the group creator can delete the group")
+    memberships.require_member(db, current_user, group_id, roles=(GroupRole.OWNER.value,), detail="Only the group creator can delete the group")
+
+    # Each prediction leaves trending and the caches through its own event
+    outbox.add_many(db, "prediction_deleted", [
+        prediction_deleted_payload(row, group_gone=True)
+        for row in db.query(
+            Prediction.prediction_id, Prediction.group_id, Prediction.category, Prediction.visibility, Prediction.timestamp
+        ).filter(Prediction.group_id == group_id)
+    ])
+
+    if purge.group_child_count(db, group_id) > purge.PURGE_THRESHOLD:
+        activity.forget(db, activity.GROUP_PREDICTIONS, group_id)
+        purge.tombstone(db, group)
+        entity_cache.invalidate("group", group_id)
+        background_tasks.add_task(purge.purge_group, group_id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
     # The database is set up with cascading deletes, so deleting the group
     # will automatically delete related memberships, predictions, etc.
-    db.delete(group)
+    db.query(Group).filter(Group.group_id == group_id).delete(synchronize_session=False)
+    activity.forget(db, activity.GROUP_PREDICTIONS, group_id)
     db.commit()
+    entity_cache.invalidate("group", group_id)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -845,7 +1178,7 @@ def delete_group(group_id: int, db: Session = Depends(get_db), current_user: Use
 
 def get_comment_response(comment: Comment, db: Session, current_user: Optional[User]) -> CommentResponse:
     """Helper function to construct a CommentResponse from a Comment object."""
-    vote_score = sum(v.value for v in comment.votes)
+    vote_score = comment.score
     user_vote = next((v.value for v in comment.votes if current_user and v.user_id == current_user.user_id), None)
     
     return CommentResponse(
@@ -873,6 +1206,7 @@ def create_comment(
     if not prediction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prediction not found")
 
+    parent_comment = None
     if comment_data.parent_comment_id:
         parent_comment = db.query(Comment).filter(Comment.comment_id == comment_data.parent_comment_id).first()
         if not parent_comment or parent_comment.prediction_id != prediction_id:
@@ -882,53 +1216,194 @@ def create_comment(
         content=comment_data.content,
         prediction_id=prediction_id,
         user_id=current_user.user_id,
-        parent_comment_id=comment_data.parent_comment_id
+        parent_comment_id=comment_data.parent_comment_id,
+        depth=parent_comment.depth + 1 if parent_comment else 0
     )
     db.add(new_comment)
+    db.flush()
+
+    # The path ends with the comment's own id, so it can only be set after the insert
+    new_comment.path = comment_threads.path_for(
+        new_comment.comment_id, parent_comment.path if parent_comment else ""
+    )
+    outbox.add(db, "comment_created", comment_id=new_comment.comment_id, prediction_id=prediction_id, user_id=current_user.user_id)
     db.commit()
     db.refresh(new_comment)
-    
+
     return get_comment_response(new_comment, db, current_user)
 
+
+def invalidate_comment_thread(delivery: outbox.Delivery) -> None:
+    """Drop the cached comment and its prediction, whose comment count and thread pages changed."""
+    comment_id, prediction_id = delivery.payload["comment_id"], delivery.payload["prediction_id"]
+
+    def publish() -> None:
+        entity_cache.invalidate("comment", comment_id)
+        entity_cache.invalidate("prediction", prediction_id)
+
+    delivery.after_commit(publish)
+
+
+outbox.register("comment_created", invalidate_comment_thread)
+
 @app.get("/predictions/{prediction_id}/comments", response_model=List[CommentResponse], tags=["comments"])
 def get_comments_for_prediction(
     prediction_id: int,
     sort: str = Query("top", regex="^(top|new|controversial)$"),
+    selected_fields: Optional[frozenset] = Depends(fieldsets.comment_fields),
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """Get all comments for a prediction, sorted and nested."""
-    # Fetch all comments for the prediction to build the hierarchy
-    all_comments = db.query(Comment).filter(Comment.prediction_id == prediction_id).all()
-    
-    # Create a dictionary for easy access
-    comment_map = {c.comment_id: c for c in all_comments}
-    
-    # Build the nested structure
+    # Siblings keep the query order, so sorting here sorts every level of the tree.
+    if sort == "new":
+        order_by = [desc(Comment.timestamp), desc(Comment.comment_id)]
+    elif sort == "top":
+        order_by = [desc(Comment.wilson_score), desc(Comment.comment_id)]
+    else:
+        order_by = [desc(Comment.controversy_score), desc(Comment.comment_id)]
+
+    if selected_fields is not None:
+        viewer_id = current_user.user_id if current_user else None
+        return fieldsets.sparse_response(
+            fieldsets.select_comment_tree(db, prediction_id, order_by, selected_fields, viewer_id)
+        )
+
+    # The whole tree in three queries: comments with their authors, every vote, and nothing lazy-loaded
+    all_comments = db.query(Comment).options(joinedload(Comment.user)).filter(
+        Comment.prediction_id == prediction_id
+    ).order_by(*order_by).all()
+    votes = {}
+    for vote in db.query(CommentVote.comment_id, CommentVote.user_id, CommentVote.value).join(
+        Comment, Comment.comment_id == CommentVote.comment_id
+    ).filter(Comment.prediction_id == prediction_id):
+        votes.setdefault(vote.comment_id, []).append(vote)
+
+    # Replies are matched to their parents here rather than through Comment.replies
+    comment_ids = {comment.comment_id for comment in all_comments}
+    replies = {}
     root_comments = []
     for comment in all_comments:
         if comment.parent_comment_id:
-            parent = comment_map.get(comment.parent_comment_id)
-            if parent:
-                if not hasattr(parent, 'temp_replies'):
-                    parent.temp_replies = []
-                parent.temp_replies.append(comment)
+            if comment.parent_comment_id in comment_ids:
+                replies.setdefault(comment.parent_comment_id, []).append(comment)
         else:
             root_comments.append(comment)
 
-    # Attach the replies properly
-    for comment in all_comments:
-        if hasattr(comment, 'temp_replies'):
-            comment.replies = comment.temp_replies
+    viewer_id = current_user.user_id if current_user else None
+
+    def build(comment: Comment) -> CommentResponse:
+        comment_votes = votes.get(comment.comment_id, [])
+        return CommentResponse(
+            comment_id=comment.comment_id,
+            prediction_id=comment.prediction_id,
+            user=comment.user,
+            parent_comment_id=comment.parent_comment_id,
+            content=comment.content,
+            timestamp=comment.timestamp,
+            votes=comment_votes,
+            vote_score=comment.score,
+            user_vote=next((vote.value for vote in comment_votes if vote.user_id == viewer_id), None),
+            replies=[build(reply) for reply in replies.get(comment.comment_id, [])],
+        )
 
-    # Sort the top-level comments
-    if sort == "new":
-        root_comments.sort(key=lambda c: c.timestamp, reverse=True)
-    elif sort == "top":
-        root_comments.sort(key=lambda c: sum(v.value for v in c.votes), reverse=True)
-    # 'controversial' could be implemented later if needed
+    return [build(comment) for comment in root_comments]
+
+@app.get("/predictions/{prediction_id}/comments/thread", response_model=CommentThreadResponse, tags=["comments"])
+def get_comment_thread(
+    request: Request,
+    prediction_id: int,
+    sort: str = Query("top", regex="^(top|new|controversial)$"),
+    parent_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(comment_threads.DEFAULT_PAGE_SIZE, ge=1, le=comment_threads.MAX_PAGE_SIZE),
+    depth: int = Query(comment_threads.DEFAULT_REPLY_DEPTH, ge=0, le=comment_threads.MAX_REPLY_DEPTH),
+    replies: int = Query(comment_threads.DEFAULT_REPLIES_PER_NODE, ge=1, le=comment_threads.MAX_REPLIES_PER_NODE),
+    selected_fields: Optional[frozenset] = Depends(fieldsets.comment_thread_fields),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """
+    Get one page of a prediction's comment thread.
+    - Root comments are paginated with `cursor` / `next_cursor`.
+    - Each comment carries at most `replies` replies, nested at most `depth` levels.
+    - A comment with more replies than shown has a `replies_cursor`; request it
+      again with `parent_id` set to that comment to continue its replies.
+    """
+    prediction = db.query(Prediction).filter(Prediction.prediction_id == prediction_id).first()
+    if not prediction:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prediction not found")
+
+    if prediction.visibility == Visibility.PRIVATE and (not current_user or current_user.user_id != prediction.user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prediction not found")
+
+    # Includes the replies of a deleted comment, which are tombstoned along with it
+    if parent_id is not None and not db.query(Comment.comment_id).filter(
+        Comment.comment_id == parent_id, Comment.prediction_id == prediction_id
+    ).first():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
+
+    try:
+        thread = comment_threads.load_thread(
+            db,
+            prediction_id,
+            sort=sort,
+            viewer_id=current_user.user_id if current_user else None,
+            parent_id=parent_id,
+            cursor=cursor,
+            limit=limit,
+            depth=depth,
+            replies_per_node=replies,
+            fields=selected_fields,
+        )
+    except comment_threads.InvalidCursor as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    if current_user is None:
+        # Comment writes and votes publish the prediction, which drops these pages
+        response_cache.cache_for(request, response_cache.THREAD_MAX_AGE, [("prediction", prediction_id)])
+    if selected_fields is not None:
+        return fieldsets.sparse_response({
+            "comments": fieldsets.trim_tree(thread["comments"], selected_fields),
+            "next_cursor": thread["next_cursor"],
+        })
+    return CommentThreadResponse.model_validate(thread)
+
+@app.get("/comments/{comment_id}/thread", response_model=CommentThreadNode, tags=["comments"])
+def continue_comment_thread(
+    comment_id: int,
+    sort: str = Query("top", regex="^(top|new|controversial)$"),
+    depth: int = Query(comment_threads.DEFAULT_REPLY_DEPTH, ge=0, le=comment_threads.MAX_REPLY_DEPTH),
+    selected_fields: Optional[frozenset] = Depends(fieldsets.comment_thread_fields),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """
+    Continue a thread from a single comment: returns the comment with up to
+    `depth` levels of replies, read from its materialized path in one query.
+    """
+    comment = db.query(Comment).filter(Comment.comment_id == comment_id).first()
+    if not comment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
 
-    return [get_comment_response(comment, db, current_user) for comment in root_comments]
+    # A parent already in the session comes from the identity map, where tombstoned rows are not filtered out
+    prediction = comment.prediction
+    if not prediction or prediction.deleted_at is not None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
+    if prediction.visibility == Visibility.PRIVATE and (not current_user or current_user.user_id != prediction.user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
+
+    subtree = comment_threads.load_subtree(
+        db,
+        comment,
+        sort=sort,
+        viewer_id=current_user.user_id if current_user else None,
+        depth=depth,
+        fields=selected_fields,
+    )
+    if selected_fields is not None:
+        return fieldsets.sparse_response(fieldsets.trim_tree([subtree], selected_fields)[0])
+    return CommentThreadNode.model_validate(subtree)
 
 @app.post("/comments/{comment_id}/vote", response_model=MessageResponse, tags=["comments"])
 def vote_on_comment(
@@ -938,7 +1413,8 @@ def vote_on_comment(
     current_user: User = Depends(get_current_user)
 ):
     """Cast a vote on a comment."""
-    comment = db.query(Comment).filter(Comment.comment_id == comment_id).first()
+    # Lock the comment row so concurrent votes don't lose counter updates
+    comment = db.query(Comment).filter(Comment.comment_id == comment_id).with_for_update().first()
     if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
 
@@ -949,12 +1425,15 @@ def vote_on_comment(
 
     if existing_vote:
         if vote_request.value == 0: # User wants to remove their vote
+            comment_threads.apply_vote(comment, existing_vote.value, None)
             db.delete(existing_vote)
             message = "Vote removed"
         elif existing_vote.value == vote_request.value: # Vote is the same, do nothing or treat as removal
+            comment_threads.apply_vote(comment, existing_vote.value, None)
             db.delete(existing_vote)
             message = "Vote removed"
         else: # Change vote
+            comment_threads.apply_vote(comment, existing_vote.value, vote_request.value)
             existing_vote.value = vote_request.value
             message = "Vote updated"
     elif vote_request.value != 0: # New vote
@@ -964,16 +1443,22 @@ def vote_on_comment(
             value=vote_request.value
         )
         db.add(new_vote)
+        comment_threads.apply_vote(comment, None, vote_request.value)
         message = "Vote cast"
     else: # Trying to cast a '0' vote from a neutral state
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid vote value")
 
+    prediction_id = comment.prediction_id
     db.commit()
+    entity_cache.invalidate("comment", comment_id)
+    # Scores and the thread's ordering changed, so cached thread pages go too
+    entity_cache.invalidate("prediction", prediction_id)
     return MessageResponse(message=message)
 
 @app.delete("/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["comments"])
 def delete_comment(
     comment_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -985,8 +1470,19 @@ def delete_comment(
     if comment.user_id != current_user.user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only delete your own comments")
 
-    db.delete(comment)
+    if purge.comment_child_count(db, comment) > purge.PURGE_THRESHOLD:
+        purge.tombstone(db, comment)
+        entity_cache.invalidate("comment", comment_id)
+        entity_cache.invalidate("prediction", comment.prediction_id)
+        background_tasks.add_task(purge.purge_comment, comment_id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    # Replies and votes go with it via ON DELETE CASCADE
+    prediction_id = comment.prediction_id
+    db.query(Comment).filter(Comment.comment_id == comment_id).delete(synchronize_session=False)
     db.commit()
+    entity_cache.invalidate("comment", comment_id)
+    entity_cache.invalidate("prediction", prediction_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
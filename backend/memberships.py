@@ -0,0 +1,115 @@
+"""
+Cached group memberships for authorization checks.
+
+Each user's memberships are loaded with one query into a `{group_id: role}`
+map and kept in-process for MEMBERSHIP_CACHE_SECONDS. A `user` invalidation
+(join, leave) drops the user's entry and a `group` invalidation drops every
+cached user that belongs to the group; both arrive from other workers over
+the invalidation bus. The TTL bounds staleness if a message is dropped.
+
+Every group endpoint authorizes through `require_member` (or `role_in` when
+a non-member is allowed through), so this is the one place membership is
+read for access control.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+import invalidation
+from models import GroupMember, User
+
+MEMBERSHIP_CACHE_SECONDS = 60
+MAX_CACHED_USERS = 10000
+
+_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _load(db: Session, user_id: int) -> Dict[int, str]:
+    rows = db.query(GroupMember.group_id, GroupMember.role).filter(GroupMember.user_id == user_id)
+    return {group_id: role for group_id, role in rows}
+
+
+def groups_for(db: Session, user_id: int) -> Dict[int, str]:
+    """The user's memberships as `{group_id: role}`; do not modify the result."""
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is not None and entry[0] > now:
+            _cache.move_to_end(user_id)
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+
+    groups = _load(db, user_id)
+    with _lock:
+        _cache[user_id] = (now + MEMBERSHIP_CACHE_SECONDS, groups)
+        _cache.move_to_end(user_id)
+        while len(_cache) > MAX_CACHED_USERS:
+            _cache.popitem(last=False)
+    return groups
+
+
+def role_in(db: Session, user: Optional[User], group_id: int) -> Optional[str]:
+    """The user's role in the group, or None for non-members and anonymous users."""
+    if user is None:
+        return None
+    return groups_for(db, user.user_id).get(group_id)
+
+
+def require_member(
+    db: Session,
+    user: Optional[User],
+    group_id: int,
+    roles: Optional[Iterable[str]] = None,
+    detail: str = "You are not a member of this group.",
+) -> str:
+    """Return the user's role in the group, raising 403 unless they hold one of `roles`.
+
+    With no `roles`, any membership is enough.
+    """
+    role = role_in(db, user, group_id)
+    if role is None or (roles is not None and role not in roles):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+    return role
+
+
+def invalidate_user(user_id: int) -> None:
+    """Forget a user's memberships after they joined or left a group."""
+    with _lock:
+        if _cache.pop(user_id, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def invalidate_group(group_id: int) -> None:
+    """Forget every cached user that belongs to a changed or deleted group."""
+    with _lock:
+        for user_id in [user_id for user_id, (_, groups) in _cache.items() if group_id in groups]:
+            del _cache[user_id]
+            _stats["invalidations"] += 1
+
+
+def clear() -> None:
+    """Forget every cached membership in this process."""
+    with _lock:
+        _cache.clear()
+
+
+def stats() -> dict:
+    """Hit, miss and invalidation counts for this process, plus the hit ratio."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_ratio": _stats["hits"] / lookups if lookups else 0.0,
+            "cached_users": len(_cache),
+        }
+
+
+invalidation.subscribe("user", invalidate_user)
+invalidation.subscribe("group", invalidate_group)
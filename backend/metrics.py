@@ -0,0 +1,316 @@
+"""
+Request metrics in Prometheus text format.
+
+MetricsMiddleware records, per route template and method: request counts by
+status, a latency histogram, and how many queries each request ran and how
+long it spent in the database. Query timing comes from query_budget, which
+attributes engine events to the request through a context variable, so it
+covers sync endpoints running in the threadpool too.
+
+Every worker keeps its own registry and writes a snapshot to
+METRICS_DIR/<pid>.json every FLUSH_INTERVAL. `/metrics` merges the
+snapshots of all live workers on the host, so whichever worker answers the
+scrape reports the whole server. A worker that stopped writing for
+STALE_AFTER is left out; Prometheus treats the drop as a counter reset.
+
+Access logging is one JSON line per request on the `access` logger, sampled
+at ACCESS_LOG_SAMPLE_RATE. Server errors and slow requests are always logged.
+"""
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import query_budget
+from config import settings
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("access")
+
+COUNTER = "counter"
+GAUGE = "gauge"  # Summed across workers
+MAX = "max"  # Highest value across workers, exposed as a gauge
+HISTOGRAM = "histogram"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+FLUSH_INTERVAL = 5.0  # seconds
+STALE_AFTER = 120.0  # seconds without a snapshot before a worker is left out
+ACCESS_LOG_SLOW_SECONDS = 1.0
+UNMATCHED_ROUTE = "unmatched"  # Keeps unknown paths from adding label values
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Registry:
+    def __init__(self):
+        self._definitions: Dict[str, tuple] = {}
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._collectors: list = []
+        self._lock = threading.Lock()
+
+    def declare(self, name: str, kind: str, help_text: str, buckets: Optional[Iterable[float]] = None) -> None:
+        self._definitions[name] = (kind, help_text, tuple(buckets or ()))
+
+    def inc(self, name: str, labels: Optional[dict] = None, amount: float = 1) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None) -> None:
+        buckets = self._definitions[name][2]
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then the sum
+                histogram = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def register_collector(self, collect: Callable[[], Iterable[Tuple[str, float]]]) -> None:
+        """Add values that are read at snapshot time, e.g. a cache's own counters."""
+        self._collectors.append(collect)
+
+    def snapshot(self) -> dict:
+        values = {}
+        for collect in self._collectors:
+            try:
+                for name, value in collect():
+                    values[(name, ())] = value
+            except Exception:
+                logger.exception("Metrics collector failed")
+        with self._lock:
+            values.update(self._values)
+            histograms = {key: list(histogram) for key, histogram in self._histograms.items()}
+        return {
+            "values": [[name, dict(labels), value] for (name, labels), value in values.items()],
+            "histograms": [[name, dict(labels), histogram] for (name, labels), histogram in histograms.items()],
+        }
+
+    def merge(self, snapshots: Iterable[dict]) -> Tuple[dict, dict]:
+        """Combine worker snapshots into ({series: value}, {series: histogram})."""
+        values: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], list] = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["values"]:
+                if name not in self._definitions:
+                    continue
+                key = (name, _labels(labels))
+                if self._definitions[name][0] == MAX:
+                    values[key] = max(values.get(key, value), value)
+                else:
+                    values[key] = values.get(key, 0) + value
+            for name, labels, histogram in snapshot["histograms"]:
+                if name not in self._definitions or len(histogram) != len(self._definitions[name][2]) + 2:
+                    continue  # Declared differently by an older worker
+                key = (name, _labels(labels))
+                merged = histograms.setdefault(key, [0] * len(histogram))
+                for i, count in enumerate(histogram):
+                    merged[i] += count
+        return values, histograms
+
+    def render(self, snapshots: Iterable[dict]) -> str:
+        """Prometheus text exposition of the merged snapshots."""
+        values, histograms = self.merge(snapshots)
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {GAUGE if kind == MAX else kind}")
+            if kind == HISTOGRAM:
+                for labels, histogram in sorted((labels, h) for (n, labels), h in histograms.items() if n == name):
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float("inf"),), histogram):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _number(bound)
+                        lines.append(f"{name}_bucket{_render_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_render_labels(labels)} {_number(histogram[-1])}")
+                    lines.append(f"{name}_count{_render_labels(labels)} {cumulative}")
+            else:
+                for labels, value in sorted((labels, v) for (n, labels), v in values.items() if n == name):
+                    lines.append(f"{name}{_render_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Optional[dict]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = Registry()
+registry.declare("http_requests_total", COUNTER, "Requests by route, method and status.")
+registry.declare("http_request_duration_seconds", HISTOGRAM, "Request latency by route and method.", LATENCY_BUCKETS)
+registry.declare("http_request_db_queries", HISTOGRAM, "Database queries per request by route and method.", QUERY_COUNT_BUCKETS)
+registry.declare("http_request_db_seconds_total", COUNTER, "Time spent in database queries by route and method.")
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], counters=(), gauges=(), maxes=()) -> None:
+    """Expose selected keys of a module's `stats()` dict as `<prefix>_<key>` metrics."""
+    for key in counters:
+        registry.declare(f"{prefix}_{key}_total", COUNTER, f"{prefix} {key.replace('_', ' ')}.")
+    for key in gauges:
+        registry.declare(f"{prefix}_{key}", GAUGE, f"{prefix} {key.replace('_', ' ')}, summed over workers.")
+    for key in maxes:
+        registry.declare(f"{prefix}_{key}", MAX, f"{prefix} {key.replace('_', ' ')}, highest of any worker.")
+
+    def collect():
+        values = stats()
+        return (
+            [(f"{prefix}_{key}_total", values[key]) for key in counters]
+            + [(f"{prefix}_{key}", values[key]) for key in gauges + maxes]
+        )
+
+    registry.register_collector(collect)
+
+
+# Cross-worker snapshots
+
+class SnapshotWriter:
+    """Writes this worker's snapshot to the shared directory in the background."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        # Named after the worker's pid, so start() must run after forking
+        self.path = os.path.join(self.directory, f"{os.getpid()}.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped.clear()
+        threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.path is None:
+            return
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w") as snapshot_file:
+                json.dump(registry.snapshot(), snapshot_file)
+            os.replace(temporary, self.path)
+        except OSError:
+            logger.exception("Could not write the metrics snapshot")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def snapshots(self) -> list:
+        """This worker's current snapshot plus the latest one of every other live worker."""
+        snapshots = [registry.snapshot()]
+        cutoff = time.time() - STALE_AFTER
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json") or path == self.path:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)  # A worker that exited without cleaning up
+                    continue
+                with open(path) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue  # Removed or replaced while we read it
+        return snapshots
+
+
+writer = SnapshotWriter(settings.metrics_dir)
+
+
+def start() -> None:
+    """Start sharing this worker's metrics; call once per worker after forking."""
+    writer.start()
+
+
+def stop() -> None:
+    writer.stop()
+
+
+def render() -> str:
+    return registry.render(writer.snapshots())
+
+
+# Request middleware
+
+def _log_access(record: dict) -> None:
+    if (
+        record["status"] >= 500
+        or record["duration_ms"] >= ACCESS_LOG_SLOW_SECONDS * 1000
+        or random.random() < settings.access_log_sample_rate
+    ):
+        access_logger.info(json.dumps(record, separators=(",", ":")))
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request and records it by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = query_budget.RequestStats(track_shapes=settings.debug, scope=scope)
+        token = query_budget.current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.debug:
+                    message["headers"] = list(message.get("headers", [])) + query_budget.debug_headers(stats)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            query_budget.current_request.reset(token)
+            if settings.debug:
+                query_budget.log_n_plus_one(stats, scope["method"], scope["path"])
+            duration = time.perf_counter() - started
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route is not None else UNMATCHED_ROUTE}
+            registry.inc("http_requests_total", {**labels, "status": str(status_code)})
+            registry.observe("http_request_duration_seconds", duration, labels)
+            registry.observe("http_request_db_queries", stats.queries, labels)
+            registry.inc("http_request_db_seconds_total", labels, stats.db_seconds)
+            _log_access({
+                **labels,
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 2),
+                "db_queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 2),
+            })
@@ -1,10 +1,25 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, Enum, UniqueConstraint, Index, LargeBinary, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import Session, relationship, with_loader_criteria
 from sqlalchemy.sql import func
 from database import Base
+from datetime import datetime
 import enum
 
 
+class HexDigest(TypeDecorator):
+    """A SHA-256 digest stored as 32 raw bytes and handled as 64-character hex."""
+
+    impl = LargeBinary(32)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else bytes(value).hex()
+
+
 class LoginType(enum.Enum):
     PASSWORD = "password"
     GOOGLE = "google"
@@ -53,28 +68,44 @@ class Prediction(Base):
     
     prediction_id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
-    group_id = Column(Integer, ForeignKey("groups.group_id"), nullable=True)
+    group_id = Column(Integer, ForeignKey("groups.group_id", ondelete="CASCADE"), nullable=True, index=True)
     title = Column(String(120), nullable=False)
     content = Column(Text, nullable=False)
     category = Column(String(50), nullable=False)
     visibility = Column(Enum(Visibility), nullable=False)
     allow_backing = Column(Boolean, default=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    hash = Column(String(255), nullable=False, unique=True)
+    hash = Column(HexDigest, nullable=False, unique=True)
     contains_profanity = Column(Boolean, default=False, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Tombstone while purge.py removes children
+
+    # Merkle receipt, filled in when receipts.py seals the prediction into a batch
+    receipt_batch_id = Column(Integer, ForeignKey("receipt_batches.batch_id"), nullable=True, index=True)
+    receipt_leaf_index = Column(Integer, nullable=True)
+    receipt_proof = Column(Text, nullable=True)  # JSON list of [side, sibling hash] steps
     
     # Relationships
-    comments = relationship("Comment", back_populates="prediction", cascade="all, delete-orphan")
+    # Children are removed by ON DELETE CASCADE; passive_deletes keeps the ORM from loading them first
+    comments = relationship("Comment", back_populates="prediction", cascade="all, delete-orphan", passive_deletes=True)
     user = relationship("User", back_populates="predictions")
-    votes = relationship("Vote", back_populates="prediction")
-    backings = relationship("Backing", back_populates="prediction")
+    votes = relationship("Vote", back_populates="prediction", passive_deletes=True)
+    backings = relationship("Backing", back_populates="prediction", passive_deletes=True)
     group = relationship("Group", back_populates="predictions")
+    receipt_batch = relationship("ReceiptBatch")
+
+    __table_args__ = (
+        # Each group's timeline is one ordered run for the home feed merge
+        Index('ix_predictions_group_timeline', 'group_id', 'timestamp', 'prediction_id'),
+        # The predictions still waiting for a receipt batch
+        Index('ix_predictions_unsealed', 'prediction_id',
+              postgresql_where=receipt_batch_id.is_(None), sqlite_where=receipt_batch_id.is_(None)),
+    )
 
 class Vote(Base):
     __tablename__ = "votes"
     
     vote_id = Column(Integer, primary_key=True, index=True)
-    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id"), nullable=False)
+    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     value = Column(Integer, nullable=False)  # -1 or 1
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -91,7 +122,7 @@ class Backing(Base):
     __tablename__ = "backings"
     
     backing_id = Column(Integer, primary_key=True, index=True)
-    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id"), nullable=False)
+    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id", ondelete="CASCADE"), nullable=False)
     backer_user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -106,27 +137,49 @@ class Comment(Base):
     __tablename__ = "comments"
 
     comment_id = Column(Integer, primary_key=True, index=True)
-    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id"), nullable=False)
+    prediction_id = Column(Integer, ForeignKey("predictions.prediction_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
-    parent_comment_id = Column(Integer, ForeignKey("comments.comment_id"), nullable=True)
+    parent_comment_id = Column(Integer, ForeignKey("comments.comment_id", ondelete="CASCADE"), nullable=True, index=True)
 
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Materialized path: one zero-padded comment_id segment per ancestor, ending
+    # with this comment, e.g. "0000000012/0000000047/". Byte-wise ("C") collation
+    # keeps a subtree contiguous in the index so it can be read as one range.
+    path = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=False, default="")
+    depth = Column(Integer, nullable=False, default=0)
+
+    # Vote totals and rankings, maintained by vote_on_comment
+    score = Column(Integer, nullable=False, default=0)
+    upvotes = Column(Integer, nullable=False, default=0)
+    downvotes = Column(Integer, nullable=False, default=0)
+    wilson_score = Column(Float, nullable=False, default=0.0)
+    controversy_score = Column(Float, nullable=False, default=0.0)
+
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Tombstone while purge.py removes the subtree
+
     # Relationships
     user = relationship("User", back_populates="comments")
     prediction = relationship("Prediction", back_populates="comments")
-    votes = relationship("CommentVote", back_populates="comment", cascade="all, delete-orphan")
+    votes = relationship("CommentVote", back_populates="comment", cascade="all, delete-orphan", passive_deletes=True)
     
     # Self-referential relationship for replies
     parent = relationship("Comment", remote_side=[comment_id], back_populates="replies")
-    replies = relationship("Comment", back_populates="parent", cascade="all, delete-orphan")
+    replies = relationship("Comment", back_populates="parent", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index('ix_comments_prediction_id_path', 'prediction_id', 'path'),
+        Index('ix_comments_thread_top', 'prediction_id', 'parent_comment_id', 'wilson_score', 'comment_id'),
+        Index('ix_comments_thread_controversial', 'prediction_id', 'parent_comment_id', 'controversy_score', 'comment_id'),
+        Index('ix_comments_thread_new', 'prediction_id', 'parent_comment_id', 'timestamp', 'comment_id'),
+    )
 
 class CommentVote(Base):
     __tablename__ = "comment_votes"
 
     vote_id = Column(Integer, primary_key=True, index=True)
-    comment_id = Column(Integer, ForeignKey("comments.comment_id"), nullable=False)
+    comment_id = Column(Integer, ForeignKey("comments.comment_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     value = Column(Integer, nullable=False)  # -1 or 1
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -148,18 +201,29 @@ class Group(Base):
     visibility = Column(String(255), nullable=False)    
     created_by = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Tombstone while purge.py removes children
+
+    # Directory counters, maintained by the group and prediction endpoints
+    member_count = Column(Integer, nullable=False, default=0)
+    prediction_count = Column(Integer, nullable=False, default=0)
 
     # Relationships
     creator = relationship("User", back_populates="created_groups")
-    members = relationship("GroupMember", back_populates="group", cascade="all, delete-orphan")
-    predictions = relationship("Prediction", back_populates="group")
+    members = relationship("GroupMember", back_populates="group", cascade="all, delete-orphan", passive_deletes=True)
+    predictions = relationship("Prediction", back_populates="group", passive_deletes=True)
+
+    __table_args__ = (
+        Index('ix_groups_directory_new', 'visibility', 'group_id'),
+        Index('ix_groups_directory_top', 'visibility', 'prediction_count', 'group_id'),
+        Index('ix_groups_directory_members', 'visibility', 'member_count', 'group_id'),
+    )
 
 
 class GroupMember(Base):
     __tablename__ = "group_members"
 
     group_member_id = Column(Integer, primary_key=True, index=True)
-    group_id = Column(Integer, ForeignKey("groups.group_id"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.group_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     role = Column(String(255), nullable=False) 
     joined_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -169,4 +233,69 @@ class GroupMember(Base):
     user = relationship("User", back_populates="memberships")
 
     # Unique constraint
-    __table_args__ = (UniqueConstraint('group_id', 'user_id', name='unique_group_membership'),)
\ No newline at end of file
+    __table_args__ = (UniqueConstraint('group_id', 'user_id', name='unique_group_membership'),)
+
+
+class ActivityBucket(Base):
+    __tablename__ = "activity_buckets"
+
+    # One row per counter per hour (per day once compacted), see activity.py
+    kind = Column(String(50), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index('ix_activity_buckets_kind_bucket_start', 'kind', 'bucket_start'),)
+
+
+class ReceiptBatch(Base):
+    __tablename__ = "receipt_batches"
+
+    # Merkle root over the hashes of one batch of predictions, see receipts.py
+    batch_id = Column(Integer, primary_key=True, index=True)
+    root = Column(String(64), nullable=False)
+    leaf_count = Column(Integer, nullable=False)
+    first_timestamp = Column(DateTime(timezone=True), nullable=True)
+    last_timestamp = Column(DateTime(timezone=True), nullable=True)
+    sealed_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    # A side effect of a committed write, waiting for the processor in outbox.py
+    event_id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    handler = Column(String(200), nullable=True)  # The one handler to run; NULL runs all of the kind's
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # Pushed back after a failed attempt
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (Index('ix_outbox_events_available_at', 'available_at'),)
+
+
+TOMBSTONED_MODELS = (Prediction, Comment, Group)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_tombstoned_rows(execute_state):
+    """Leave tombstoned rows out of every ORM query.
+
+    Lazy loads of relationships inherit the criteria from the query that
+    loaded the parent object, but a many-to-one target that is already in
+    the session is returned without a query, tombstoned or not. Code that
+    follows one, such as `comment.prediction`, checks `deleted_at` itself.
+    Pass `execution_options(include_deleted=True)` to see them, as the purge does.
+    """
+    if (
+        execute_state.is_select
+        and not execute_state.is_column_load
+        and not execute_state.is_relationship_load
+        and not execute_state.execution_options.get("include_deleted", False)
+    ):
+        execute_state.statement = execute_state.statement.options(*[
+            with_loader_criteria(model, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+            for model in TOMBSTONED_MODELS
+        ])
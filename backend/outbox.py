@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Transactional outbox for the side effects of writes.
+
+An endpoint records what happened with `add(db, kind, **payload)` before it
+commits, so the event is stored in the same transaction as the write. Both
+happen, or neither does. Handlers registered with `register(kind, handler)`
+then do the fan-out work out of the request: group counters
+(group_directory.py), activity buckets for trending (activity.py), author
+wisdom (main.py), and the cache invalidations and live updates that votes
+and new comments cause. Adding an event of a kind that no handler takes is
+an error.
+
+Every worker runs a Processor thread. Each batch is one transaction that
+claims up to OUTBOX_BATCH_SIZE events, deletes them and runs their
+handlers, so the database work of a handler commits exactly when its event
+is consumed. On Postgres the claim is `SELECT ... FOR UPDATE SKIP LOCKED`,
+so workers take disjoint batches. Elsewhere a batch whose delete comes up
+short was taken by another worker, and is rolled back. Whatever a handler
+schedules with `Delivery.after_commit`, such as publishing invalidations,
+runs after that commit. Delivery is at least once: if a worker dies between
+the commit and those callbacks, they do not run, but everything else is
+retried.
+
+A commit that added events wakes its worker's processor, so counters
+usually catch up within milliseconds. The other workers poll every
+OUTBOX_POLL_INTERVAL seconds. `add` stores one row per handler of the
+kind, so a handler that raises does not hold up the others: its row alone
+is retried, with exponential backoff, up to MAX_ATTEMPTS times. After that
+it stays in the table with its last error for someone to look at.
+
+To drain the outbox by hand, e.g. after a deploy with the processor off:
+
+    python outbox.py
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+KINDS = (
+    "prediction_created",
+    "prediction_deleted",
+    "prediction_voted",
+    "prediction_backed",
+    "prediction_unbacked",
+    "comment_created",
+    "group_joined",
+    "group_left",
+)
+MAX_ATTEMPTS = 10
+RETRY_BACKOFF = 1.0  # seconds before the first retry, doubled after each further failure
+PENDING_KEY = "outbox_pending"  # In Session.info once the session has added events
+
+
+class Delivery:
+    """One event being handled, in the transaction that consumes it."""
+
+    __slots__ = ("db", "kind", "payload", "callbacks")
+
+    def __init__(self, db: Session, kind: str, payload: dict):
+        self.db = db
+        self.kind = kind
+        self.payload = payload
+        self.callbacks: List[Callable[[], None]] = []
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Run `callback` once the handlers' work is committed, e.g. to publish invalidations."""
+        self.callbacks.append(callback)
+
+
+Handler = Callable[[Delivery], None]
+_handlers: Dict[str, Dict[str, Handler]] = defaultdict(dict)  # kind -> {name: handler}
+
+
+def handler_name(handler: Handler) -> str:
+    """How rows name `handler`; it must not change between a deploy and the next."""
+    return f"{handler.__module__}.{handler.__qualname__}"
+
+
+def register(kind: str, handler: Handler) -> None:
+    """Call `handler` with a Delivery for every `kind` event, after the write that added it commits."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown outbox event kind: {kind}")
+    _handlers[kind][handler_name(handler)] = handler
+
+
+def add(db: Session, kind: str, **payload) -> None:
+    """Record an event in the session's transaction; handlers see it once that commits."""
+    if not _handlers.get(kind):
+        # Stored events are work owed; one that nothing would ever consume is a bug
+        raise ValueError(f"No handler is registered for outbox event kind: {kind}")
+    payload = json.dumps(payload, separators=(",", ":"))
+    for name in _handlers[kind]:
+        db.add(OutboxEvent(kind=kind, handler=name, payload=payload))
+    db.info[PENDING_KEY] = True
+
+
+def add_many(db: Session, kind: str, payloads: Iterable[dict]) -> None:
+    """`add` for many events of one kind, in a single executemany."""
+    if not _handlers.get(kind):
+        raise ValueError(f"No handler is registered for outbox event kind: {kind}")
+    now = datetime.utcnow()
+    rows = [
+        {"kind": kind, "handler": name, "payload": json.dumps(payload, separators=(",", ":")),
+         "created_at": now, "available_at": now, "attempts": 0}
+        for payload in payloads
+        for name in _handlers[kind]
+    ]
+    if rows:
+        db.execute(insert(OutboxEvent), rows)
+        db.info[PENDING_KEY] = True
+
+
+def _handlers_for(kind: str, name: Optional[str]) -> List[Handler]:
+    if name is None:  # Added before rows named their handler
+        return list(_handlers.get(kind, {}).values())
+    handler = _handlers.get(kind, {}).get(name)
+    if handler is None:
+        raise LookupError(f"No handler {name} is registered for outbox event kind: {kind}")
+    return [handler]
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_processor(session: Session) -> None:
+    if session.info.pop(PENDING_KEY, False):
+        processor.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session: Session) -> None:
+    session.info.pop(PENDING_KEY, None)
+
+
+class Processor:
+    """Background thread that hands committed events to their handlers."""
+
+    def __init__(self, batch_size: int, poll_interval: float):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "processed": 0, "failed": 0, "dead": 0, "batches": 0, "conflicts": 0,
+            "latency_count": 0, "latency_seconds_sum": 0.0, "latency_seconds_max": 0.0, "lag_seconds": 0.0,
+        }
+
+    def start(self) -> None:
+        """Start processing; call once per worker after forking."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-processor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                claimed = self.batch_size
+                while claimed == self.batch_size and not self._stopped.is_set():
+                    claimed, _ = self.process_batch()
+            except Exception:
+                logger.exception("Outbox processing failed")
+            self._wake.wait(self.poll_interval)
+
+    def drain(self) -> int:
+        """Process batches until none is left that is due; returns how many rows were consumed."""
+        consumed = 0
+        while True:
+            claimed, delivered = self.process_batch()
+            consumed += delivered
+            if claimed < self.batch_size:
+                return consumed
+
+    def process_batch(self) -> tuple:
+        """Claim and deliver one batch; returns how many rows were claimed and how many delivered."""
+        db = SessionLocal()
+        try:
+            rows = self._claim(db)
+            if not rows:
+                self._measure_lag(db)
+                return 0, 0
+            try:
+                delivered = self._deliver(db, rows)
+            except Exception:
+                db.rollback()
+                logger.exception("Outbox batch failed; retrying its events one at a time")
+                delivered = 0
+                for row in rows:
+                    if not self._claim(db, row[0]):  # Locks it again, unless another worker has it now
+                        continue
+                    try:
+                        delivered += self._deliver(db, [row])
+                    except Exception as error:
+                        db.rollback()
+                        self._record_failure(db, row, error)
+            self._measure_lag(db)
+            return len(rows), delivered
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, event_id: Optional[int] = None) -> list:
+        query = db.query(
+            OutboxEvent.event_id, OutboxEvent.kind, OutboxEvent.handler, OutboxEvent.payload,
+            OutboxEvent.created_at, OutboxEvent.attempts,
+        )
+        if event_id is not None:
+            query = query.filter(OutboxEvent.event_id == event_id)
+        else:
+            query = query.filter(
+                OutboxEvent.available_at <= datetime.utcnow(), OutboxEvent.attempts < MAX_ATTEMPTS
+            ).order_by(OutboxEvent.event_id).limit(self.batch_size)
+        if db.get_bind().dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        return query.all()
+
+    def _deliver(self, db: Session, rows: list) -> int:
+        """Consume `rows` and run their handlers in one transaction. Returns how many were delivered."""
+        deleted = db.query(OutboxEvent).filter(
+            OutboxEvent.event_id.in_([row[0] for row in rows])
+        ).delete(synchronize_session=False)
+        if deleted != len(rows):
+            db.rollback()  # Another worker got there first
+            self._count("conflicts")
+            return 0
+
+        deliveries = []
+        for _, kind, name, payload, _, _ in rows:
+            delivery = Delivery(db, kind, json.loads(payload))
+            for handler in _handlers_for(kind, name):
+                handler(delivery)
+            deliveries.append(delivery)
+        db.commit()
+
+        for delivery in deliveries:
+            for callback in delivery.callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Outbox after-commit callback for %s failed", delivery.kind)
+
+        now = datetime.utcnow()
+        latencies = [max(0.0, (now - created_at).total_seconds()) for _, _, _, _, created_at, _ in rows]
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["processed"] += len(rows)
+            self._stats["latency_count"] += len(rows)
+            self._stats["latency_seconds_sum"] += sum(latencies)
+            self._stats["latency_seconds_max"] = max(self._stats["latency_seconds_max"], *latencies)
+        return len(rows)
+
+    def _record_failure(self, db: Session, row, error: Exception) -> None:
+        event_id, kind, name, _, _, attempts = row
+        attempts += 1
+        logger.error(
+            "Outbox event %s (%s, %s) failed, attempt %d of %d", event_id, kind, name, attempts, MAX_ATTEMPTS,
+            exc_info=error,
+        )
+        db.query(OutboxEvent).filter(OutboxEvent.event_id == event_id).update({
+            OutboxEvent.attempts: attempts,
+            OutboxEvent.available_at: datetime.utcnow() + timedelta(seconds=RETRY_BACKOFF * 2 ** (attempts - 1)),
+            OutboxEvent.last_error: repr(error)[:2000],
+        }, synchronize_session=False)
+        db.commit()
+        self._count("failed")
+        if attempts >= MAX_ATTEMPTS:
+            self._count("dead")
+
+    def _measure_lag(self, db: Session) -> None:
+        """Record the age of the oldest event still waiting, 0 when caught up."""
+        oldest = db.query(OutboxEvent.created_at).filter(
+            OutboxEvent.attempts < MAX_ATTEMPTS
+        ).order_by(OutboxEvent.event_id).limit(1).scalar()
+        db.rollback()  # End the read transaction
+        lag = max(0.0, (datetime.utcnow() - oldest).total_seconds()) if oldest is not None else 0.0
+        with self._lock:
+            self._stats["lag_seconds"] = lag
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+
+processor = Processor(settings.outbox_batch_size, settings.outbox_poll_interval)
+
+
+def stats() -> dict:
+    return processor.stats()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import main  # Registers every handler, with the `outbox` module rather than this __main__ copy
+
+    started = time.perf_counter()
+    consumed = main.outbox.processor.drain()
+    print(f"Processed {consumed} outbox rows in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,236 @@
+"""
+On-demand profiles of single requests.
+
+A request is profiled when it carries `X-Profile: <PROFILING_TOKEN>`, or at
+random with probability PROFILING_SAMPLE_RATE. A sampler thread then reads
+the stacks of every thread each SAMPLE_INTERVAL for as long as the request
+runs, and keeps the ones that are inside the matched route's endpoint or one
+of its dependencies. That covers sync endpoints in the threadpool as well as
+async ones on the event loop. Requests to the same route running at the
+same moment can mix into the profile.
+
+Each profile is written to PROFILING_DIR as two files named after the
+`X-Profile-Id` response header:
+
+    <id>.folded  collapsed stacks weighted in microseconds, for flamegraph.pl,
+                 speedscope or inferno
+    <id>.json    the request, its timings and every SQL statement it ran with
+                 its offset and duration (no parameters, they may be private)
+
+When neither trigger is configured the middleware is not installed at all,
+so there is no per-request cost. At most one request per worker is profiled
+at a time.
+"""
+import hmac
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import count
+from typing import Dict, Optional, Set
+
+import query_budget
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.001  # seconds
+PROFILE_HEADER = b"x-profile"
+
+_busy = threading.Lock()
+_sequence = count(1)
+
+
+def enabled() -> bool:
+    return bool(settings.profiling_token) or settings.profiling_sample_rate > 0
+
+
+def _requested(scope) -> bool:
+    if settings.profiling_token:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, settings.profiling_token.encode())
+    return random.random() < settings.profiling_sample_rate
+
+
+def _code_of(call) -> Optional[object]:
+    call = inspect.unwrap(call)
+    code = getattr(call, "__code__", None)
+    if code is None:
+        # Dependency instances such as HTTPBearer
+        code = getattr(getattr(call, "__call__", None), "__code__", None)
+    return code
+
+
+def _route_codes(route) -> Set[object]:
+    """Code objects of the route's endpoint and all of its dependencies."""
+    codes = set()
+    pending = [route.dependant]
+    while pending:
+        dependant = pending.pop()
+        if dependant.call is not None:
+            code = _code_of(dependant.call)
+            if code is not None:
+                codes.add(code)
+        pending.extend(dependant.dependencies)
+    return codes
+
+
+class Sampler:
+    """Collects the request's stacks from a background thread while it runs."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._codes: Optional[Set[object]] = None
+        self._labels: Dict[object, str] = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            now = time.perf_counter()
+            # Weighted by the time since the last sample, which the GIL can stretch
+            self.sample(round((now - last) * 1_000_000))
+            last = now
+
+    def sample(self, weight: int) -> None:
+        if self._codes is None:
+            route = self.scope.get("route")
+            if route is None or not hasattr(route, "dependant"):
+                return  # Not routed yet
+            self._codes = _route_codes(route)
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack, root = [], None
+            while frame is not None:
+                stack.append(frame.f_code)
+                if frame.f_code in self._codes:
+                    root = len(stack)  # Keep the outermost match as the root
+                frame = frame.f_back
+            if root is not None:
+                self.stacks[tuple(reversed(stack[:root]))] += weight
+                self.samples += 1
+
+    def label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def folded(self) -> str:
+        return "".join(
+            ";".join(self.label(code) for code in stack) + f" {weight}\n"
+            for stack, weight in self.stacks.most_common()
+        )
+
+
+def _short_path(path: str) -> str:
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and path.startswith(prefix + os.sep):
+            return path[len(prefix) + 1:]
+    return path
+
+
+def _profile_id(scope) -> str:
+    route = scope.get("route")
+    slug = "".join(c if c.isalnum() else "_" for c in (route.path if route is not None else "unmatched")).strip("_")
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}-{next(_sequence)}-{scope['method'].lower()}-{slug or 'root'}"
+
+
+def write_profile(profile_id: str, scope, sampler: Sampler, stats: query_budget.RequestStats,
+                  started: float, duration: float, status_code: int) -> None:
+    os.makedirs(settings.profiling_dir, exist_ok=True)
+    base = os.path.join(settings.profiling_dir, profile_id)
+    with open(f"{base}.folded", "w") as folded_file:
+        folded_file.write(sampler.folded())
+    route = scope.get("route")
+    with open(f"{base}.json", "w") as summary_file:
+        json.dump({
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route.path if route is not None else None,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "samples": sampler.samples,
+            "sample_interval_ms": SAMPLE_INTERVAL * 1000,
+            "db_queries": stats.queries,
+            "db_ms": round(stats.db_seconds * 1000, 3),
+            "statements": [
+                {
+                    "offset_ms": round((finished - seconds - started) * 1000, 3),
+                    "duration_ms": round(seconds * 1000, 3),
+                    "sql": statement,
+                }
+                for finished, seconds, statement in stats.statements or ()
+            ],
+        }, summary_file, indent=2)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles the requests picked by `_requested`.
+
+    Install it inside MetricsMiddleware, whose per-request stats it extends
+    with the SQL statements.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope) or not _busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            stats = query_budget.current_request.get()
+            token = None
+            if stats is None:
+                stats = query_budget.RequestStats()
+                token = query_budget.current_request.set(stats)
+            stats.statements = []
+            sampler = Sampler(scope)
+            profile_id = None
+            status_code = 500
+            started = time.perf_counter()
+
+            async def send_with_id(message):
+                nonlocal profile_id, status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    profile_id = _profile_id(scope)
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+                await send(message)
+
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                sampler.stop()
+                duration = time.perf_counter() - started
+                if token is not None:
+                    query_budget.current_request.reset(token)
+                try:
+                    write_profile(profile_id or _profile_id(scope), scope, sampler, stats, started, duration, status_code)
+                except OSError:
+                    logger.exception("Could not write the request profile")
+        finally:
+            _busy.release()
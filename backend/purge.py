@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Chunked deletion of large predictions, comment threads and groups.
+
+Small deletes are a single DELETE and the database's ON DELETE CASCADE
+foreign keys take care of the children. When an entity has more than
+PURGE_THRESHOLD dependent rows the request only sets its `deleted_at`
+tombstone, which hides it from every ORM query (see models.py), and
+schedules a purge. The purge removes children leaves-first in chunks of
+PURGE_CHUNK_SIZE rows, committing after every chunk, so no transaction
+holds locks on or loads a whole thread.
+
+Purges run as FastAPI background tasks. If a worker dies half-way, running
+this module sweeps every remaining tombstone:
+
+    python purge.py
+"""
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session, aliased
+
+import comment_threads
+from database import SessionLocal
+from models import Backing, Comment, CommentVote, Group, GroupMember, Prediction, Vote
+
+logger = logging.getLogger(__name__)
+
+PURGE_THRESHOLD = 1000
+PURGE_CHUNK_SIZE = 500
+
+# Purge queries have to see the tombstoned rows they are cleaning up
+INCLUDE_DELETED = {"include_deleted": True}
+
+
+def prediction_child_count(db: Session, prediction_id: int) -> int:
+    """Rows that deleting a prediction would cascade into, in one query."""
+    counts = [
+        select(func.count(Vote.vote_id)).where(Vote.prediction_id == prediction_id),
+        select(func.count(Backing.backing_id)).where(Backing.prediction_id == prediction_id),
+        select(func.count(Comment.comment_id)).where(Comment.prediction_id == prediction_id),
+        select(func.count(CommentVote.vote_id)).join(
+            Comment, Comment.comment_id == CommentVote.comment_id
+        ).where(Comment.prediction_id == prediction_id),
+    ]
+    return sum(db.execute(select(*[count.scalar_subquery() for count in counts]), execution_options=INCLUDE_DELETED).one())
+
+
+def comment_child_count(db: Session, comment: Comment) -> int:
+    """Descendants and votes that deleting a comment would cascade into."""
+    subtree = select(Comment.comment_id).where(comment_threads.in_subtree(comment))
+    counts = [
+        select(func.count()).select_from(subtree.subquery()),
+        select(func.count(CommentVote.vote_id)).where(CommentVote.comment_id.in_(subtree)),
+    ]
+    return sum(db.execute(select(*[count.scalar_subquery() for count in counts]), execution_options=INCLUDE_DELETED).one())
+
+
+def group_child_count(db: Session, group_id: int) -> int:
+    """Members and predictions of a group; each prediction's own children are counted when it is purged."""
+    counts = [
+        select(func.count(GroupMember.group_member_id)).where(GroupMember.group_id == group_id),
+        select(func.count(Prediction.prediction_id)).where(Prediction.group_id == group_id),
+    ]
+    return sum(db.execute(select(*[count.scalar_subquery() for count in counts]), execution_options=INCLUDE_DELETED).one())
+
+
+def tombstone(db: Session, entity) -> None:
+    """Hide `entity` from all reads; its rows are removed later by a purge.
+
+    A comment's replies and a group's predictions are tombstoned with it,
+    so they drop out of counts, lists and feeds and cannot be reached by
+    their own ids either.
+    """
+    now = datetime.utcnow()
+    entity.deleted_at = now
+    if isinstance(entity, Comment):
+        db.query(Comment).filter(
+            comment_threads.in_subtree(entity), Comment.deleted_at.is_(None)
+        ).update({Comment.deleted_at: now}, synchronize_session=False)
+    elif isinstance(entity, Group):
+        db.query(Prediction).filter(
+            Prediction.group_id == entity.group_id, Prediction.deleted_at.is_(None)
+        ).update({Prediction.deleted_at: now}, synchronize_session=False)
+    db.commit()
+
+
+def delete_in_chunks(db: Session, model, condition, order_by=(), chunk_size: int = PURGE_CHUNK_SIZE) -> int:
+    """Delete rows of `model` matching `condition`, committing every `chunk_size` rows."""
+    primary_key = model.__mapper__.primary_key[0]
+    deleted = 0
+    while True:
+        ids = db.execute(
+            select(primary_key).where(condition).order_by(*order_by).limit(chunk_size),
+            execution_options=INCLUDE_DELETED,
+        ).scalars().all()
+        if not ids:
+            return deleted
+        db.query(model).filter(primary_key.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+
+
+def _purge_prediction_children(db: Session, prediction_id: int) -> None:
+    comment_ids = select(Comment.comment_id).where(Comment.prediction_id == prediction_id)
+    delete_in_chunks(db, CommentVote, CommentVote.comment_id.in_(comment_ids))
+    # Deepest comments first, so no chunk cascades into a reply subtree
+    delete_in_chunks(db, Comment, Comment.prediction_id == prediction_id, order_by=[Comment.depth.desc()])
+    delete_in_chunks(db, Vote, Vote.prediction_id == prediction_id)
+    delete_in_chunks(db, Backing, Backing.prediction_id == prediction_id)
+
+
+def purge_prediction(prediction_id: int) -> None:
+    """Remove a tombstoned prediction and everything attached to it."""
+    db = SessionLocal()
+    try:
+        _purge_prediction_children(db, prediction_id)
+        db.query(Prediction).filter(Prediction.prediction_id == prediction_id).delete(synchronize_session=False)
+        db.commit()
+        logger.info("Purged prediction %s", prediction_id)
+    finally:
+        db.close()
+
+
+def purge_comment(comment_id: int) -> None:
+    """Remove a tombstoned comment and its whole reply subtree."""
+    db = SessionLocal()
+    try:
+        comment = db.get(Comment, comment_id, execution_options=INCLUDE_DELETED)
+        if comment is None:
+            return
+        subtree = comment_threads.in_subtree(comment)
+        delete_in_chunks(db, CommentVote, CommentVote.comment_id.in_(select(Comment.comment_id).where(subtree)))
+        delete_in_chunks(db, Comment, subtree, order_by=[Comment.depth.desc()])
+        logger.info("Purged comment %s", comment_id)
+    finally:
+        db.close()
+
+
+def purge_group(group_id: int) -> None:
+    """Remove a tombstoned group, its memberships and its predictions."""
+    db = SessionLocal()
+    try:
+        while True:
+            prediction_id = db.execute(
+                select(Prediction.prediction_id).where(Prediction.group_id == group_id).limit(1),
+                execution_options=INCLUDE_DELETED,
+            ).scalar()
+            if prediction_id is None:
+                break
+            _purge_prediction_children(db, prediction_id)
+            db.query(Prediction).filter(Prediction.prediction_id == prediction_id).delete(synchronize_session=False)
+            db.commit()
+        delete_in_chunks(db, GroupMember, GroupMember.group_id == group_id)
+        db.query(Group).filter(Group.group_id == group_id).delete(synchronize_session=False)
+        db.commit()
+        logger.info("Purged group %s", group_id)
+    finally:
+        db.close()
+
+
+def _tombstoned_outside_groups():
+    """Tombstoned predictions that are not purged with a tombstoned group."""
+    tombstoned_groups = select(Group.group_id).where(Group.deleted_at.isnot(None))
+    return select(Prediction.prediction_id).where(
+        Prediction.deleted_at.isnot(None),
+        or_(Prediction.group_id.is_(None), Prediction.group_id.not_in(tombstoned_groups)),
+    )
+
+
+def _tombstoned_subtree_roots():
+    """Tombstoned comments whose parent is not; purging those removes the rest."""
+    parent = aliased(Comment)
+    return select(Comment.comment_id).outerjoin(
+        parent, parent.comment_id == Comment.parent_comment_id
+    ).where(Comment.deleted_at.isnot(None), or_(parent.comment_id.is_(None), parent.deleted_at.is_(None)))
+
+
+def purge_pending(db: Optional[Session] = None) -> int:
+    """Finish every purge that was interrupted. Returns the number of entities purged."""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        pending = [
+            (purge_group, db.execute(select(Group.group_id).where(Group.deleted_at.isnot(None)), execution_options=INCLUDE_DELETED).scalars().all()),
+            (purge_prediction, db.execute(_tombstoned_outside_groups(), execution_options=INCLUDE_DELETED).scalars().all()),
+            (purge_comment, db.execute(_tombstoned_subtree_roots(), execution_options=INCLUDE_DELETED).scalars().all()),
+        ]
+    finally:
+        if own_session:
+            db.close()
+
+    purged = 0
+    for purge, ids in pending:
+        for entity_id in ids:
+            purge(entity_id)
+            purged += 1
+    return purged
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Purged {purge_pending()} tombstoned entities.")
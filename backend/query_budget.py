@@ -0,0 +1,143 @@
+"""
+Per-request query accounting, query budgets and N+1 detection.
+
+Engine events count every statement and its time against the current
+request (see `current_request`, set by metrics.MetricsMiddleware). With
+DEBUG on, each request also records statement shapes: the SQL with literals
+and IN-list lengths normalized away. Responses then carry `X-DB-Queries` and
+`X-DB-Time-Ms`, and any shape repeated N_PLUS_ONE_THRESHOLD times in one
+request is logged as a likely N+1.
+
+`query_budget()` checks the same numbers outside a request, for tests and
+benchmarks:
+
+    with query_budget(5):
+        client.get("/feed/home", headers=auth)
+
+tests/conftest.py wraps it in the `assert_max_queries` fixture, and
+tests/test_query_budgets.py pins the budgets of the hot endpoints, so an
+N+1 fails the test run.
+"""
+import contextlib
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = 5  # runs of one statement shape within a request
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|:\w+|__\[POSTCOMPILE_\w+\])\s*,?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    """`statement` with literals and placeholder lists collapsed, so N+1 runs compare equal."""
+    shape = _LITERALS.sub("?", statement)
+    shape = _PLACEHOLDER_LISTS.sub("(...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class RequestStats:
+    """What one request did, filled in as it runs."""
+
+    __slots__ = ("queries", "db_seconds", "shapes", "statements", "scope")
+
+    def __init__(self, track_shapes: bool = False, scope: Optional[dict] = None):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.shapes: Optional[Counter] = Counter() if track_shapes else None
+        # (perf_counter at the end, seconds, SQL) of every statement, when a profile asks for them
+        self.statements: Optional[List[Tuple[float, float, str]]] = None
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_seconds += seconds
+        if self.shapes is not None:
+            self.shapes[statement_shape(statement)] += 1
+        if self.statements is not None:
+            self.statements.append((time.perf_counter(), seconds, statement))
+
+    def endpoint(self) -> Optional[str]:
+        """"GET /predictions/{prediction_id}" once routed, else the raw path."""
+        if self.scope is None:
+            return None
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {route.path if route is not None else self.scope['path']}"
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """Statement shapes run at least `threshold` times, most frequent first."""
+        if self.shapes is None:
+            return []
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def report(self) -> str:
+        lines = [f"{self.queries} queries" + (f" in {self.db_seconds * 1000:.1f} ms" if self.db_seconds else "")]
+        lines += [f"  {count}x {shape}" for shape, count in self.repeated()]
+        return "\n".join(lines)
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    conn.info["query_seconds"] = elapsed  # For listeners registered after this one, e.g. slow_queries
+    stats = current_request.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+event.listen(engine, "before_cursor_execute", _start_timer)
+event.listen(engine, "after_cursor_execute", _stop_timer)
+
+
+@contextlib.contextmanager
+def query_budget(max_queries: int, bind: Engine = engine) -> Iterator[RequestStats]:
+    """Count every statement `bind` runs inside the block, from any thread.
+
+    Raises QueryBudgetExceeded, listing the repeated statement shapes, if
+    there were more than `max_queries`.
+    """
+    stats = RequestStats(track_shapes=True)
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        stats.record(statement, 0.0)
+
+    event.listen(bind, "before_cursor_execute", count)
+    try:
+        yield stats
+    finally:
+        event.remove(bind, "before_cursor_execute", count)
+    if stats.queries > max_queries:
+        raise QueryBudgetExceeded(f"Query budget of {max_queries} exceeded: {stats.report()}")
+
+
+def debug_headers(stats: RequestStats) -> List[Tuple[bytes, bytes]]:
+    return [
+        (b"x-db-queries", str(stats.queries).encode()),
+        (b"x-db-time-ms", f"{stats.db_seconds * 1000:.1f}".encode()),
+    ]
+
+
+def log_n_plus_one(stats: RequestStats, method: str, path: str) -> None:
+    for shape, count in stats.repeated():
+        logger.warning("Possible N+1 in %s %s: %sx %s", method, path, count, shape)
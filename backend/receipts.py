@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Merkle-batched prediction receipts.
+
+Every BATCH_INTERVAL the predictions that are not in a batch yet are sealed
+into one: their hashes become the leaves of a Merkle tree, the root is stored
+in `receipt_batches`, and each prediction keeps its leaf index and inclusion
+proof. A receipt then shows that the prediction was part of a root that
+existed by the batch's `sealed_at`, and anyone holding the root can check
+the proof in O(log n) hashes without trusting the prediction row.
+
+The tree follows RFC 6962: leaves are SHA-256(0x00 || digest), inner nodes
+SHA-256(0x01 || left || right), and an unpaired last node is promoted to the
+next level unchanged. The prefixes keep a leaf from passing for an inner
+node.
+
+Sealing runs at most once per BATCH_INTERVAL per process as a background
+task after a prediction is created, and can be run by hand or from cron:
+
+    python receipts.py
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Prediction, ReceiptBatch
+
+logger = logging.getLogger(__name__)
+
+BATCH_INTERVAL = 600  # seconds
+MAX_BATCH_SIZE = 50000  # leaves; the rest wait for the next batch
+SEAL_LOCK_KEY = 0x52454345  # pg advisory lock shared by every sealing worker
+
+LEFT = "left"
+RIGHT = "right"
+
+ProofStep = Tuple[str, str]  # (side of the sibling, sibling hash as hex)
+
+_last_seal = 0.0
+_seal_lock = threading.Lock()
+
+
+def leaf_hash(prediction_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(prediction_hash)).digest()
+
+
+def _node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def build_tree(leaves: Sequence[bytes]) -> Tuple[bytes, List[List[ProofStep]]]:
+    """Root of the tree over `leaves` and the inclusion proof of every leaf, in order."""
+    if not leaves:
+        raise ValueError("A Merkle tree needs at least one leaf")
+    proofs: List[List[ProofStep]] = [[] for _ in leaves]
+    positions = list(range(len(leaves)))  # Each leaf's index on the current level
+    level = list(leaves)
+    while len(level) > 1:
+        for leaf, index in enumerate(positions):
+            sibling = index ^ 1
+            if sibling < len(level):
+                proofs[leaf].append((LEFT if sibling < index else RIGHT, level[sibling].hex()))
+            positions[leaf] = index // 2
+        level = [
+            _node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+    return level[0], proofs
+
+
+def root_from_proof(prediction_hash: str, proof: Iterable[ProofStep]) -> bytes:
+    """The root that `proof` leads to from the prediction's hash."""
+    node = leaf_hash(prediction_hash)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        if side == LEFT:
+            node = _node_hash(sibling, node)
+        elif side == RIGHT:
+            node = _node_hash(node, sibling)
+        else:
+            raise ValueError(f"Unknown proof step side: {side}")
+    return node
+
+
+def load_proof(prediction: Prediction) -> Optional[List[ProofStep]]:
+    """A sealed prediction's stored inclusion proof, or None before it is sealed."""
+    if prediction.receipt_proof is None:
+        return None
+    return [tuple(step) for step in json.loads(prediction.receipt_proof)]
+
+
+def _take_seal_lock(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return True  # SQLite serializes writers on its own
+    return db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SEAL_LOCK_KEY}).scalar()
+
+
+def seal_batch(db: Session, now: Optional[datetime] = None) -> Optional[ReceiptBatch]:
+    """Seal up to MAX_BATCH_SIZE unbatched predictions into a new batch and commit.
+
+    Returns None when there was nothing to seal or another worker is sealing.
+    """
+    if not _take_seal_lock(db):
+        db.rollback()
+        return None
+    rows = db.query(Prediction.prediction_id, Prediction.hash, Prediction.timestamp).filter(
+        Prediction.receipt_batch_id.is_(None)
+    ).order_by(Prediction.prediction_id).limit(MAX_BATCH_SIZE).all()
+    if not rows:
+        db.rollback()
+        return None
+
+    root, proofs = build_tree([leaf_hash(row.hash) for row in rows])
+    timestamps = [row.timestamp for row in rows if row.timestamp is not None]
+    batch = ReceiptBatch(
+        root=root.hex(),
+        leaf_count=len(rows),
+        first_timestamp=min(timestamps, default=None),
+        last_timestamp=max(timestamps, default=None),
+        sealed_at=now or datetime.utcnow(),
+    )
+    db.add(batch)
+    db.flush()
+    db.execute(update(Prediction), [{
+        "prediction_id": row.prediction_id,
+        "receipt_batch_id": batch.batch_id,
+        "receipt_leaf_index": index,
+        "receipt_proof": json.dumps(proof, separators=(",", ":")),
+    } for index, (row, proof) in enumerate(zip(rows, proofs))])
+    db.commit()
+    return batch
+
+
+def seal_pending(db: Session) -> int:
+    """Seal batches until every prediction is in one; returns how many were sealed."""
+    sealed = 0
+    while seal_batch(db) is not None:
+        sealed += 1
+    return sealed
+
+
+def seal_if_due() -> None:
+    """Seal in a fresh session unless this process did so within BATCH_INTERVAL."""
+    global _last_seal
+    with _seal_lock:
+        if time.monotonic() - _last_seal < BATCH_INTERVAL:
+            return
+        _last_seal = time.monotonic()
+    db = SessionLocal()
+    try:
+        batch = seal_batch(db)
+        if batch is not None:
+            logger.info("Sealed receipt batch %s with %s predictions", batch.batch_id, batch.leaf_count)
+    finally:
+        db.close()
+
+
+def verify(db: Session, receipts: Sequence[Tuple[str, int, Iterable[ProofStep]]]) -> List[bool]:
+    """Check (prediction hash, batch id, proof) receipts against the stored roots.
+
+    All the roots are loaded in one query; each proof is then checked in
+    memory. A malformed receipt is reported invalid rather than raising.
+    """
+    batch_ids = {batch_id for _, batch_id, _ in receipts}
+    roots = dict(db.query(ReceiptBatch.batch_id, ReceiptBatch.root).filter(ReceiptBatch.batch_id.in_(batch_ids)))
+    results = []
+    for prediction_hash, batch_id, proof in receipts:
+        root = roots.get(batch_id)
+        try:
+            results.append(root is not None and root_from_proof(prediction_hash, proof).hex() == root)
+        except ValueError:
+            results.append(False)
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        print(f"Sealed {seal_pending(session)} receipt batches.")
+    finally:
+        session.close()
@@ -0,0 +1,225 @@
+"""
+Shared cache of whole anonymous responses, stored precompressed.
+
+An endpoint opts a response in with `cache_for(request, max_age, tags)`;
+nothing else is cached. Only anonymous GET requests (no Authorization
+header) are stored or served, and only 200s. The cache key is the path plus
+the query string. Each entry is compressed once, at PRECOMPRESSED_LEVELS,
+into every encoding the server supports, so a hit sends the variant the
+client accepts without compressing anything. Hits also carry `Cache-Control:
+public, max-age=<remaining>` for browsers and CDNs.
+
+Entries expire after their max age. Tags such as `("prediction", 12)` let
+the invalidation bus drop them earlier, e.g. a comment thread page when a
+comment is added, or a sealed receipt whose prediction gets deleted. Each worker keeps its own cache, bounded by
+RESPONSE_CACHE_MAX_BYTES.
+
+Hits are answered here, before routing, so they skip the endpoint's rate
+limit dependency: they cost next to nothing.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import anyio
+from fastapi import Request
+from starlette.datastructures import Headers, MutableHeaders
+
+import compression
+import invalidation
+from config import settings
+
+SCOPE_KEY = "response_cache"
+FEED_MAX_AGE = 10  # seconds an anonymous feed page may be behind
+THREAD_MAX_AGE = 60
+RECEIPT_MAX_AGE = 3600  # Sealed receipts only change if the prediction is deleted, which is tagged
+SKIPPED_HEADERS = frozenset({b"content-length", b"content-encoding", b"cache-control", b"vary"})
+
+Tag = Tuple[str, object]
+
+
+def cache_for(request: Request, max_age: int, tags: Iterable[Tag] = ()) -> None:
+    """Let the response to this request be cached for `max_age` seconds if it is anonymous."""
+    request.scope[SCOPE_KEY] = (max_age, [f"{kind}:{entity_id}" for kind, entity_id in tags])
+
+
+class Entry:
+    __slots__ = ("expires", "headers", "bodies", "route", "size", "tags")
+
+    def __init__(self, expires: float, headers: list, bodies: Dict[str, bytes], route, tags: list):
+        self.expires = expires
+        self.headers = headers
+        self.bodies = bodies  # By content encoding, identity included
+        self.route = route
+        self.size = sum(len(body) for body in bodies.values())
+        self.tags = tags
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, Entry]" = OrderedDict()
+        self._tagged: Dict[str, Set[bytes]] = defaultdict(set)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    def get(self, key: bytes) -> Optional[Entry]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: bytes, entry: Entry) -> None:
+        if entry.size > self.max_bytes // 10:
+            return  # One response may not push out most of the cache
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for tag in entry.tags:
+                self._tagged[tag].add(key)
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: bytes) -> None:
+        """Drop one entry. Holds the lock."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def invalidate(self, tag: str) -> None:
+        with self._lock:
+            for key in list(self._tagged.get(tag, ())):
+                self._remove(key)
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+
+cache = ResponseCache(settings.response_cache_max_bytes)
+
+
+def stats() -> dict:
+    return cache.stats()
+
+
+def _precompress(body: bytes) -> Dict[str, bytes]:
+    bodies = {compression.IDENTITY: body}
+    if len(body) >= settings.compression_min_size:
+        for encoding in compression.ENCODINGS:
+            compressed = compression.compress(body, encoding, compression.PRECOMPRESSED_LEVELS)
+            if len(compressed) < len(body):
+                bodies[encoding] = compressed
+    return bodies
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware that serves and stores the responses endpoints opted in with `cache_for`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        if "authorization" in request_headers:
+            await self.app(scope, receive, send)
+            return
+
+        key = scope["path"].encode() + b"?" + scope["query_string"]
+        entry = cache.get(key)
+        if entry is not None:
+            await self._send_entry(scope, send, entry, request_headers)
+            return
+
+        start = None
+        body = []
+
+        async def send_and_store(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    start = False
+                    await send(message)
+                else:
+                    start = message  # Held back until we know the endpoint opted in
+                return
+            if start is False or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body.append(message.get("body", b""))
+            if message.get("more_body"):
+                if SCOPE_KEY in scope:
+                    return  # Opted in: collect the rest
+                await send(start)
+                await send({"type": "http.response.body", "body": b"".join(body), "more_body": True})
+                start = False
+                return
+            opted_in = scope.get(SCOPE_KEY)
+            if opted_in is None:
+                await send(start)
+                await send({"type": "http.response.body", "body": b"".join(body)})
+                return
+            max_age, tags = opted_in
+            headers = [(name, value) for name, value in start.get("headers", []) if name.lower() not in SKIPPED_HEADERS]
+            # Off the event loop: high compression levels take a while on big pages
+            bodies = await anyio.to_thread.run_sync(_precompress, b"".join(body))
+            stored = Entry(time.monotonic() + max_age, headers, bodies, scope.get("route"), tags)
+            cache.put(key, stored)
+            await self._send_entry(scope, send, stored, request_headers, hit=False)
+
+        await self.app(scope, receive, send_and_store)
+
+    async def _send_entry(self, scope, send, entry: Entry, request_headers: Headers, hit: bool = True) -> None:
+        if hit and entry.route is not None:
+            scope["route"] = entry.route  # So metrics label the hit with its route
+        available = [encoding for encoding in compression.ENCODINGS if encoding in entry.bodies]
+        encoding = compression.negotiate(request_headers.get("accept-encoding"), available)
+        body = entry.bodies[encoding or compression.IDENTITY]
+        if encoding is not None:
+            compression.record_sent(encoding, len(entry.bodies[compression.IDENTITY]), len(body))
+
+        message = {"type": "http.response.start", "status": 200, "headers": list(entry.headers)}
+        headers = MutableHeaders(scope=message)
+        headers["content-length"] = str(len(body))
+        headers["cache-control"] = f"public, max-age={max(0, math.ceil(entry.expires - time.monotonic()))}"
+        headers["x-cache"] = "hit" if hit else "miss"
+        compression.add_vary(headers)
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        await send(message)
+        await send({"type": "http.response.body", "body": body})
+
+
+def _invalidate_prediction(prediction_id) -> None:
+    cache.invalidate(f"prediction:{prediction_id}")
+
+
+invalidation.subscribe("prediction", _invalidate_prediction)
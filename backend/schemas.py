@@ -85,6 +85,11 @@ class PredictionListResponse(BaseModel):
     per_page: int
 
 
+class FeedResponse(BaseModel):
+    predictions: List[PredictionResponse]
+    next_cursor: Optional[str] = None
+
+
 # Vote schemas
 class VoteRequest(BaseModel):
     value: int = Field(..., ge=-1, le=1)
@@ -114,6 +119,11 @@ class BackingResponse(BaseModel):
 
 
 # Receipt schema
+class ReceiptProofStep(BaseModel):
+    side: str = Field(..., pattern="^(left|right)$")  # Which side the sibling hash goes on
+    hash: str
+
+
 class PredictionReceipt(BaseModel):
     prediction_id: int
     title: str
@@ -122,6 +132,45 @@ class PredictionReceipt(BaseModel):
     timestamp: datetime
     hash: str
     verification_url: str
+    # Set once the prediction is sealed into a Merkle batch
+    batch_id: Optional[int] = None
+    merkle_root: Optional[str] = None
+    sealed_at: Optional[datetime] = None
+    leaf_index: Optional[int] = None
+    proof: Optional[List[ReceiptProofStep]] = None
+
+
+class ReceiptToVerify(BaseModel):
+    hash: str
+    batch_id: int
+    proof: List[ReceiptProofStep]
+
+
+class ReceiptVerifyRequest(BaseModel):
+    receipts: List[ReceiptToVerify] = Field(..., max_length=5000)
+
+
+class ReceiptVerifyResult(BaseModel):
+    hash: str
+    batch_id: int
+    valid: bool
+
+
+class ReceiptVerifyResponse(BaseModel):
+    results: List[ReceiptVerifyResult]
+    valid_count: int
+    invalid_count: int
+
+
+# Trending schemas
+class TrendingCategory(BaseModel):
+    category: str
+    prediction_count: int
+
+
+class TrendingCategoriesResponse(BaseModel):
+    window: str
+    categories: List[TrendingCategory]
 
 
 # Error schemas
@@ -152,6 +201,7 @@ class GroupResponse(GroupBase):
 
 class GroupListResponse(BaseModel):
     groups: List[GroupResponse]
+    next_cursor: Optional[str] = None
 
 class MessageResponse(BaseModel):
     message: str
@@ -187,4 +237,29 @@ class CommentResponse(BaseModel):
         from_attributes = True
 
 # This is needed for the recursive 'replies' field to work correctly
-CommentResponse.model_rebuild()
\ No newline at end of file
+CommentResponse.model_rebuild()
+
+
+class CommentThreadNode(BaseModel):
+    comment_id: int
+    prediction_id: int
+    user: UserResponse
+    parent_comment_id: Optional[int]
+    content: str
+    timestamp: datetime
+    vote_score: int = 0
+    user_vote: Optional[int] = None
+    reply_count: int = 0
+    descendant_count: int = 0
+    replies: List['CommentThreadNode'] = []
+    replies_cursor: Optional[str] = None  # Pass back with parent_id to load more replies
+
+    class Config:
+        from_attributes = True
+
+CommentThreadNode.model_rebuild()
+
+
+class CommentThreadResponse(BaseModel):
+    comments: List[CommentThreadNode]
+    next_cursor: Optional[str] = None
\ No newline at end of file
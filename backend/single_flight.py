@@ -0,0 +1,76 @@
+"""
+Coalescing of concurrent identical work within a worker.
+
+`Group.do(key, fn)` runs `fn` once for all the threads that ask for the same
+key at the same time. The first caller runs it. The others wait for the
+result and share it, instead of each repeating the same queries, e.g. when a
+viral prediction's cache entry expires under a few hundred requests. Results
+are shared as they are, so return plain values rather than anything tied to
+the caller, such as ORM instances bound to its session.
+
+A waiter whose leader fails, or takes longer than the group's timeout, runs
+`fn` itself. `forget(key)` detaches the call in flight, so callers that
+arrive after a write do not get a result read before it.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+DEFAULT_TIMEOUT = 5.0  # seconds a waiter gives the leader before doing the work itself
+
+
+class _Call:
+    __slots__ = ("done", "result", "failed")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class Group:
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "fallbacks": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """`fn()`, or the result of the call already running for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+
+        if not leader:
+            if call.done.wait(self.timeout) and not call.failed:
+                self._count("coalesced")
+                return call.result
+            self._count("fallbacks")
+            return fn()
+
+        try:
+            call.result = fn()
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self, key: Hashable) -> None:
+        """Let the next caller for `key` start a new call instead of joining the one in flight."""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,177 @@
+"""
+Slow query log with automatic plan capture.
+
+Every statement that takes longer than SLOW_QUERY_MS is logged on the
+`slow_query` logger as one JSON line: duration, the endpoint that ran it
+(route template, via query_budget's per-request stats), the SQL and its
+parameters. The timing is query_budget's, so this adds no second timer.
+
+The first time a statement shape turns up slow, and again at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL, a background thread runs EXPLAIN (EXPLAIN
+QUERY PLAN on SQLite) for it with the same parameters on its own connection.
+It never runs ANALYZE, so nothing is executed twice. At most EXPLAIN_QUEUE
+plans wait at a time; more are dropped.
+
+Each worker keeps the TRACKED_SHAPES slowest shapes seen in the last WINDOW
+with counts, worst and total time, the last example and its plan.
+`/internal/slow-queries` lists the slowest TOP_N of the worker that answers.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+
+import query_budget
+from config import settings
+from database import engine
+
+logger = logging.getLogger("slow_query")
+
+TOP_N = 20
+TRACKED_SHAPES = 200
+WINDOW = 3600  # seconds a shape stays in the top list without turning up again
+EXPLAIN_QUEUE = 10
+MAX_PARAMETERS_LENGTH = 2000  # characters of repr() in the log
+EXPLAINABLE = ("select", "with", "update", "delete", "insert")
+
+
+class SlowShape:
+    __slots__ = ("shape", "count", "total_seconds", "max_seconds", "last_seen", "endpoint", "statement", "plan", "explained_at")
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seen = 0.0
+        self.endpoint: Optional[str] = None
+        self.statement = ""
+        self.plan: Optional[str] = None
+        self.explained_at = float("-inf")
+
+    def as_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "mean_ms": round(self.total_seconds / self.count * 1000, 2),
+            "last_seen": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.last_seen)),
+            "endpoint": self.endpoint,
+            "statement": self.statement,
+            "plan": self.plan,
+        }
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self._shapes = {}
+        self._lock = threading.Lock()
+        self._explains: "queue.Queue" = queue.Queue(maxsize=EXPLAIN_QUEUE)
+        self._worker: Optional[threading.Thread] = None
+
+    def record(self, statement: str, parameters, seconds: float, endpoint: Optional[str], explainable: bool) -> None:
+        shape = query_budget.statement_shape(statement)
+        now = time.time()
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                entry = self._shapes[shape] = SlowShape(shape)
+                if len(self._shapes) > TRACKED_SHAPES:
+                    self._evict(now)
+            entry.count += 1
+            entry.total_seconds += seconds
+            entry.max_seconds = max(entry.max_seconds, seconds)
+            entry.last_seen = now
+            entry.endpoint = endpoint
+            entry.statement = statement
+            explain = explainable and now - entry.explained_at >= settings.slow_query_explain_interval
+            if explain:
+                entry.explained_at = now
+
+        logger.warning(json.dumps({
+            "duration_ms": round(seconds * 1000, 2),
+            "endpoint": endpoint,
+            "statement": statement,
+            "parameters": repr(parameters)[:MAX_PARAMETERS_LENGTH],
+        }, separators=(",", ":")))
+        if explain:
+            self._queue_explain(entry, statement, parameters)
+
+    def _evict(self, now: float) -> None:
+        """Drop shapes outside the window, or else the least slow one. Holds the lock."""
+        stale = [shape for shape, entry in self._shapes.items() if now - entry.last_seen > WINDOW]
+        for shape in stale:
+            del self._shapes[shape]
+        if len(self._shapes) > TRACKED_SHAPES:
+            del self._shapes[min(self._shapes.values(), key=lambda entry: entry.max_seconds).shape]
+
+    def top(self, limit: int = TOP_N) -> list:
+        cutoff = time.time() - WINDOW
+        with self._lock:
+            entries = [entry for entry in self._shapes.values() if entry.last_seen >= cutoff]
+            entries.sort(key=lambda entry: entry.max_seconds, reverse=True)
+            return [entry.as_dict() for entry in entries[:limit]]
+
+    # Plan capture
+
+    def _queue_explain(self, entry: SlowShape, statement: str, parameters) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                # Started on first use, so it belongs to the worker process that needs it
+                self._worker = threading.Thread(target=self._run_explains, name="slow-query-explain", daemon=True)
+                self._worker.start()
+        try:
+            self._explains.put_nowait((entry, statement, parameters))
+        except queue.Full:
+            pass
+
+    def _run_explains(self) -> None:
+        while True:
+            entry, statement, parameters = self._explains.get()
+            try:
+                plan = explain(statement, parameters)
+            except Exception as exc:
+                plan = f"EXPLAIN failed: {exc}"
+            with self._lock:
+                entry.plan = plan
+            logger.warning(json.dumps({"plan_for": entry.shape, "plan": plan}, separators=(",", ":")))
+
+
+def explain(statement: str, parameters) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    _explaining.active = True
+    try:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters or ()).fetchall()
+            connection.rollback()
+    finally:
+        _explaining.active = False
+    if engine.dialect.name == "sqlite":
+        # (id, parent, notused, detail)
+        return "\n".join(str(row[-1]) for row in rows)
+    return "\n".join(str(row[0]) for row in rows)
+
+
+slow_log = SlowQueryLog()
+_explaining = threading.local()  # Keeps the EXPLAIN statements themselves out of the log
+
+
+def _check(conn, cursor, statement, parameters, context, executemany):
+    seconds = conn.info.get("query_seconds", 0.0)
+    if seconds * 1000 < settings.slow_query_ms or getattr(_explaining, "active", False):
+        return
+    stats = query_budget.current_request.get()
+    explainable = not executemany and statement.lstrip()[:6].lower().startswith(EXPLAINABLE)
+    slow_log.record(statement, parameters, seconds, stats.endpoint() if stats is not None else None, explainable)
+
+
+# Registered after query_budget's timer, whose measurement it reads
+event.listen(engine, "after_cursor_execute", _check)
+
+
+def top(limit: int = TOP_N) -> list:
+    return slow_log.top(limit)
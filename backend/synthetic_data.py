@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator.
+
+Fills an empty database with users, groups, memberships, predictions,
+votes, backings, comment threads and comment votes. Row counts grow
+linearly with a TPC-style scale factor; scale 1 is about 14 million rows:
+
+    users          100,000      predictions    1,000,000
+    groups           2,000      votes          5,000,000
+    memberships   ~300,000      backings         500,000
+                                comments       2,000,000
+                                comment votes ~4,000,000
+
+The shape is meant to look like real traffic rather than uniform noise:
+
+- Popularity is Zipfian. A few users write most predictions, a few groups
+  hold most members, and a few predictions collect most votes, backings and
+  comments. Which ids are popular is shuffled, not the lowest ones.
+- Timelines are bursty: most predictions fall into short bursts around
+  events spread over the last year, and votes and comments trail their
+  prediction with an exponential delay.
+- Threads are deep: most comments reply to one of the latest comments in
+  their thread, which builds the long reply chains real threads have.
+
+Everything is drawn from one seeded generator and the timeline ends at the
+start of the current UTC day, so a seed and scale produce the same rows all
+day (pass `now` to pin it further). Rows are streamed to the database in chunks, with
+COPY on Postgres and multi-row INSERTs elsewhere, and derived counters
+(group and comment totals, wisdom levels, activity buckets) are filled in
+so the data looks as if it had gone through the API.
+
+Usage:
+    python synthetic_data.py --scale 0.01 [--seed 42] [--database-url URL] [--create-tables]
+
+The target must be empty; every user's password is PASSWORD.
+"""
+import argparse
+import bisect
+import csv
+import enum
+import hashlib
+import io
+import itertools
+import logging
+import random
+import time
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+import activity
+import comment_threads
+from auth import get_password_hash
+from models import (
+    ActivityBucket, Backing, Comment, CommentVote, Group, GroupMember, HexDigest, LoginType,
+    Prediction, User, Vote, Visibility,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows at scale 1
+USERS = 100_000
+GROUPS = 2_000
+MEMBERSHIPS_PER_USER = 3
+PREDICTIONS = 1_000_000
+VOTES = 5_000_000
+BACKINGS = 500_000
+COMMENTS = 2_000_000
+COMMENT_VOTE_TAIL = 1.4  # Pareto shape of votes per comment; about 2 on average
+
+ZIPF_EXPONENT = 1.07
+SPAN = timedelta(days=365)
+BURSTS = 120  # events over SPAN that predictions cluster around
+BURST_SHARE = 0.7  # of predictions made during a burst
+BURST_LENGTH = timedelta(hours=6)  # mean spread around a burst's centre
+REACTION_DELAY = timedelta(days=1)  # mean delay of votes and comments after their prediction
+REPLY_SHARE = 0.75  # of comments that reply to another comment
+REPLY_WINDOW = 8  # replies go to one of the thread's latest comments
+PRIVATE_SHARE = 0.1
+GROUP_SHARE = 0.3  # of predictions posted to one of the author's groups
+NO_BACKING_SHARE = 0.1
+CATEGORIES = ("Sports", "Movies", "Television", "Pop Culture", "Politics", "Tech", "Science", "General")
+
+PASSWORD = "synthetic"
+CHUNK_SIZE = 10_000
+
+# Parents before children, so a chunk never refers to rows that are not written yet
+TABLES = [model.__table__ for model in (User, Group, GroupMember, Prediction, Vote, Backing, Comment, CommentVote, ActivityBucket)]
+# Tables whose ids are generated here rather than drawn from their sequence
+EXPLICIT_IDS = ((User, "user_id"), (Group, "group_id"), (Prediction, "prediction_id"), (Comment, "comment_id"))
+
+
+class Zipf:
+    """Draws ids 1..n with Zipfian popularity; the seed decides which ids are popular."""
+
+    def __init__(self, rng: random.Random, n: int, exponent: float = ZIPF_EXPONENT):
+        self.rng = rng
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self.cumulative = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+        total = self.cumulative[-1]
+        self.shares = [0.0] * (n + 1)  # Indexed by id
+        for rank, item_id in enumerate(self.ids, start=1):
+            self.shares[item_id] = 1 / rank ** exponent / total
+
+    def draw(self) -> int:
+        return self.ids[bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+    def allocate(self, total: int, cap: int) -> array:
+        """Split `total` over the ids in proportion to their popularity, at most `cap` each."""
+        counts = array("l", [0]) * len(self.shares)
+        for item_id in range(1, len(self.shares)):
+            expected = total * self.shares[item_id]
+            whole = int(expected)
+            counts[item_id] = min(cap, whole + (self.rng.random() < expected - whole))
+        return counts
+
+
+class Timeline:
+    """Bursty timestamps over SPAN, ending now."""
+
+    def __init__(self, rng: random.Random, now: datetime):
+        self.rng = rng
+        self.now = now.timestamp()
+        self.start = self.now - SPAN.total_seconds()
+        self.bursts = sorted(rng.uniform(self.start, self.now) for _ in range(BURSTS))
+        self.burst_popularity = Zipf(rng, BURSTS)
+
+    def draw(self) -> float:
+        if self.rng.random() < BURST_SHARE:
+            centre = self.bursts[self.burst_popularity.draw() - 1]
+            moment = centre + self.rng.expovariate(1 / BURST_LENGTH.total_seconds())
+        else:
+            moment = self.rng.uniform(self.start, self.now)
+        return min(moment, self.now)
+
+    def after(self, moment: float) -> float:
+        """A reaction to something that happened at `moment`."""
+        return min(self.now, moment + self.rng.expovariate(1 / REACTION_DELAY.total_seconds()))
+
+
+class Loader:
+    """Buffers rows per table and writes them in chunks."""
+
+    def __init__(self, db: Session, chunk_size: int = CHUNK_SIZE):
+        self.connection = db.connection()
+        self.copy = self.connection.dialect.name == "postgresql"
+        self.chunk_size = chunk_size
+        self.buffers: Dict[str, list] = {table.name: [] for table in TABLES}
+        self.counts = Counter()
+
+    def add(self, table, row: dict) -> None:
+        buffer = self.buffers[table.name]
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush(table)
+
+    def flush(self, until=None) -> None:
+        """Write `until` and every table it may refer to; with no argument, everything."""
+        for table in TABLES:
+            rows = self.buffers[table.name]
+            if rows:
+                self._write(table, rows)
+                self.counts[table.name] += len(rows)
+                self.buffers[table.name] = []
+            if table is until:
+                return
+
+    def _write(self, table, rows: List[dict]) -> None:
+        if not self.copy:
+            self.connection.execute(insert(table), rows)
+            return
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([_copy_value(table.c[column].type, row[column]) for column in columns])
+        buffer.seek(0)
+        with self.connection.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _copy_value(column_type, value):
+    """`value` as Postgres reads it from CSV; None becomes an unquoted empty field, i.e. NULL."""
+    if value is None:
+        return None
+    if isinstance(column_type, HexDigest):
+        return "\\x" + value
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _scaled(base: int, scale: float, minimum: int) -> int:
+    return max(minimum, round(base * scale))
+
+
+def generate(db: Session, scale: float, seed: int = 42, now: Optional[datetime] = None) -> dict:
+    """Write a dataset of the given scale into the empty database behind `db` and commit.
+
+    Returns the row counts per table, plus `hot_predictions`: the ids of the
+    most commented predictions.
+    """
+    if db.query(User.user_id).first() is not None:
+        raise RuntimeError("The synthetic dataset needs an empty database")
+
+    rng = random.Random(seed)
+    now = now or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    timeline = Timeline(rng, now)
+    loader = Loader(db)
+    user_count = _scaled(USERS, scale, 10)
+    group_count = _scaled(GROUPS, scale, 2)
+    prediction_count = _scaled(PREDICTIONS, scale, 20)
+
+    logger.info("Users and groups")
+    password_hash = get_password_hash(PASSWORD)  # bcrypt is slow on purpose; hash once
+    for user_id in range(1, user_count + 1):
+        loader.add(User.__table__, {
+            "user_id": user_id, "email": f"user{user_id}@example.com", "handle": f"user{user_id}",
+            "password_hash": password_hash, "login_type": LoginType.PASSWORD, "wisdom_level": 0,
+            "created_at": datetime.fromtimestamp(timeline.start + rng.random() * SPAN.total_seconds() / 2),
+        })
+
+    user_activity = Zipf(rng, user_count)
+    group_popularity = Zipf(rng, group_count)
+    for group_id in range(1, group_count + 1):
+        loader.add(Group.__table__, {
+            "group_id": group_id, "name": f"Group {group_id}", "description": "Synthetic group",
+            "visibility": rng.choice(("public", "public", "public", "private")),
+            "created_by": user_activity.draw(), "created_at": datetime.fromtimestamp(timeline.start),
+        })
+
+    member_of: Dict[int, List[int]] = defaultdict(list)
+    for user_id in range(1, user_count + 1):
+        wanted = min(group_count, int(rng.expovariate(1 / MEMBERSHIPS_PER_USER)))
+        groups = set()
+        for _ in range(wanted * 3):  # Popular groups repeat; stop trying eventually
+            if len(groups) == wanted:
+                break
+            groups.add(group_popularity.draw())
+        for group_id in sorted(groups):
+            member_of[user_id].append(group_id)
+            loader.add(GroupMember.__table__, {"group_id": group_id, "user_id": user_id, "role": "member"})
+
+    logger.info("Predictions")
+    # Ids follow time, as they do when predictions are created through the API
+    moments = sorted(timeline.draw() for _ in range(prediction_count))
+    prediction_times = array("d", [0.0]) + array("d", moments)
+    activity_counts = Counter()
+    for prediction_id, moment in enumerate(moments, start=1):
+        author = user_activity.draw()
+        groups = member_of.get(author)
+        group_id = rng.choice(groups) if groups and rng.random() < GROUP_SHARE else None
+        visibility = Visibility.PRIVATE if rng.random() < PRIVATE_SHARE else Visibility.PUBLIC
+        category = CATEGORIES[min(len(CATEGORIES) - 1, int(rng.expovariate(0.5)))]
+        timestamp = datetime.fromtimestamp(moment)
+        loader.add(Prediction.__table__, {
+            "prediction_id": prediction_id, "user_id": author, "group_id": group_id,
+            "title": f"Prediction {prediction_id}", "content": f"Synthetic prediction {prediction_id} in {category}.",
+            "category": category, "visibility": visibility, "allow_backing": rng.random() >= NO_BACKING_SHARE,
+            "timestamp": timestamp, "hash": hashlib.sha256(f"synthetic:{seed}:{prediction_id}".encode()).hexdigest(),
+            "contains_profanity": False,
+        })
+        bucket_start = activity.bucket_for(timestamp, now)
+        if bucket_start is not None:
+            if group_id:
+                activity_counts[(activity.GROUP_PREDICTIONS, str(group_id), bucket_start)] += 1
+            if visibility == Visibility.PUBLIC:
+                activity_counts[(activity.CATEGORY_PREDICTIONS, category, bucket_start)] += 1
+    for (kind, key, bucket_start), count in activity_counts.items():
+        loader.add(ActivityBucket.__table__, {"kind": kind, "key": key, "bucket_start": bucket_start, "count": count})
+
+    # Votes, backings and comments all follow one popularity ranking
+    prediction_popularity = Zipf(rng, prediction_count)
+
+    logger.info("Votes and backings")
+    for prediction_id, voters in enumerate(prediction_popularity.allocate(_scaled(VOTES, scale, 1), user_count)):
+        for user_id in rng.sample(range(1, user_count + 1), voters) if voters else ():
+            loader.add(Vote.__table__, {
+                "prediction_id": prediction_id, "user_id": user_id, "value": 1 if rng.random() < 0.7 else -1,
+                "timestamp": datetime.fromtimestamp(timeline.after(prediction_times[prediction_id])),
+            })
+    for prediction_id, backers in enumerate(prediction_popularity.allocate(_scaled(BACKINGS, scale, 1), user_count)):
+        for user_id in rng.sample(range(1, user_count + 1), backers) if backers else ():
+            loader.add(Backing.__table__, {
+                "prediction_id": prediction_id, "backer_user_id": user_id,
+                "timestamp": datetime.fromtimestamp(timeline.after(prediction_times[prediction_id])),
+            })
+
+    logger.info("Comment threads")
+    comment_id = 0
+    comment_total = _scaled(COMMENTS, scale, 1)
+    comment_counts = prediction_popularity.allocate(comment_total, comment_total)
+    for prediction_id, size in enumerate(comment_counts):
+        if not size:
+            continue
+        latest: List[int] = []
+        paths, depths, times = {}, {}, {}
+        for _ in range(size):
+            comment_id += 1
+            parent_id = None
+            if latest and rng.random() < REPLY_SHARE:
+                parent_id = latest[-1 - min(len(latest) - 1, int(rng.expovariate(0.7)) % REPLY_WINDOW)]
+            paths[comment_id] = comment_threads.path_for(comment_id, paths.get(parent_id, ""))
+            depths[comment_id] = depths[parent_id] + 1 if parent_id else 0
+            times[comment_id] = timeline.after(times[parent_id] if parent_id else prediction_times[prediction_id])
+            latest = (latest + [comment_id])[-REPLY_WINDOW:]
+
+            voter_count = min(user_count, int(rng.paretovariate(COMMENT_VOTE_TAIL)) - 1)
+            voters = rng.sample(range(1, user_count + 1), voter_count) if voter_count else []
+            values = [1 if rng.random() < 0.75 else -1 for _ in voters]
+            upvotes = values.count(1)
+            downvotes = len(values) - upvotes
+            loader.add(Comment.__table__, {
+                "comment_id": comment_id, "prediction_id": prediction_id, "user_id": user_activity.draw(),
+                "parent_comment_id": parent_id, "content": f"Synthetic comment {comment_id}",
+                "timestamp": datetime.fromtimestamp(times[comment_id]),
+                "path": paths[comment_id], "depth": depths[comment_id],
+                "score": upvotes - downvotes, "upvotes": upvotes, "downvotes": downvotes,
+                "wilson_score": comment_threads.wilson_lower_bound(upvotes, downvotes),
+                "controversy_score": comment_threads.controversy(upvotes, downvotes),
+            })
+            for user_id, value in zip(voters, values):
+                loader.add(CommentVote.__table__, {
+                    "comment_id": comment_id, "user_id": user_id, "value": value,
+                    "timestamp": datetime.fromtimestamp(timeline.after(times[comment_id])),
+                })
+    loader.flush()
+
+    logger.info("Counters")
+    _fill_counters(db)
+    db.commit()
+
+    hottest = sorted(range(1, prediction_count + 1), key=lambda prediction_id: -comment_counts[prediction_id])
+    return {**loader.counts, "hot_predictions": [p for p in hottest[:20] if comment_counts[p]]}
+
+
+def _fill_counters(db: Session) -> None:
+    """Set the totals the API maintains on writes, and move id sequences past the generated rows."""
+    db.execute(text("""
+        UPDATE groups SET
+            member_count = (SELECT count(*) FROM group_members WHERE group_members.group_id = groups.group_id),
+            prediction_count = (SELECT count(*) FROM predictions WHERE predictions.group_id = groups.group_id)
+    """))
+    db.execute(text("""
+        UPDATE users SET wisdom_level = (
+            SELECT count(*) FROM backings JOIN predictions ON predictions.prediction_id = backings.prediction_id
+            WHERE predictions.user_id = users.user_id
+        )
+    """))
+    if db.get_bind().dialect.name == "postgresql":
+        for model, key in EXPLICIT_IDS:
+            table = model.__tablename__
+            db.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{key}'), "
+                f"coalesce((SELECT max({key}) FROM {table}), 0) + 1, false)"
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, required=True, help="1 is about 14 million rows")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL")
+    parser.add_argument("--create-tables", action="store_true", help="create the schema first instead of running alembic")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from config import settings
+    from database import Base
+
+    engine = create_engine(args.database_url or settings.database_url)
+    if args.create_tables:
+        Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        started = time.perf_counter()
+        counts = generate(db, args.scale, args.seed)
+        counts.pop("hot_predictions")
+        for table, count in counts.items():
+            print(f"  {table:<16} {count:>12,}")
+        print(f"Generated {sum(counts.values()):,} rows in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Shared fixtures for the backend tests.
+
+The app runs in-process against a throwaway SQLite file filled by
+synthetic_data.py. Set TEST_DATABASE_URL to an empty Postgres database to
+run against the real thing; the tables created there are dropped again at
+the end.
+
+`assert_max_queries(n)` fails the test when the block runs more than `n`
+statements. It empties the per-worker caches first, so the budget covers
+what a cold request does:
+
+    def test_home_feed(client, auth_headers, dataset, assert_max_queries):
+        with assert_max_queries(5):
+            response = client.get("/feed/home", headers=auth_headers(dataset["member"]))
+"""
+import os
+import sys
+import tempfile
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or f"sqlite:///{tempfile.mkstemp(suffix='.db')[1]}"
+os.environ["JWT_SECRET"] = "test"
+os.environ["INVALIDATION_BACKEND"] = "inprocess"
+os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+
+SCALE = 0.001  # 100 users, 1000 predictions, 2000 comments
+SEED = 7
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    """Row counts of the synthetic dataset, plus ids the tests pick from."""
+    import models  # Registers the tables with Base.metadata
+    import synthetic_data
+    from database import Base, SessionLocal, engine
+    from models import GroupMember, Prediction, Visibility
+    from sqlalchemy import event, func
+
+    if engine.dialect.name == "sqlite":
+        # Deletes rely on ON DELETE CASCADE, which SQLite only enforces when asked
+        event.listen(engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+        engine.dispose()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        data = synthetic_data.generate(db, SCALE, SEED)
+        public = {row[0] for row in db.query(Prediction.prediction_id).filter(Prediction.visibility == Visibility.PUBLIC)}
+        data["public"] = sorted(public)
+        data["hot_predictions"] = [p for p in data["hot_predictions"] if p in public]
+        # The member whose groups hold the most predictions, so home feed pages are full
+        data["member"] = db.query(GroupMember.user_id).join(
+            Prediction, Prediction.group_id == GroupMember.group_id
+        ).group_by(GroupMember.user_id).order_by(func.count(Prediction.prediction_id).desc()).limit(1).scalar()
+    finally:
+        db.close()
+    yield data
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="session")
+def client(dataset):
+    """A client for `main.app`, without its startup handlers.
+
+    The outbox processor and the metrics thread would otherwise run
+    statements of their own in the middle of a budget.
+    """
+    from fastapi.testclient import TestClient
+
+    import main
+
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="session")
+def auth_headers():
+    from auth import create_access_token
+
+    def headers(user_id: int) -> dict:
+        token = create_access_token(data={"sub": str(user_id)}, expires_delta=timedelta(hours=1))
+        return {"Authorization": f"Bearer {token}"}
+
+    return headers
+
+
+@pytest.fixture
+def assert_max_queries():
+    import entity_cache
+    import group_directory
+    import memberships
+    import response_cache
+    from query_budget import query_budget
+
+    def budget(max_queries: int):
+        entity_cache.cache.clear()
+        response_cache.cache.clear()
+        group_directory.invalidate()
+        memberships.clear()
+        return query_budget(max_queries)
+
+    return budget
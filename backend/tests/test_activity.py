@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta, timezone
+
+import activity
+
+
+def test_aware_and_naive_moments_share_a_bucket():
+    now = datetime(2026, 10, 19, 13, 30)
+    aware = datetime(2026, 10, 19, 14, 45, tzinfo=timezone(timedelta(hours=2)))  # 12:45 UTC
+    assert activity.bucket_for(aware, now) == activity.bucket_for(datetime(2026, 10, 19, 12, 45), now)
+    assert activity.bucket_for(aware, now.replace(tzinfo=timezone.utc)) == datetime(2026, 10, 19, 12)
+
+
+def test_moments_past_retention_are_not_counted():
+    now = datetime(2026, 10, 19, 13, 30, tzinfo=timezone.utc)
+    assert activity.bucket_for(now - activity.RETENTION - timedelta(hours=1), now) is None
@@ -0,0 +1,202 @@
+"""
+Outbox events from the endpoints through `outbox.processor`.
+
+The test client runs without the app's startup handlers, so no processor
+thread is consuming events; each test drains the outbox itself.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm.attributes import set_committed_value
+
+import activity
+import entity_cache
+import main
+import outbox
+from database import SessionLocal
+from models import Group, GroupMember, OutboxEvent, Prediction
+
+CATEGORY = "outbox-tests"  # Nothing else is counted under it
+
+
+def _counts(group_id: int) -> tuple:
+    """The group's prediction counter, and its activity and the test category's over RETENTION."""
+    db = SessionLocal()
+    try:
+        totals = [
+            db.query(subquery.c.total).scalar() or 0
+            for subquery in (
+                activity.window_totals(db, activity.GROUP_PREDICTIONS, activity.RETENTION, [group_id]),
+                activity.window_totals(db, activity.CATEGORY_PREDICTIONS, activity.RETENTION, [CATEGORY]),
+            )
+        ]
+        return (db.get(Group, group_id).prediction_count, *totals)
+    finally:
+        db.close()
+
+
+def _waiting(kind=None) -> list:
+    """Rows still in the outbox, as (handler, attempts, available_at, last_error)."""
+    db = SessionLocal()
+    try:
+        query = db.query(OutboxEvent.handler, OutboxEvent.attempts, OutboxEvent.available_at, OutboxEvent.last_error)
+        if kind is not None:
+            query = query.filter(OutboxEvent.kind == kind)
+        return query.order_by(OutboxEvent.event_id).all()
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def group_prediction(client, auth_headers, dataset):
+    """A public prediction by the member in one of their groups, counted already, and the counts before it."""
+    db = SessionLocal()
+    try:
+        group_id = db.query(GroupMember.group_id).filter(GroupMember.user_id == dataset["member"]).limit(1).scalar()
+    finally:
+        db.close()
+    outbox.processor.drain()
+    before = _counts(group_id)
+    response = client.post(
+        "/predictions",
+        json={"title": "Outbox", "content": "Counted once", "category": CATEGORY, "visibility": "public", "group_id": group_id},
+        headers=auth_headers(dataset["member"]),
+    )
+    assert response.status_code == 201
+    outbox.processor.drain()
+    assert _counts(group_id) == (before[0] + 1, before[1] + 1, before[2] + 1)
+    return response.json()["prediction_id"], group_id, before
+
+
+def test_delete_takes_the_prediction_back(client, auth_headers, dataset, group_prediction):
+    prediction_id, group_id, before = group_prediction
+    response = client.delete(f"/predictions/{prediction_id}", headers=auth_headers(dataset["member"]))
+    assert response.status_code == 204
+    outbox.processor.drain()
+    assert _counts(group_id) == before
+    assert _waiting() == []
+
+
+def test_delete_with_an_aware_timestamp(group_prediction):
+    # Prediction.timestamp is timestamptz on Postgres, so it loads timezone-aware there
+    prediction_id, group_id, before = group_prediction
+    db = SessionLocal()
+    try:
+        prediction = db.get(Prediction, prediction_id)
+        aware = prediction.timestamp.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=-5)))
+        set_committed_value(prediction, "timestamp", aware)
+        main.add_prediction_deleted(db, prediction)
+        db.query(Prediction).filter(Prediction.prediction_id == prediction_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    outbox.processor.drain()
+    assert _counts(group_id) == before
+    assert _waiting() == []  # Nothing failed and is waiting for a retry
+
+
+def test_vote_and_comment_invalidate_from_their_events(client, auth_headers, dataset, group_prediction, monkeypatch):
+    prediction_id, _, _ = group_prediction
+    headers = auth_headers(dataset["member"])
+    invalidated = []
+    monkeypatch.setattr(entity_cache, "invalidate", lambda kind, entity_id: invalidated.append((kind, entity_id)))
+
+    assert client.post(f"/predictions/{prediction_id}/vote", json={"value": 1}, headers=headers).status_code == 200
+    response = client.post(f"/predictions/{prediction_id}/comments", json={"content": "Outbox"}, headers=headers)
+    assert response.status_code == 201
+    assert invalidated == []  # Not in the request
+    outbox.processor.drain()
+    assert invalidated == [
+        ("prediction", prediction_id), ("comment", response.json()["comment_id"]), ("prediction", prediction_id)
+    ]
+
+    monkeypatch.undo()
+    assert client.delete(f"/predictions/{prediction_id}", headers=headers).status_code == 204
+    outbox.processor.drain()
+
+
+handled = []
+
+
+def _record(delivery: outbox.Delivery) -> None:
+    handled.append(delivery.payload["n"])
+
+
+def _fail(delivery: outbox.Delivery) -> None:
+    raise RuntimeError("handler failed")
+
+
+@pytest.fixture
+def test_event(monkeypatch):
+    """Registers handlers for a `test_event` kind; call with the handlers, then `add` events of it."""
+    monkeypatch.setattr(outbox, "KINDS", outbox.KINDS + ("test_event",))
+    monkeypatch.setitem(outbox._handlers, "test_event", {})
+    handled.clear()
+
+    def register(*handlers):
+        for handler in handlers:
+            outbox.register("test_event", handler)
+
+    yield register
+    db = SessionLocal()
+    try:
+        db.query(OutboxEvent).filter(OutboxEvent.kind == "test_event").delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _add(n: int) -> None:
+    db = SessionLocal()
+    try:
+        outbox.add(db, "test_event", n=n)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _make_due() -> None:
+    db = SessionLocal()
+    try:
+        db.query(OutboxEvent).filter(OutboxEvent.kind == "test_event").update(
+            {OutboxEvent.available_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_failing_handler_does_not_hold_up_the_others(test_event):
+    test_event(_fail, _record)
+    _add(1)
+    _add(2)
+    started = datetime.utcnow()
+    outbox.processor.drain()
+    assert handled == [1, 2]
+
+    waiting = _waiting("test_event")
+    assert [(handler, attempts) for handler, attempts, _, _ in waiting] == [(outbox.handler_name(_fail), 1)] * 2
+    for _, _, available_at, last_error in waiting:
+        assert "handler failed" in last_error
+        assert started + timedelta(seconds=outbox.RETRY_BACKOFF) <= available_at <= datetime.utcnow() + timedelta(
+            seconds=outbox.RETRY_BACKOFF
+        )
+
+
+def test_retries_back_off_until_the_event_is_dead(test_event):
+    test_event(_fail)
+    _add(1)
+    dead = outbox.processor.stats()["dead"]
+    for attempt in range(1, outbox.MAX_ATTEMPTS + 1):
+        _make_due()  # Instead of waiting out the backoff
+        started = datetime.utcnow()
+        outbox.processor.drain()
+        [(_, attempts, available_at, _)] = _waiting("test_event")
+        assert attempts == attempt
+        backoff = timedelta(seconds=outbox.RETRY_BACKOFF * 2 ** (attempt - 1))
+        assert started + backoff <= available_at <= datetime.utcnow() + backoff
+
+    assert outbox.processor.stats()["dead"] == dead + 1
+    _make_due()  # Dead events are left alone all the same
+    assert outbox.processor.drain() == 0
+    assert [attempts for _, attempts, _, _ in _waiting("test_event")] == [outbox.MAX_ATTEMPTS]
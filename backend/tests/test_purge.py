@@ -0,0 +1,119 @@
+"""
+Tombstones: what a deleted entity hides while purge.py removes its rows.
+
+The purges themselves are stubbed out, as if they had not run yet, and run
+by hand with `purge_pending` at the end.
+"""
+import pytest
+from sqlalchemy import select
+
+import activity
+import outbox
+import purge
+from database import SessionLocal
+from models import Comment, Prediction
+
+
+@pytest.fixture
+def thread(client, auth_headers, dataset):
+    """A public prediction with a comment, a reply to it and a reply to that."""
+    headers = auth_headers(dataset["member"])
+    response = client.post(
+        "/predictions", json={"title": "Purge", "content": "Tombstones", "category": "purge-tests", "visibility": "public"},
+        headers=headers,
+    )
+    prediction_id = response.json()["prediction_id"]
+    comment_ids = []
+    for _ in range(3):
+        response = client.post(
+            f"/predictions/{prediction_id}/comments",
+            json={"content": "Reply", "parent_comment_id": comment_ids[-1] if comment_ids else None},
+            headers=headers,
+        )
+        comment_ids.append(response.json()["comment_id"])
+    yield prediction_id, comment_ids
+    client.delete(f"/predictions/{prediction_id}", headers=headers)
+
+
+def test_tombstoned_comment_hides_its_replies(client, auth_headers, dataset, thread, monkeypatch):
+    prediction_id, (comment_id, reply_id, nested_reply_id) = thread
+    monkeypatch.setattr(purge, "PURGE_THRESHOLD", 0)
+    monkeypatch.setattr(purge, "purge_comment", lambda comment_id: None)
+    headers = auth_headers(dataset["member"])
+    assert client.get(f"/predictions/{prediction_id}", headers=headers).json()["comment_count"] == 3
+
+    assert client.delete(f"/comments/{comment_id}", headers=headers).status_code == 204
+    assert client.get(f"/predictions/{prediction_id}", headers=headers).json()["comment_count"] == 0
+    assert client.get(f"/predictions/{prediction_id}/comments/thread").json()["comments"] == []
+    for parent_id in (comment_id, reply_id):
+        assert client.get(f"/predictions/{prediction_id}/comments/thread?parent_id={parent_id}").status_code == 404
+        assert client.get(f"/comments/{parent_id}/thread").status_code == 404
+    assert client.get(f"/comments/{nested_reply_id}/thread").status_code == 404
+
+    monkeypatch.undo()
+    assert purge.purge_pending() == 1  # The subtree is purged once, from its root
+    db = SessionLocal()
+    try:
+        remaining = db.execute(
+            select(Comment.comment_id).where(Comment.prediction_id == prediction_id),
+            execution_options=purge.INCLUDE_DELETED,
+        ).all()
+        assert remaining == []
+    finally:
+        db.close()
+
+
+def _category_activity() -> int:
+    db = SessionLocal()
+    try:
+        totals = activity.window_totals(db, activity.CATEGORY_PREDICTIONS, activity.RETENTION, ["purge-tests"])
+        return db.query(totals.c.total).scalar() or 0
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("tombstoned", [True, False])
+def test_deleted_group_takes_its_predictions_along(client, auth_headers, dataset, monkeypatch, tombstoned):
+    headers = auth_headers(dataset["member"])
+    response = client.post(
+        "/groups", json={"name": f"Purge {tombstoned}", "description": "Gone soon", "visibility": "public"}, headers=headers
+    )
+    group_id = response.json()["group_id"]
+    outbox.processor.drain()
+    before = _category_activity()
+    prediction_ids = [
+        client.post(
+            "/predictions",
+            json={"title": "Purge", "content": "In a group", "category": "purge-tests", "visibility": visibility, "group_id": group_id},
+            headers=headers,
+        ).json()["prediction_id"]
+        for visibility in ("public", "private")
+    ]
+    outbox.processor.drain()
+    assert _category_activity() == before + 1
+    for prediction_id in prediction_ids:  # Cached now
+        assert client.get(f"/predictions/{prediction_id}", headers=headers).status_code == 200
+    assert prediction_ids[0] in [p["prediction_id"] for p in client.get("/predictions?sort=recent", headers=headers).json()["predictions"]]
+
+    if tombstoned:
+        monkeypatch.setattr(purge, "PURGE_THRESHOLD", 0)
+        monkeypatch.setattr(purge, "purge_group", lambda group_id: None)
+    assert client.delete(f"/groups/{group_id}", headers=headers).status_code == 204
+    outbox.processor.drain()
+
+    assert _category_activity() == before
+    for prediction_id in prediction_ids:
+        assert client.get(f"/predictions/{prediction_id}", headers=headers).status_code == 404
+    assert prediction_ids[0] not in [p["prediction_id"] for p in client.get("/predictions?sort=recent", headers=headers).json()["predictions"]]
+
+    monkeypatch.undo()
+    assert purge.purge_pending() == (1 if tombstoned else 0)  # The group, whose purge takes its predictions
+    db = SessionLocal()
+    try:
+        remaining = db.execute(
+            select(Prediction.prediction_id).where(Prediction.prediction_id.in_(prediction_ids)),
+            execution_options=purge.INCLUDE_DELETED,
+        ).all()
+        assert remaining == []
+    finally:
+        db.close()
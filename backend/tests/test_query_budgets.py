@@ -0,0 +1,81 @@
+"""
+Query budgets for the hot endpoints.
+
+Each budget is what the endpoint needs today for a full page on a cold
+worker. Totals, authors and replies are loaded for the whole page at once,
+so the counts do not grow with the page size; an N+1 adds a statement per
+row and fails here. Raise a budget only for a new query that runs once per
+request.
+"""
+import pytest
+
+import comment_threads
+import feed
+
+
+@pytest.mark.parametrize("sort", ["recent", "popular", "controversial"])
+def test_prediction_list(client, assert_max_queries, sort):
+    with assert_max_queries(4):  # Count, page ids, predictions with authors, totals
+        response = client.get(f"/predictions?sort={sort}")
+    assert response.status_code == 200
+    assert len(response.json()["predictions"]) == 20
+
+
+def test_prediction_list_signed_in(client, auth_headers, dataset, assert_max_queries):
+    with assert_max_queries(5):  # And the viewer
+        response = client.get("/predictions", headers=auth_headers(dataset["member"]))
+    assert response.status_code == 200
+    assert len(response.json()["predictions"]) == 20
+
+
+def test_prediction_list_compact(client, assert_max_queries):
+    with assert_max_queries(3):
+        response = client.get("/predictions?shape=compact")
+    assert response.status_code == 200
+
+
+def test_prediction_detail(client, dataset, assert_max_queries):
+    with assert_max_queries(5):  # Prediction, author, three totals
+        response = client.get(f"/predictions/{dataset['hot_predictions'][0]}")
+    assert response.status_code == 200
+
+
+def test_prediction_detail_signed_in(client, auth_headers, dataset, assert_max_queries):
+    with assert_max_queries(8):  # And the viewer, their vote and their backing
+        response = client.get(f"/predictions/{dataset['hot_predictions'][0]}", headers=auth_headers(dataset["member"]))
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("sort", comment_threads.SORTS)
+def test_comment_thread(client, auth_headers, dataset, assert_max_queries, sort):
+    prediction_id = dataset["hot_predictions"][0]
+    # Viewer, prediction, the top-level page and one query per level of replies
+    with assert_max_queries(3 + comment_threads.DEFAULT_REPLY_DEPTH):
+        response = client.get(
+            f"/predictions/{prediction_id}/comments/thread?sort={sort}", headers=auth_headers(dataset["member"])
+        )
+    assert response.status_code == 200
+    assert len(response.json()["comments"]) == comment_threads.DEFAULT_PAGE_SIZE
+
+
+def test_comment_tree(client, auth_headers, dataset, assert_max_queries):
+    # The legacy full tree: viewer, comments with their authors, votes; prediction size does not matter
+    with assert_max_queries(3):
+        response = client.get(
+            f"/predictions/{dataset['hot_predictions'][0]}/comments", headers=auth_headers(dataset["member"])
+        )
+    assert response.status_code == 200
+
+
+def test_home_feed(client, auth_headers, dataset, assert_max_queries):
+    with assert_max_queries(5):  # Viewer, memberships, page ids, predictions with authors, totals
+        response = client.get("/feed/home", headers=auth_headers(dataset["member"]))
+    assert response.status_code == 200
+    assert len(response.json()["predictions"]) == feed.DEFAULT_PAGE_SIZE
+
+
+@pytest.mark.parametrize("sort", ["new", "top", "members", "popular"])
+def test_group_directory(client, assert_max_queries, sort):
+    with assert_max_queries(1):
+        response = client.get(f"/groups?sort={sort}")
+    assert response.status_code == 200